@@ -0,0 +1,65 @@
+"""Compare building the outbound `messages` payload from scratch with the incremental payload.
+
+Simulates a long session where every turn sends the whole conversation, and reports the time
+spent building the payload for the last turn. `sanitize_messages_for_request` is the former
+`utils` helper that walked the history on every request; the store now keeps the payload as a
+tuple updated when messages are added. Run from the repo root:
+
+    python benchmarks/request_payload.py --turns 50 200 1000
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from conversation import ConversationStore  # noqa: E402
+
+# Every tenth answer fails and drops its prompt from the payload
+FAILURE_RATE = 10
+
+
+def sanitize_messages_for_request(messages):
+    """Strips meta_id and any invalid fields from the messages, otherwise OpenAI will fail due to schema mismatch"""
+    sanitized_messages = []
+    for i, message in enumerate(messages):
+        if message["content"] is None:
+            if i > 0 and messages[i - 1]["meta_id"] == message["meta_id"]:
+                sanitized_messages.pop()
+            continue
+
+        sanitized_messages.append({"role": message["role"], "content": message["content"]})
+
+    return sanitized_messages
+
+
+def build_conversation(turns: int) -> ConversationStore:
+    store = ConversationStore()
+    store.add_system_message("You are a helpful assistant.")
+    for index in range(turns):
+        store.add_prompt(f"turn-{index}", f"Question number {index} " * 5, {})
+        answer = None if index % FAILURE_RATE == FAILURE_RATE - 1 else f"Answer number {index} " * 20
+        store.add_answer(f"turn-{index}", answer)
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'turns':>6} {'sanitize (us)':>14} {'incremental (us)':>17}")
+    for turns in args.turns:
+        store = build_conversation(turns)
+        assert list(store.request_messages) == sanitize_messages_for_request(store.messages)
+
+        sanitize = timeit.timeit(lambda store=store: sanitize_messages_for_request(store.messages), number=args.repeat)
+        incremental = timeit.timeit(lambda store=store: store.request_messages, number=args.repeat)
+        print(f"{turns:>6} {sanitize / args.repeat * 1e6:>14.1f} {incremental / args.repeat * 1e6:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
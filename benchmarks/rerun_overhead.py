@@ -0,0 +1,112 @@
+"""Measure the wall time of a steady-state rerun of the app.
+
+The DataRobot API is mocked, so the numbers show the app's own per-rerun overhead: session
+setup, configuration parsing and rendering, without any network latency. Run from the repo root:
+
+    python benchmarks/rerun_overhead.py --reruns 200
+
+`--mode uncached` restores the behaviour before the client and configuration were cached: a new
+DataRobot client (with its /version/ API call) and a freshly parsed Config on every rerun, and
+the session setup run again each time. The default runs both modes one after the other.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from unittest.mock import patch
+
+import responses
+from streamlit.testing.v1 import AppTest
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+ENDPOINT = "https://benchmark.datarobot.com/api/v2"
+DEPLOYMENT_ID = "benchmark_deployment"
+APP_ID = "benchmark_app"
+
+
+def mock_datarobot_api(mock: responses.RequestsMock) -> None:
+    deployment_url = f"{ENDPOINT}/deployments/{DEPLOYMENT_ID}"
+    mock.get(f"{ENDPOINT}/version/", json={"major": 2, "minor": 34, "versionString": "2.34.0"})
+    mock.get(f"{ENDPOINT}/customApplications/{APP_ID}/", json={"id": APP_ID, "name": "Benchmark"})
+    mock.get(
+        f"{deployment_url}/",
+        json={
+            "id": DEPLOYMENT_ID,
+            "label": "Benchmark",
+            "model": {"id": "model", "targetName": "resultText", "targetType": "TextGeneration"},
+        },
+    )
+    mock.get(f"{deployment_url}/settings/", json={"associationId": {"columnNames": ["association_id"]}})
+    mock.get(f"{deployment_url}/capabilities/", json={"data": [{"name": "supports_chat_api", "supported": True}]})
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(reruns: int, uncached: bool) -> tuple[list[float], int]:
+    """Time `reruns` steady-state reruns and count the DataRobot API calls they make."""
+    import config
+    import utils
+
+    # Start from empty caches, so both modes see the same first run
+    config._load_config.cache_clear()
+    utils._create_datarobot_client.cache_clear()
+
+    with ExitStack() as stack:
+        mock = stack.enter_context(responses.RequestsMock(assert_all_requests_are_fired=False))
+        mock_datarobot_api(mock)
+        if uncached:
+            # The undecorated functions build a new Config and Client on every call
+            stack.enter_context(patch.object(config, "_load_config", config._load_config.__wrapped__))
+            stack.enter_context(
+                patch.object(utils, "_create_datarobot_client", utils._create_datarobot_client.__wrapped__)
+            )
+
+        at = AppTest.from_file("qa_chat_bot.py").run(timeout=30)
+        assert not at.exception, at.exception
+        mock.calls.reset()
+
+        timings = []
+        for _ in range(reruns):
+            if uncached:
+                del at.session_state["session_initialized"]
+            start = time.perf_counter()
+            at.run(timeout=30)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return timings, len(mock.calls)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reruns", type=int, default=100)
+    parser.add_argument("--mode", choices=["uncached", "cached", "both"], default="both")
+    args = parser.parse_args()
+
+    os.environ.update(
+        DATAROBOT_API_TOKEN="benchmark-token",
+        DATAROBOT_ENDPOINT=ENDPOINT,
+        DEPLOYMENT_ID=DEPLOYMENT_ID,
+        APPLICATION_ID=APP_ID,
+        ENABLE_CHAT_API="true",
+    )
+    # The app imports its modules relative to src/, as it does when started with `streamlit run`
+    os.chdir(SRC_DIR)
+    sys.path.insert(0, str(SRC_DIR))
+
+    modes = ["uncached", "cached"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        timings, api_calls = measure(args.reruns, uncached=mode == "uncached")
+        print(f"{mode}: {len(timings)} reruns, DataRobot API calls: {api_calls}")
+        print(f"  mean {statistics.mean(timings):7.2f} ms")
+        print(f"  p50  {percentile(timings, 0.5):7.2f} ms")
+        print(f"  p95  {percentile(timings, 0.95):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
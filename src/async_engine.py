@@ -0,0 +1,134 @@
+"""Shared asyncio engine for streamed LLM answers.
+
+With `USE_ASYNC_ENGINE`, streamed Chat API and LLM Gateway answers are opened and read by one
+event loop, started once per app process in a background thread. The socket reads of every
+session and of every model of a comparison are then multiplexed on that loop, using
+`AsyncOpenAI` and `litellm.acompletion`, instead of each reading its own blocking socket.
+
+The script thread consumes a stream through a `StreamBridge`, a plain iterator fed through a
+thread-safe queue. `st.write_stream`, the circuit breakers, hedging and the Stop button work with
+it as with a synchronous stream. Opening a stream waits until its response headers arrived, so
+retries and fallbacks see the same errors as before. Closing the bridge cancels the read on the
+loop and closes the upstream stream.
+"""
+
+import asyncio
+import inspect
+import logging
+import queue
+import threading
+from collections.abc import AsyncIterable, Awaitable, Iterator
+from concurrent.futures import Future
+from typing import Any
+
+# Marks the end of a stream in the queue of a bridge
+_END = object()
+
+
+class _StreamError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def _aclose(stream: Any) -> None:
+    """Close an AsyncOpenAI or LiteLLM stream, or an async generator, on the loop."""
+    # LiteLLM wraps the stream of the provider SDK and has no `close()` of its own
+    for candidate in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(candidate, "aclose", None) or getattr(candidate, "close", None)
+        if callable(close):
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as exc:
+                logging.warning("Failed to close the LLM stream: %s", exc)
+            return
+
+
+class StreamBridge:
+    """An iterator over the chunks of an async stream that is read on the engine loop."""
+
+    def __init__(self, engine: "AsyncEngine"):
+        self._engine = engine
+        self._chunks: queue.SimpleQueue = queue.SimpleQueue()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    async def _open(self, open_stream: Awaitable[AsyncIterable[Any]]) -> None:
+        stream = await open_stream
+        self._task = asyncio.get_running_loop().create_task(self._read(stream))
+        # The loop only keeps a weak reference to its tasks
+        self._engine._tasks.add(self._task)
+        self._task.add_done_callback(self._engine._tasks.discard)
+
+    async def _read(self, stream: AsyncIterable[Any]) -> None:
+        try:
+            async for chunk in stream:
+                self._chunks.put(chunk)
+        except Exception as exc:
+            self._chunks.put(_StreamError(exc))
+        finally:
+            # Also ends the iteration of a bridge that was closed while it was waiting
+            self._chunks.put(_END)
+            await _aclose(stream)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        if self._closed:
+            raise StopIteration
+        chunk = self._chunks.get()
+        if chunk is _END:
+            self._closed = True
+            raise StopIteration
+        if isinstance(chunk, _StreamError):
+            self._closed = True
+            raise chunk.error
+        return chunk
+
+    def close(self) -> None:
+        """Stop reading the stream and close it. Chunks that were not read yet are dropped."""
+        self._closed = True
+        if self._task is not None:
+            self._engine.loop.call_soon_threadsafe(self._task.cancel)
+
+
+class AsyncEngine:
+    """One event loop in a daemon thread, shared by all sessions. It is started on first use."""
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="async-engine", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coroutine: Awaitable[Any]) -> Future:
+        """Run a coroutine on the loop, returns a future that can be waited for from any thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Awaitable[Any], timeout: float | None = None) -> Any:
+        """Run a coroutine on the loop and wait for its result. Never call it from the loop itself."""
+        return self.submit(coroutine).result(timeout)
+
+    def stream(self, open_stream: Awaitable[AsyncIterable[Any]]) -> StreamBridge:
+        """Open an async stream on the loop and return a bridge to iterate it from the calling thread.
+
+        `open_stream` is awaited on the loop, e.g. `client.chat.completions.create(stream=True)` of
+        an `AsyncOpenAI` client. Errors raised while opening the stream are raised here.
+        """
+        bridge = StreamBridge(self)
+        self.run(bridge._open(open_stream))
+        return bridge
+
+
+async_engine = AsyncEngine()
@@ -0,0 +1,284 @@
+"""Bulk scoring of many prompts through the Prediction API.
+
+Prompts are read from a CSV or JSONL source, packed into request bodies below the Prediction API
+size limit and scored concurrently by a bounded worker pool. Results are handed back chunk by
+chunk as they complete, so a large job never holds every row in memory.
+
+Besides the sidebar in the app, jobs can be run from the command line:
+
+    python bulk.py prompts.csv --output results.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import tempfile
+import uuid
+import weakref
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TextIO
+
+import pandas as pd
+from datarobot import Client, Deployment
+
+from config import get_config
+from constants import (
+    BULK_CHUNK_MAX_BYTES,
+    BULK_CHUNK_MAX_ROWS,
+    BULK_MAX_WORKERS,
+    BULK_PROMPT_FIELD,
+    DEFAULT_PROMPT_COLUMN_NAME,
+    DEFAULT_RESULT_COLUMN_NAME,
+)
+from predictions import PredictionClient, decode_csv, get_prediction_client
+from utils import process_llm_context_citations
+
+RESULT_COLUMNS = [
+    "row_index",
+    "association_id",
+    "prompt",
+    "answer",
+    "citations",
+    "datarobot_latency",
+    "datarobot_token_count",
+    "datarobot_confidence_score",
+    "error",
+]
+
+
+@dataclass
+class BulkChunk:
+    """A batch of prompts encoded as a single Prediction API request body."""
+
+    start_index: int
+    body: bytes
+    prompts: list[str] = field(default_factory=list)
+    association_ids: list[str | None] = field(default_factory=list)
+
+
+class BulkResultsFile:
+    """Temporary CSV file that holds the results of a bulk job, so they are not kept in memory.
+
+    The file is removed by `remove`, or at the latest once the object is garbage collected with
+    the session state that refers to it.
+    """
+
+    def __init__(self):
+        with tempfile.NamedTemporaryFile(prefix="bulk_results_", suffix=".csv", delete=False) as file:
+            self.path = file.name
+        self._finalizer = weakref.finalize(self, Path(self.path).unlink, missing_ok=True)
+
+    def remove(self) -> None:
+        self._finalizer()
+
+
+def read_prompts(source: Iterable[str], file_format: str) -> Iterator[str]:
+    """Yield prompts from the lines of a CSV or JSONL file. Each row needs a `prompt` field."""
+    if file_format == "csv":
+        rows = csv.DictReader(source)
+    elif file_format == "jsonl":
+        rows = (json.loads(line) for line in source if line.strip())
+    else:
+        raise ValueError(f"Unsupported bulk input format: {file_format}")
+
+    for row_index, row in enumerate(rows):
+        if row.get(BULK_PROMPT_FIELD) is None:
+            raise ValueError(f"Row {row_index} has no `{BULK_PROMPT_FIELD}` field")
+        yield str(row[BULK_PROMPT_FIELD])
+
+
+def _encode_csv_line(values: list[str]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue().encode("utf-8")
+
+
+def chunk_prompts(
+    prompts: Iterable[str],
+    prompt_column: str,
+    association_id_column: str | None = None,
+    max_bytes: int = BULK_CHUNK_MAX_BYTES,
+    max_rows: int = BULK_CHUNK_MAX_ROWS,
+) -> Iterator[BulkChunk]:
+    """Pack prompts into CSV request bodies of at most `max_bytes` and `max_rows`.
+
+    A prompt that does not fit on its own is still emitted as a single-row chunk, so the
+    Prediction API size check reports it as an error for that row only.
+    """
+    columns = [association_id_column, prompt_column] if association_id_column else [prompt_column]
+    header = _encode_csv_line(columns)
+    chunk = BulkChunk(start_index=0, body=header)
+    lines = []
+    size = len(header)
+
+    for index, prompt in enumerate(prompts):
+        association_id = str(uuid.uuid4()) if association_id_column else None
+        # Force prompt to be string using quotes, same as for single predictions
+        values = [association_id, f"'{prompt}'"] if association_id_column else [f"'{prompt}'"]
+        line = _encode_csv_line(values)
+
+        if lines and (size + len(line) > max_bytes or len(lines) >= max_rows):
+            chunk.body = b"".join([header, *lines])
+            yield chunk
+            chunk = BulkChunk(start_index=index, body=header)
+            lines = []
+            size = len(header)
+
+        lines.append(line)
+        size += len(line)
+        chunk.prompts.append(prompt)
+        chunk.association_ids.append(association_id)
+
+    if lines:
+        chunk.body = b"".join([header, *lines])
+        yield chunk
+
+
+def extract_citations(df: pd.DataFrame) -> list[list[dict[str, Any]]]:
+    """Extract the citations of every row of a prediction result frame.
+
+    Works column-wise on the `CITATION_*` columns instead of building a dict per row, and falls
+    back to the `_LLM_CONTEXT` column when the deployment does not return citation columns.
+    """
+    content_columns = [column for column in df.columns if column.startswith("CITATION_CONTENT_")]
+    if not content_columns:
+        if "_LLM_CONTEXT" in df.columns:
+            return [
+                process_llm_context_citations(value) if isinstance(value, str) else [] for value in df["_LLM_CONTEXT"]
+            ]
+        return [[] for _ in range(len(df))]
+
+    indices = sorted(int(column.removeprefix("CITATION_CONTENT_")) for column in content_columns)
+
+    def citation_values(prefix):
+        frame = df.reindex(columns=[f"{prefix}{i}" for i in indices]).astype(object)
+        return frame.where(frame.notna(), None).to_numpy()
+
+    contents = citation_values("CITATION_CONTENT_")
+    sources = citation_values("CITATION_SOURCE_")
+    pages = citation_values("CITATION_PAGE_")
+    return [
+        [
+            {"text": text, "source": source, "page": page}
+            for text, source, page in zip(row_texts, row_sources, row_pages, strict=True)
+        ]
+        for row_texts, row_sources, row_pages in zip(contents, sources, pages, strict=True)
+    ]
+
+
+def _score_chunk(client: PredictionClient, chunk: BulkChunk, result_column: str) -> pd.DataFrame:
+    result = pd.DataFrame(
+        {
+            "row_index": range(chunk.start_index, chunk.start_index + len(chunk.prompts)),
+            "association_id": chunk.association_ids,
+            "prompt": chunk.prompts,
+        }
+    )
+    try:
+        # Decoded like single predictions, so an answer such as "42" or "NA" is kept verbatim
+        rows = decode_csv(client.send(chunk.body), text_columns={result_column})
+        df = pd.DataFrame(rows, dtype=object)
+        result["answer"] = df[result_column].to_numpy()
+        result["citations"] = [json.dumps(citations, default=str) for citations in extract_citations(df)]
+        extra_columns = {column: df[column].to_numpy() for column in RESULT_COLUMNS if column in df.columns}
+    except Exception as exc:
+        logging.error(exc)
+        return result.reindex(columns=RESULT_COLUMNS).assign(error=str(exc))
+
+    return result.assign(**extra_columns).reindex(columns=RESULT_COLUMNS)
+
+
+def score_chunks(
+    client: PredictionClient,
+    chunks: Iterable[BulkChunk],
+    result_column: str,
+    max_workers: int = BULK_MAX_WORKERS,
+) -> Iterator[pd.DataFrame]:
+    """Score chunks concurrently and yield a result frame per chunk as soon as it completes.
+
+    At most `2 * max_workers` chunks are in flight, which bounds memory for arbitrarily long inputs.
+    Result frames are yielded in completion order; use `row_index` to restore the input order.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk-scoring") as executor:
+        pending: set[Future] = set()
+        for chunk in chunks:
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+            pending.add(executor.submit(_score_chunk, client, chunk, result_column))
+
+        yield from (future.result() for future in as_completed(pending))
+
+
+def run_bulk_job(
+    client: PredictionClient,
+    prompts: Iterable[str],
+    output: TextIO,
+    prompt_column: str,
+    result_column: str,
+    association_id_column: str | None = None,
+    max_workers: int = BULK_MAX_WORKERS,
+    max_chunk_rows: int = BULK_CHUNK_MAX_ROWS,
+    on_progress: Callable[[int], None] | None = None,
+) -> int:
+    """Score all prompts and stream the results as CSV to `output`. Returns the number of rows written."""
+    chunks = chunk_prompts(prompts, prompt_column, association_id_column, max_rows=max_chunk_rows)
+    rows_written = 0
+    for frame in score_chunks(client, chunks, result_column, max_workers):
+        frame.to_csv(output, header=rows_written == 0, index=False)
+        rows_written += len(frame)
+        if on_progress:
+            on_progress(rows_written)
+    return rows_written
+
+
+def get_bulk_columns(deployment: Deployment) -> tuple[str, str, str | None]:
+    """Return the prompt, result and association ID column names of a deployment."""
+    association_id_names = deployment.get_association_id_settings().get("column_names")
+    return (
+        deployment.model.get("prompt", DEFAULT_PROMPT_COLUMN_NAME),
+        deployment.model.get("target_name", DEFAULT_RESULT_COLUMN_NAME),
+        association_id_names[0] if association_id_names else None,
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Score a CSV or JSONL file of prompts against DEPLOYMENT_ID.")
+    parser.add_argument("input", help=f"CSV or JSONL file with a `{BULK_PROMPT_FIELD}` field per row")
+    parser.add_argument("--output", required=True, help="CSV file to write the results to")
+    parser.add_argument("--workers", type=int, default=BULK_MAX_WORKERS, help="Number of concurrent requests")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    # Reads DATAROBOT_API_TOKEN and DATAROBOT_ENDPOINT automatically
+    dr = Client()
+    # Bulk jobs are scored by the primary deployment of DEPLOYMENT_ID
+    deployment = Deployment.get(get_config().deployment_ids[0])
+    prompt_column, result_column, association_id_column = get_bulk_columns(deployment)
+    client = get_prediction_client(deployment, dr.endpoint, dr.token)
+    file_format = "jsonl" if args.input.endswith(".jsonl") else "csv"
+
+    with (
+        open(args.input, newline="", encoding="utf-8") as source,
+        open(args.output, "w", newline="", encoding="utf-8") as output,
+    ):
+        rows_written = run_bulk_job(
+            client,
+            read_prompts(source, file_format),
+            output,
+            prompt_column,
+            result_column,
+            association_id_column,
+            max_workers=args.workers,
+            on_progress=lambda count: logging.info("Scored %d rows", count),
+        )
+    logging.info("Wrote %d rows to %s", rows_written, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Process-wide caches for DataRobot metadata.
+
+Unlike `st.cache_data`, entries are keyed explicitly by the caller, hold the loaded objects as
+they are (no pickling on every hit) and expire. An expired entry is still served for a while
+after its TTL while a background thread reloads it, so a slow DataRobot API never blocks a rerun
+for data the app already has.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from constants import (
+    METADATA_CACHE_MAX_ENTRIES,
+    METADATA_CACHE_REFRESH_WORKERS,
+    METADATA_CACHE_STALE_SECONDS,
+    METADATA_CACHE_TTL_SECONDS,
+)
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    # Served as a hit until `expires_at`, then served stale while it is refreshed until `stale_until`
+    expires_at: float
+    stale_until: float
+    # True for a placeholder stored after a failed load, see `TTLCache.get(error_ttl_seconds=...)`
+    is_error: bool = False
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+    evictions: int = 0
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTLs and stale-while-revalidate refresh.
+
+    Concurrent misses for the same key share a single load. Exceptions raised by the loader are
+    not cached unless the caller asks for negative caching, they propagate to every caller waiting
+    on that load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float = METADATA_CACHE_TTL_SECONDS,
+        stale_seconds: float = METADATA_CACHE_STALE_SECONDS,
+        max_entries: int = METADATA_CACHE_MAX_ENTRIES,
+        refresh_workers: int = METADATA_CACHE_REFRESH_WORKERS,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._loads: dict[Hashable, Future] = {}
+        self._refresh_workers = refresh_workers
+        self._executor: ThreadPoolExecutor | None = None
+
+    def get(
+        self,
+        key: Hashable,
+        loader: Callable[[], Any],
+        ttl_seconds: float | None = None,
+        error_value: Any = None,
+        error_ttl_seconds: float | None = None,
+    ) -> Any:
+        """Return the cached value for `key`, calling `loader` to load it on a miss.
+
+        `ttl_seconds` overrides the cache TTL for the entry stored by this call. When
+        `error_ttl_seconds` is set, a failed load stores and returns `error_value` for that long
+        instead of raising, and is then retried in the background like any other expired entry.
+        A failed refresh of a good value keeps serving it and is retried after `error_ttl_seconds`.
+        """
+        options = (ttl_seconds, error_value, error_ttl_seconds)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now < entry.expires_at:
+                    self.stats.hits += 1
+                else:
+                    self.stats.stale_hits += 1
+                    if key not in self._loads:
+                        self.stats.refreshes += 1
+                        future = self._loads[key] = Future()
+                        self._get_executor().submit(self._load, key, loader, options, future, True)
+                return entry.value
+
+            self.stats.misses += 1
+            # Concurrent misses wait for the load that is already running for this key
+            future = self._loads.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = self._loads[key] = Future()
+
+        if is_loader:
+            self._load(key, loader, options, future, False)
+        return future.result()
+
+    def invalidate(self, key: Hashable | None = None) -> None:
+        """Drop one entry, or every entry when no key is given.
+
+        Loads that are still in flight for the dropped keys finish, but their results are not stored.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._loads.clear()
+            else:
+                self._entries.pop(key, None)
+                self._loads.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], options: tuple, future: Future, is_refresh: bool) -> None:
+        ttl_seconds, error_value, error_ttl_seconds = options
+        try:
+            value = loader()
+        except Exception as exc:
+            with self._lock:
+                is_current = self._finish_load(key, future)
+                if is_refresh:
+                    self.stats.refresh_errors += 1
+                    logging.warning("Failed to refresh %s cache entry %s: %s", self.name, key, exc)
+                if error_ttl_seconds is None or not is_current:
+                    future.set_exception(exc)
+                    return
+
+                entry = self._entries.get(key)
+                now = time.monotonic()
+                if is_refresh and entry is not None and not entry.is_error:
+                    # Keep serving the stale value until the stale window runs out, retry a bit later
+                    entry.expires_at = min(now + error_ttl_seconds, entry.stale_until)
+                    future.set_result(entry.value)
+                    return
+                expires_at = now + error_ttl_seconds
+                self._store(key, CacheEntry(error_value, expires_at, expires_at + self.stale_seconds, is_error=True))
+            future.set_result(error_value)
+            return
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self._finish_load(key, future):
+                self._store(key, CacheEntry(value, now + ttl, now + ttl + self.stale_seconds))
+        future.set_result(value)
+
+    def _finish_load(self, key: Hashable, future: Future) -> bool:
+        # Called with the lock held. False if the key was invalidated while it was loading.
+        if self._loads.get(key) is not future:
+            return False
+        del self._loads[key]
+        return True
+
+    def _store(self, key: Hashable, entry: CacheEntry) -> None:
+        # Called with the lock held
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._refresh_workers, thread_name_prefix=f"{self.name}-cache-refresh"
+            )
+        return self._executor
+
+
+# Deployment, application and custom metric metadata shared by all sessions in the app process
+metadata_cache = TTLCache("metadata")
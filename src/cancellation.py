@@ -0,0 +1,156 @@
+"""Stopping an answer while it is being generated.
+
+The Stop button is rendered outside of any fragment, so a click makes Streamlit interrupt the
+running script at its next yield point, which is any `st.*` call or session state access. The send
+functions register the request they are waiting for with `track_in_flight`, which aborts it as soon
+as the script is interrupted: the stream is closed and the sockets of its `transport.AbortScope` are
+shut down, which frees the upstream connection right away. The Stop button callback,
+`cancel_generation`, then completes the prompt with the partial answer received so far.
+
+Blocking requests are sent from a thread of their own by `run_interruptibly`, so the script is not
+stuck in a socket read while the user waits. There is no shared pool, so requests of other
+sessions never queue behind each other. When the wait is interrupted, the request is aborted the
+same way. Requests coalesced with other sessions are never aborted, they complete in the background
+and their result is discarded.
+"""
+
+import logging
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+from functools import partial
+from typing import Any
+
+import streamlit as st
+
+from constants import LLM_REQUEST_POLL_SECONDS, STATUS_CANCELLED
+from streaming import StreamCollector
+from transport import AbortScope, abortable
+from utils import set_result_message_state
+
+
+def close_stream(stream: Any) -> None:
+    """Close an OpenAI or LiteLLM stream, which releases its HTTP connection."""
+    # LiteLLM wraps the stream of the provider SDK and has no `close()` of its own
+    for candidate in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(candidate, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as exc:
+                logging.warning("Failed to close the LLM stream: %s", exc)
+            return
+
+
+class InFlightRequest:
+    """The request a session is waiting for.
+
+    Send its requests and read its stream within `scope`, so `close` can abort them. `on_cancel` is
+    called by `cancel_generation` once the request is closed, e.g. to keep the partial answers of a
+    model comparison.
+    """
+
+    def __init__(
+        self,
+        meta_id: str,
+        collector: StreamCollector | None = None,
+        on_cancel: Callable[[], None] | None = None,
+    ):
+        self.meta_id = meta_id
+        self.collector = collector
+        self.on_cancel = on_cancel
+        self.stream: Any = None
+        self.scope = AbortScope()
+
+    @property
+    def partial_answer(self) -> str | None:
+        return self.collector.text if self.collector is not None else None
+
+    def close(self) -> None:
+        # Wakes the threads still reading the stream or waiting for a response
+        self.scope.abort()
+        if self.stream is not None:
+            close_stream(self.stream)
+            self.stream = None
+
+
+@contextmanager
+def track_in_flight(
+    meta_id: str,
+    collector: StreamCollector | None = None,
+    on_cancel: Callable[[], None] | None = None,
+) -> Iterator[InFlightRequest]:
+    """Register the request of a prompt, so the Stop button can cancel it. Set `stream` once it is open."""
+    request = InFlightRequest(meta_id, collector, on_cancel)
+    st.session_state.in_flight_request = request
+    try:
+        yield request
+    except BaseException:
+        # Interrupted or failed: free the upstream connection right away. The request stays
+        # registered, so `cancel_generation` can still read the partial answer.
+        request.close()
+        raise
+    request.close()
+    st.session_state.in_flight_request = None
+
+
+def _start_thread(send: Callable[[], Any]) -> Future:
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def _run():
+        try:
+            future.set_result(send())
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=_run, name="llm-request", daemon=True).start()
+    return future
+
+
+def _send_within(scope: AbortScope, send: Callable[[], Any]) -> Any:
+    with abortable(scope):
+        return send()
+
+
+def run_interruptibly(
+    send: Callable[[], Any],
+    discard: Callable[[Any], None] | None = None,
+    scope: AbortScope | None = None,
+) -> Any:
+    """Call `send` in a new daemon thread and wait for it, letting Streamlit interrupt the wait.
+
+    `send` starts right away, so the total deadline of its retries also covers the wait. If the wait
+    is interrupted, `discard` is called with the result if it still arrives, e.g. to close a stream.
+    With `scope`, `send` runs within it and an interrupted wait also aborts its requests.
+    """
+    future = _start_thread(send if scope is None else partial(_send_within, scope, send))
+    try:
+        while True:
+            try:
+                return future.result(timeout=LLM_REQUEST_POLL_SECONDS)
+            except TimeoutError:
+                # Session state access is a yield point, Streamlit raises here when the user clicked Stop
+                st.session_state.get("in_flight_request")
+    except BaseException:
+        if scope is not None:
+            scope.abort()
+        if discard is not None:
+            future.add_done_callback(lambda done: discard(done.result()) if done.exception() is None else None)
+        raise
+
+
+def cancel_generation(meta_id: str) -> None:
+    """Stop button callback: abort the upstream request and keep the partial answer."""
+    request = st.session_state.get("in_flight_request")
+    partial_answer = None
+    if request is not None and request.meta_id == meta_id:
+        request.close()
+        partial_answer = request.partial_answer
+        if request.on_cancel is not None:
+            request.on_cancel()
+        st.session_state.in_flight_request = None
+
+    if st.session_state.pending_message_id == meta_id:
+        set_result_message_state(meta_id, partial_answer or None, STATUS_CANCELLED)
@@ -0,0 +1,309 @@
+"""Circuit breakers for the LLM backends.
+
+Every deployment and LLM Gateway model gets a process-wide breaker, shared by all sessions. It
+keeps the outcomes and latencies of the requests of the last `CIRCUIT_BREAKER_WINDOW_SECONDS`.
+Once at least `CIRCUIT_BREAKER_MIN_REQUESTS` requests were sent and the share of failures reaches
+`CIRCUIT_BREAKER_ERROR_RATE`, the breaker opens. New prompts then fail right away with a
+`CircuitOpenError` instead of waiting for the timeouts of a degraded backend.
+
+After `CIRCUIT_BREAKER_OPEN_SECONDS`, the breaker lets a single probe request through
+(half-open). It closes if the probe succeeds and opens again if it fails.
+
+Whether a request was admitted or rejected is reported to the `on_decision` callback of `call`
+and `call_stream`, together with the stats of the breaker, so it can be shown with the answer.
+
+Failures are connection errors, timeouts and 408/429/5xx responses. Other client errors, such as
+a rejected prompt, say nothing about the health of the backend. With
+`CIRCUIT_BREAKER_SLOW_CALL_SECONDS` set, requests slower than that count as failures too.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from config import get_config
+from constants import CIRCUIT_BREAKER_WINDOW_SECONDS, LLM_RETRY_STATUS_CODES
+from request_timing import percentile
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a backend whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in_seconds: float | None):
+        if retry_in_seconds is None:
+            message = f"{name} is recovering from errors. Please try again in a moment."
+        else:
+            message = f"{name} is failing, requests are paused. Please try again in {math.ceil(retry_in_seconds)}s."
+        super().__init__(message)
+        self.retry_in_seconds = retry_in_seconds
+
+
+@dataclass
+class CircuitBreakerStats:
+    state: str
+    # Requests and failures within the window
+    requests: int
+    failures: int
+    error_rate: float
+    latency_p95: float | None
+    # Requests rejected while the breaker was open, since the app started
+    rejected: int
+    times_opened: int
+
+
+@dataclass
+class CircuitBreakerDecision:
+    breaker: str
+    admitted: bool
+    # Why the breaker opened, while it is open or half-open
+    reason: str | None
+    stats: CircuitBreakerStats
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Return whether an error tells that the backend is unhealthy."""
+    status_code = getattr(exc, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500 or status_code in LLM_RETRY_STATUS_CODES
+    # Connection errors, timeouts and errors that carry no status
+    return True
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker of one backend."""
+
+    def __init__(
+        self,
+        name: str,
+        error_rate_threshold: float,
+        min_requests: int,
+        open_seconds: float,
+        slow_call_seconds: float | None = None,
+        window_seconds: float = CIRCUIT_BREAKER_WINDOW_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.window_seconds = window_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (finished at, failed, latency) of the requests within the window
+        self._outcomes: deque[tuple[float, bool, float]] = deque()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._open_reason: str | None = None
+        self._probe_in_flight = False
+        self._rejected = 0
+        self._times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def acquire(self, on_decision: Callable[[CircuitBreakerDecision], None] | None = None) -> bool:
+        """Admit a request or raise `CircuitOpenError`. Returns whether the request is the half-open probe.
+
+        `on_decision` is called with the decision either way.
+        """
+        error = None
+        is_probe = False
+        with self._lock:
+            if self._state == STATE_OPEN:
+                retry_in = self._opened_at + self.open_seconds - self._clock()
+                if retry_in > 0:
+                    self._rejected += 1
+                    error = CircuitOpenError(self.name, retry_in)
+                else:
+                    self._state = STATE_HALF_OPEN
+                    logging.info("Circuit breaker of %s is half-open, sending a probe request", self.name)
+            if error is None and self._state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    error = CircuitOpenError(self.name, None)
+                else:
+                    self._probe_in_flight = is_probe = True
+            reason = self._open_reason if self._state != STATE_CLOSED else None
+
+        if on_decision is not None:
+            on_decision(CircuitBreakerDecision(self.name, error is None, reason, self.stats()))
+        if error is not None:
+            raise error
+        return is_probe
+
+    def record(self, is_probe: bool, failed: bool, latency: float) -> None:
+        """Record the outcome of an admitted request."""
+        if self.slow_call_seconds is not None and latency >= self.slow_call_seconds:
+            failed = True
+        with self._lock:
+            now = self._clock()
+            self._outcomes.append((now, failed, latency))
+            self._prune(now)
+            if is_probe:
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now, "The probe request failed")
+                else:
+                    self._state = STATE_CLOSED
+                    self._outcomes.clear()
+                    logging.info("Circuit breaker of %s is closed again", self.name)
+            elif self._state == STATE_CLOSED and len(self._outcomes) >= self.min_requests:
+                failures = sum(1 for _, failed, _ in self._outcomes if failed)
+                if failures / len(self._outcomes) >= self.error_rate_threshold:
+                    self._open(now, f"{failures} of {len(self._outcomes)} requests failed")
+
+    def release(self, is_probe: bool) -> None:
+        """Release an admitted request that ended without an outcome, e.g. because it was cancelled."""
+        if is_probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def call(
+        self,
+        send: Callable[..., Any],
+        *args: Any,
+        on_decision: Callable[[CircuitBreakerDecision], None] | None = None,
+    ) -> Any:
+        """Call `send(*args)` through the breaker."""
+        is_probe = self.acquire(on_decision)
+        started = self._clock()
+        try:
+            result = send(*args)
+        except Exception as exc:
+            self.record(is_probe, is_backend_failure(exc), self._clock() - started)
+            raise
+        except BaseException:
+            self.release(is_probe)
+            raise
+        self.record(is_probe, False, self._clock() - started)
+        return result
+
+    def call_stream(
+        self,
+        open_stream: Callable[..., Iterable[Any]],
+        *args: Any,
+        on_decision: Callable[[CircuitBreakerDecision], None] | None = None,
+    ) -> "GuardedStream":
+        """Open a stream through the breaker. Its outcome is recorded once the stream ends."""
+        is_probe = self.acquire(on_decision)
+        started = self._clock()
+        try:
+            stream = open_stream(*args)
+        except Exception as exc:
+            self.record(is_probe, is_backend_failure(exc), self._clock() - started)
+            raise
+        except BaseException:
+            self.release(is_probe)
+            raise
+        return GuardedStream(self, stream, is_probe, self._clock() - started)
+
+    def stats(self) -> CircuitBreakerStats:
+        with self._lock:
+            self._prune(self._clock())
+            failures = sum(1 for _, failed, _ in self._outcomes if failed)
+            latencies = [latency for _, _, latency in self._outcomes]
+            return CircuitBreakerStats(
+                state=self._state,
+                requests=len(self._outcomes),
+                failures=failures,
+                error_rate=failures / len(self._outcomes) if self._outcomes else 0.0,
+                latency_p95=percentile(latencies, 0.95) if latencies else None,
+                rejected=self._rejected,
+                times_opened=self._times_opened,
+            )
+
+    def _open(self, now: float, reason: str) -> None:
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._open_reason = reason
+        self._times_opened += 1
+        logging.warning("Circuit breaker of %s is open for %ss", self.name, self.open_seconds)
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+
+class GuardedStream:
+    """A stream that records its outcome with the circuit breaker that admitted it.
+
+    The latency is the time it took to open the stream. A stream that ended or was closed after
+    it delivered chunks succeeded. A stream closed before its first chunk, e.g. by the Stop button,
+    records no outcome.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, stream: Iterable[Any], is_probe: bool, latency: float):
+        self._breaker = breaker
+        self._stream = stream
+        self._is_probe = is_probe
+        self._latency = latency
+        self._received = False
+        self._done = False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            for item in self._stream:
+                self._received = True
+                yield item
+        except Exception as exc:
+            self._finish(is_backend_failure(exc))
+            raise
+        self._finish(failed=False)
+
+    def close(self) -> None:
+        # Imported here, cancellation imports streamlit and is only needed once a stream is closed
+        from cancellation import close_stream
+
+        close_stream(self._stream)
+        self._finish(failed=False if self._received else None)
+
+    def _finish(self, failed: bool | None) -> None:
+        """Report the outcome once, None releases the request without an outcome."""
+        if self._done:
+            return
+        self._done = True
+        if failed is None:
+            self._breaker.release(self._is_probe)
+        else:
+            self._breaker.record(self._is_probe, failed, self._latency)
+
+
+class CircuitBreakerRegistry:
+    """The circuit breakers of all backends in the app process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: dict[Hashable, CircuitBreaker] = {}
+
+    def get(self, key: Hashable, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                config = get_config()
+                breaker = self._breakers[key] = CircuitBreaker(
+                    name,
+                    error_rate_threshold=config.circuit_breaker_error_rate,
+                    min_requests=config.circuit_breaker_min_requests,
+                    open_seconds=config.circuit_breaker_open_seconds,
+                    slow_call_seconds=config.circuit_breaker_slow_call_seconds,
+                )
+            return breaker
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,119 @@
+"""Comparing LLM Gateway models side by side.
+
+In LLM Gateway mode, the sidebar can switch to comparing up to `COMPARE_MAX_MODELS` models. A
+prompt is then sent to every selected model at once, and each answer streams into its own column
+with its time to first token, response time and output tokens. Every model is read by its own
+worker thread, so the comparison takes as long as the slowest model, not the sum of all of them.
+
+The first model that answered without an error continues the conversation, so follow-up prompts
+send the same history to every model. The answers of all models are stored in the message meta
+under `comparison`.
+"""
+
+import logging
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from constants import LLM_REQUEST_POLL_SECONDS, LLM_REQUEST_WORKERS
+from context_window import count_tokens
+from request_timing import RequestTimer
+from streaming import StreamCollector
+
+_compare_executor = ThreadPoolExecutor(max_workers=LLM_REQUEST_WORKERS, thread_name_prefix="model-compare")
+
+
+class ModelAnswer:
+    """The answer of one model. Only its worker thread writes to it until the comparison has ended."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.timer = RequestTimer()
+        self.collector = StreamCollector(self.timer)
+        self.error: str | None = None
+
+    @property
+    def text(self) -> str:
+        return self.collector.text
+
+    def summary(self) -> dict[str, Any]:
+        """Return the answer and its timings to store in the message meta."""
+        text = self.text
+        return {
+            "model": self.model,
+            "content": text,
+            "error": self.error,
+            "output_tokens": count_tokens(text) if text else 0,
+            **self.timer.summary(text),
+        }
+
+
+def _read_answer(
+    index: int,
+    answer: ModelAnswer,
+    open_deltas: Callable[[RequestTimer], Iterable[str]],
+    events: queue.SimpleQueue,
+    stopped: threading.Event,
+) -> None:
+    deltas = None
+    try:
+        deltas = open_deltas(answer.timer)
+        for delta in deltas:
+            if stopped.is_set():
+                break
+            answer.collector.add(delta)
+            events.put((index, delta))
+    except Exception as exc:
+        logging.error("Comparison request to %s failed: %s", answer.model, exc)
+        answer.error = str(exc)
+    finally:
+        # Closing the generator of an unfinished answer closes its stream
+        close = getattr(deltas, "close", None)
+        if callable(close):
+            close()
+        answer.timer.finish()
+        events.put((index, None))
+
+
+def stream_answers(
+    answers: list[ModelAnswer],
+    open_deltas: list[Callable[[RequestTimer], Iterable[str]]],
+    poll_seconds: float = LLM_REQUEST_POLL_SECONDS,
+) -> Iterator[dict[int, str]]:
+    """Read the answers of all models concurrently, `open_deltas[i]` sends the request of `answers[i]`.
+
+    Yields the text each answer received since the last yield, by the index of the answer. An
+    empty dict is yielded every `poll_seconds` while no text arrives, so the caller gets to check
+    whether it was interrupted. Ends once every answer is complete or failed. If the caller stops
+    early, the workers stop reading and close their streams.
+    """
+    events: queue.SimpleQueue = queue.SimpleQueue()
+    stopped = threading.Event()
+    for index, (answer, open_answer) in enumerate(zip(answers, open_deltas, strict=True)):
+        _compare_executor.submit(_read_answer, index, answer, open_answer, events, stopped)
+
+    remaining = len(answers)
+    try:
+        while remaining:
+            received: dict[int, str] = {}
+            try:
+                event = events.get(timeout=poll_seconds)
+            except queue.Empty:
+                yield received
+                continue
+            # Merge everything that arrived meanwhile, so each column is rendered once per yield
+            while event is not None:
+                index, delta = event
+                if delta is None:
+                    remaining -= 1
+                else:
+                    received[index] = received.get(index, "") + delta
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    event = None
+            yield received
+    finally:
+        stopped.set()
@@ -1,37 +1,68 @@
+import io
+import logging
+
 import streamlit as st
 import streamlit_sal as sal
 
+from cancellation import cancel_generation
 from constants import (
     APP_EMPTY_CHAT_IMAGE,
     APP_EMPTY_CHAT_IMAGE_WIDTH,
     APP_LOGO,
+    COMPARE_MAX_MODELS,
     I18N_ACCESSIBILITY_LABEL_LLM,
     I18N_ACCESSIBILITY_LABEL_YOU,
     I18N_APP_DESCRIPTION,
+    I18N_BULK_DOWNLOAD_BUTTON,
+    I18N_BULK_ERROR,
+    I18N_BULK_PREPARE_DOWNLOAD_BUTTON,
+    I18N_BULK_PROGRESS,
+    I18N_BULK_RUN_BUTTON,
+    I18N_BULK_TITLE,
+    I18N_BULK_UPLOAD_LABEL,
+    I18N_CIRCUIT_BREAKER_STATES,
     I18N_CITATION_BUTTON,
     I18N_CITATION_DIALOG_TITLE,
     I18N_CITATION_KEY_ANSWER,
     I18N_CITATION_KEY_CITATION,
     I18N_CITATION_KEY_PROMPT,
     I18N_CITATION_SOURCE_PAGE,
+    I18N_COMPARE_MODELS,
+    I18N_COMPARE_TOGGLE,
     I18N_DIALOG_CLOSE_BUTTON,
+    I18N_FORMAT_CIRCUIT_BREAKER_REASON,
     I18N_FORMAT_CONFIDENCE,
     I18N_FORMAT_CURRENCY,
     I18N_FORMAT_LATENCY,
+    I18N_FORMAT_REPLICA,
+    I18N_FORMAT_TOKENS_PER_SECOND,
     I18N_LOADING_MESSAGE,
+    I18N_MESSAGE_CANCELLED,
     I18N_NO_DEPLOYMENT_FOUND,
+    I18N_RESPONSE_CACHED,
+    I18N_RESPONSE_CIRCUIT_BREAKER,
+    I18N_RESPONSE_COMPARE_TIME,
     I18N_RESPONSE_CONFIDENCE,
     I18N_RESPONSE_COST,
+    I18N_RESPONSE_FALLBACK,
     I18N_RESPONSE_LATENCY,
+    I18N_RESPONSE_ORIGIN,
+    I18N_RESPONSE_OUTPUT_TOKENS,
+    I18N_RESPONSE_REPLICA,
+    I18N_RESPONSE_RETRIES,
+    I18N_RESPONSE_SPEED,
+    I18N_RESPONSE_TIME_TO_FIRST_TOKEN,
     I18N_RESPONSE_TOKENS,
+    I18N_RESPONSE_TOTAL_TIME,
     I18N_SHARE_BUTTON,
     I18N_SHARE_DIALOG_TITLE,
     I18N_SPLASH_TEXT,
     I18N_SPLASH_TITLE,
+    I18N_STOP_BUTTON,
     LLM_AVATAR,
     LLM_DISPLAY_NAME,
-    ROLE_ASSISTANT,
     ROLE_USER,
+    STATUS_CANCELLED,
     STATUS_ERROR,
     USER_AVATAR,
     USER_DISPLAY_NAME,
@@ -40,16 +71,18 @@ from dr_requests import (
     get_application_info,
     send_chat_api_request,
     send_chat_api_streaming_request,
+    send_llm_gateway_compare_request,
     send_llm_gateway_request,
     send_llm_gateway_streaming_request,
     send_predict_request,
     submit_metric,
 )
+from predictions import get_prediction_client
+from streaming import MarkdownBlockStream, batch_deltas, split_markdown_blocks
 from utils import (
     escape_result_text,
     get_app_name,
     get_deployment,
-    get_message_by_role,
     get_vdb_metadata_columns,
 )
 
@@ -129,6 +162,12 @@ def show_citations_dialog(prompt, answer, citations):
 # If your LLM response contains more metadata, you can add them here to `info_items`
 def get_info_section_data(message_meta):
     info_items = []
+    if message_meta.get("cached"):
+        info_items.append({I18N_RESPONSE_ORIGIN: I18N_RESPONSE_CACHED})
+    if message_meta.get("fallback_model"):
+        fallback_model = get_model_label(message_meta["fallback_model"])
+        info_items.append({I18N_RESPONSE_ORIGIN: I18N_RESPONSE_FALLBACK.format(fallback_model)})
+
     if message_meta.get("datarobot_latency"):
         formatted_value = I18N_FORMAT_LATENCY.format(f"{message_meta['datarobot_latency']:.2f}")
         info_items.append({I18N_RESPONSE_LATENCY: formatted_value})
@@ -140,6 +179,42 @@ def get_info_section_data(message_meta):
         formatted_value = I18N_FORMAT_CONFIDENCE.format(f"{(100 * message_meta['datarobot_confidence_score']):.2f}")
         info_items.append({I18N_RESPONSE_CONFIDENCE: formatted_value})
 
+    # Client-side timings, see `request_timing.py`
+    if message_meta.get("time_to_first_token"):
+        formatted_value = I18N_FORMAT_LATENCY.format(f"{message_meta['time_to_first_token']:.2f}")
+        info_items.append({I18N_RESPONSE_TIME_TO_FIRST_TOKEN: formatted_value})
+
+    if message_meta.get("total_time"):
+        formatted_value = I18N_FORMAT_LATENCY.format(f"{message_meta['total_time']:.2f}")
+        info_items.append({I18N_RESPONSE_TOTAL_TIME: formatted_value})
+
+    if message_meta.get("output_tokens_per_second"):
+        formatted_value = I18N_FORMAT_TOKENS_PER_SECOND.format(f"{message_meta['output_tokens_per_second']:.1f}")
+        info_items.append({I18N_RESPONSE_SPEED: formatted_value})
+
+    if message_meta.get("output_tokens"):
+        info_items.append({I18N_RESPONSE_OUTPUT_TOKENS: message_meta["output_tokens"]})
+
+    if message_meta.get("retries"):
+        info_items.append({I18N_RESPONSE_RETRIES: len(message_meta["retries"])})
+
+    if message_meta.get("replicas"):
+        # The replica the prompt was routed to, see `router.py`
+        deployment_id = message_meta["deployment_id"]
+        ewma_latency = message_meta["replicas"][deployment_id]["ewma_latency"]
+        formatted_value = (
+            deployment_id if ewma_latency is None else I18N_FORMAT_REPLICA.format(deployment_id, f"{ewma_latency:.2f}")
+        )
+        info_items.append({I18N_RESPONSE_REPLICA: formatted_value})
+
+    if message_meta.get("circuit_breakers"):
+        # The last breaker decision is the one of the backend that answered, see `circuit_breaker.py`
+        decision = message_meta["circuit_breakers"][-1]
+        formatted_value = I18N_CIRCUIT_BREAKER_STATES[decision["stats"]["state"]]
+        if decision["reason"]:
+            formatted_value = I18N_FORMAT_CIRCUIT_BREAKER_REASON.format(formatted_value, decision["reason"])
+        info_items.append({I18N_RESPONSE_CIRCUIT_BREAKER: formatted_value})
+
     if message_meta.get("cost"):
         formatted_value = I18N_FORMAT_CURRENCY.format(message_meta.get("cost"))
         info_items.append({I18N_RESPONSE_COST: formatted_value})
@@ -148,12 +223,11 @@ def get_info_section_data(message_meta):
 
 
 def response_info_footer(meta_id):
-    prompt_message = get_message_by_role(ROLE_USER, meta_id)
-    result_message = get_message_by_role(ROLE_ASSISTANT, meta_id)
-    message_meta = st.session_state.messages_meta.get(meta_id, None)
+    turn = st.session_state.conversation.get_turn(meta_id)
+    message_meta = turn.meta
 
-    prompt = prompt_message["content"]
-    answer = result_message["content"]
+    prompt = turn.prompt.content
+    answer = turn.answer.content
     feedback = message_meta["feedback_value"]
     citations = message_meta.get("citations", None)
     custom_metric_id = st.session_state.custom_metric_id
@@ -238,20 +312,106 @@ def render_message(message):
         else:
             if "status" in meta_data and meta_data["status"] == STATUS_ERROR:
                 st.error(meta_data["error_message"], icon="🚨")
+            elif meta_data.get("status") == STATUS_CANCELLED:
+                if meta_data.get("comparison"):
+                    render_comparison(meta_data)
+                elif content:
+                    render_answer(content)
+                st.caption(I18N_MESSAGE_CANCELLED)
+            elif meta_data.get("comparison"):
+                render_comparison(meta_data)
             else:
-                escaped_text = escape_result_text(message["content"])
-                st.write(escaped_text)
+                render_answer(message["content"])
                 response_info_footer(msg_id)
 
 
-@st.fragment
+def render_answer(content):
+    # One container with a markdown element per block, like `write_stream_blocks` renders the stream
+    with st.container():
+        for block in split_markdown_blocks(content) or [content]:
+            st.markdown(escape_result_text(block))
+
+
+def write_finished_blocks(answer_container, open_block, blocks):
+    """Write `blocks` into the growing element `open_block` of `answer_container`, return the next growing element."""
+    for block in blocks:
+        open_block.markdown(escape_result_text(block))
+        open_block = answer_container.empty()
+    return open_block
+
+
+def write_stream_blocks(chunks):
+    """Render a streamed answer block by block.
+
+    Finished paragraphs and code blocks are written once, only the block that is still growing
+    is rendered again for every chunk. Long answers would otherwise be re-rendered as a whole.
+    The growing block is the last element of the answer container and is finished in place, so
+    the container ends up with the same elements as `render_answer` renders.
+    """
+    blocks = MarkdownBlockStream()
+    answer_container = st.container()
+    open_block = answer_container.empty()
+    for chunk in chunks:
+        open_block = write_finished_blocks(answer_container, open_block, blocks.feed(chunk))
+        open_block.markdown(escape_result_text(blocks.open_block))
+    write_finished_blocks(answer_container, open_block, blocks.close()).empty()
+
+
+def get_model_label(model):
+    return model.removeprefix("datarobot/")
+
+
+def write_comparison_stream(models, received_text):
+    """Render the answers of a model comparison side by side while they stream, see `compare.py`."""
+    answers = []
+    for column, model in zip(st.columns(len(models)), models, strict=True):
+        column.markdown(f"**{get_model_label(model)}**")
+        answer_container = column.container()
+        answers.append([MarkdownBlockStream(), answer_container, answer_container.empty()])
+    for received in received_text:
+        for index, text in received.items():
+            blocks, answer_container, open_block = answers[index]
+            open_block = answers[index][2] = write_finished_blocks(answer_container, open_block, blocks.feed(text))
+            open_block.markdown(escape_result_text(blocks.open_block))
+
+
+def render_comparison(message_meta):
+    """Render the answers of a model comparison side by side, each with its own timings."""
+    comparison = message_meta["comparison"]
+    for column, answer in zip(st.columns(len(comparison)), comparison, strict=True):
+        with column:
+            st.markdown(f"**{get_model_label(answer['model'])}**")
+            if answer["error"]:
+                st.error(answer["error"], icon="🚨")
+            else:
+                render_answer(answer["content"])
+            info_section_data = get_info_section_data(answer)
+            if info_section_data:
+                render_info_section(info_section_data)
+    if message_meta.get("total_time"):
+        formatted_value = I18N_FORMAT_LATENCY.format(f"{message_meta['total_time']:.2f}")
+        render_info_section([{I18N_RESPONSE_COMPARE_TIME: formatted_value}])
+
+
+def batch_stream(deltas):
+    return batch_deltas(deltas, st.session_state.stream_flush_interval_ms, st.session_state.stream_flush_chars)
+
+
 def render_pending_message(message):
-    # Render the message within a fragment, that way st.rerun() will only affect this container and not the whole app
+    # Not a fragment: Streamlit only interrupts a running script for a click that reruns the whole
+    # app, so the Stop button must not be rendered within a fragment, see `cancellation.py`
     with sal.chat_message(), st.chat_message(name=I18N_ACCESSIBILITY_LABEL_LLM, avatar=LLM_AVATAR):
         st.markdown(f"__{LLM_DISPLAY_NAME}:__")
-        if st.session_state.use_llm_gateway:
+        st.button(
+            I18N_STOP_BUTTON, key=f"stop-{message['meta_id']}", on_click=cancel_generation, args=(message["meta_id"],)
+        )
+        if st.session_state.use_llm_gateway and st.session_state.llm_compare_models:
+            models = st.session_state.llm_compare_models
+            write_comparison_stream(models, send_llm_gateway_compare_request(message, models))
+            st.rerun()
+        elif st.session_state.use_llm_gateway:
             if st.session_state.enable_chat_api_streaming:
-                st.write_stream(send_llm_gateway_streaming_request(message))
+                write_stream_blocks(batch_stream(send_llm_gateway_streaming_request(message)))
                 st.rerun()
             else:
                 with st.spinner(I18N_LOADING_MESSAGE):
@@ -259,7 +419,7 @@ def render_pending_message(message):
                     st.rerun()
         elif st.session_state.is_chat_api_enabled and st.session_state.enable_chat_api_streaming:
             # Immediately render any incoming streaming response
-            st.write_stream(send_chat_api_streaming_request(message))
+            write_stream_blocks(batch_stream(send_chat_api_streaming_request(message)))
             # The final streaming chunk has been received now. Trigger rerun to let the render_message handle the
             # message rendering.
             st.rerun()
@@ -318,6 +478,78 @@ def render_vdb_filter_sidebar():
                     st.warning("Enter a value.")
 
 
+def render_compare_sidebar(models):
+    """Let the user compare LLM Gateway models side by side, see `compare.py`."""
+    if not st.toggle(I18N_COMPARE_TOGGLE, key="_llm_compare"):
+        st.session_state.llm_compare_models = []
+        return
+    # Seed the comparison with the selected model once, after that Streamlit owns the selection
+    if "_llm_compare_select" not in st.session_state:
+        st.session_state["_llm_compare_select"] = [st.session_state["_llm_model_select"]]
+    st.multiselect(I18N_COMPARE_MODELS, options=models, key="_llm_compare_select", max_selections=COMPARE_MAX_MODELS)
+    selected = st.session_state["_llm_compare_select"]
+    # A single model is answered the usual way
+    st.session_state.llm_compare_models = [f"datarobot/{model}" for model in selected] if len(selected) > 1 else []
+
+
+def render_bulk_sidebar():
+    """Render a sidebar section that scores an uploaded CSV or JSONL file of prompts in bulk.
+
+    Results are streamed to a temporary CSV file of the session while the job runs. Only the file
+    is kept and removed when a new job starts. `st.download_button` loads its data into memory when
+    it is rendered, so the file is only read on the run where the user asks for the download.
+    """
+    with st.sidebar:
+        st.subheader(I18N_BULK_TITLE)
+        uploaded_file = st.file_uploader(I18N_BULK_UPLOAD_LABEL, type=["csv", "jsonl"], key="bulk_upload")
+
+        if uploaded_file is not None and st.button(I18N_BULK_RUN_BUTTON, use_container_width=True):
+            # bulk works on DataFrames, so it is only imported once a job is started
+            from bulk import BulkResultsFile, get_bulk_columns, read_prompts, run_bulk_job
+
+            if st.session_state.get("bulk_results"):
+                st.session_state.bulk_results.remove()
+            st.session_state.bulk_results = None
+            deployment = get_deployment()
+            prompt_column, result_column, association_id_column = get_bulk_columns(deployment)
+            client = get_prediction_client(deployment, st.session_state.endpoint, st.session_state.token)
+            file_format = "jsonl" if uploaded_file.name.endswith(".jsonl") else "csv"
+            progress = st.empty()
+            results = BulkResultsFile()
+
+            try:
+                with (
+                    io.TextIOWrapper(uploaded_file, encoding="utf-8", newline="") as source,
+                    open(results.path, "w", newline="", encoding="utf-8") as output,
+                ):
+                    run_bulk_job(
+                        client,
+                        read_prompts(source, file_format),
+                        output,
+                        prompt_column,
+                        result_column,
+                        association_id_column,
+                        on_progress=lambda count: progress.caption(I18N_BULK_PROGRESS.format(count)),
+                    )
+                st.session_state.bulk_results = results
+            except Exception as exc:
+                results.remove()
+                logging.exception("Bulk scoring failed")
+                st.error(I18N_BULK_ERROR.format(exc), icon="🚨")
+
+        if st.session_state.get("bulk_results") and st.button(
+            I18N_BULK_PREPARE_DOWNLOAD_BUTTON, use_container_width=True
+        ):
+            with open(st.session_state.bulk_results.path, "rb") as results_file:
+                st.download_button(
+                    I18N_BULK_DOWNLOAD_BUTTON,
+                    results_file,
+                    file_name="bulk_results.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                )
+
+
 @st.fragment
 def render_empty_chat():
     empty_chat = st.container()
@@ -1,3 +1,6 @@
+import os
+from functools import lru_cache
+
 from datarobot.core.config import DataRobotAppFrameworkBaseSettings
 
 from constants import I18N_APP_NAME_DEFAULT
@@ -15,12 +18,23 @@ class Config(DataRobotAppFrameworkBaseSettings):
     Runtime Parameter names map directly to env var names (e.g. DEPLOYMENT_ID).
     """
 
+    # Several replicas of the same deployment can be listed separated by commas, prompts are then
+    # routed to the fastest one. Metadata and feedback use the first one.
     deployment_id: str | None = None
     custom_metric_id: str | None = None
     app_name: str = I18N_APP_NAME_DEFAULT
     system_prompt: str | None = None
+    # Max tokens of conversation history sent with each prompt. The system prompt and the latest
+    # prompt are always sent. Unset sends the whole conversation.
+    context_token_budget: int | None = None
+    # Fold the history that no longer fits the budget into a summary, generated in the background.
+    enable_context_summary: bool = False
     enable_chat_api: bool = True
     enable_chat_api_streaming: bool = False
+    # Streamed deltas are sent to the browser in batches, flushed after this many milliseconds or
+    # characters, whichever comes first.
+    stream_flush_interval_ms: int = 50
+    stream_flush_chars: int = 256
     # APPLICATION_ID is injected by the DataRobot platform at runtime
     application_id: str | None = None
     # Full LiteLLM model string for the DataRobot LLM Gateway.
@@ -36,3 +50,78 @@ class Config(DataRobotAppFrameworkBaseSettings):
     # Example: "source" (text-ZIP VDBs only expose the filename as metadata).
     # When set, the sidebar shows a dropdown instead of a free-text field.
     vdb_metadata_columns: str | None = None
+    # Show a sidebar section to score an uploaded file of prompts through the Prediction API.
+    enable_bulk_mode: bool = False
+    # Answer repeated questions from a process-wide cache instead of calling the LLM again.
+    # Only enable it for apps whose answers don't depend on who asks or when.
+    enable_response_cache: bool = False
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_max_entries: int = 1000
+    response_cache_max_megabytes: int = 64
+    # Send identical questions asked in several sessions at the same time upstream only once.
+    # Sessions that share another session's answer don't get feedback buttons for it.
+    enable_request_coalescing: bool = False
+    # Timeouts of Chat API and LLM Gateway requests. The read timeout is the longest wait for the
+    # next bytes of a response, which for a blocking request is the whole answer. The total timeout
+    # bounds all attempts of a request, including the backoff between them.
+    chat_api_connect_timeout_seconds: float = 10.0
+    chat_api_read_timeout_seconds: float = 120.0
+    chat_api_total_timeout_seconds: float = 300.0
+    llm_gateway_connect_timeout_seconds: float = 10.0
+    llm_gateway_read_timeout_seconds: float = 120.0
+    llm_gateway_total_timeout_seconds: float = 300.0
+    # Attempts of an LLM request that fails with a connection error, a timeout or a rate limit.
+    # Streams are not retried once their first token arrived.
+    llm_max_attempts: int = 3
+    # Fail fast while a deployment or LLM Gateway model is failing. The breaker opens once at least
+    # CIRCUIT_BREAKER_MIN_REQUESTS requests were sent in the last minute and the share of failures
+    # reaches CIRCUIT_BREAKER_ERROR_RATE, and lets a probe request through after CIRCUIT_BREAKER_OPEN_SECONDS.
+    enable_circuit_breaker: bool = False
+    circuit_breaker_error_rate: float = 0.5
+    circuit_breaker_min_requests: int = 10
+    circuit_breaker_open_seconds: float = 30.0
+    # Requests slower than this count as failures. Unset only counts errors.
+    circuit_breaker_slow_call_seconds: float | None = None
+    # With several replicas in DEPLOYMENT_ID, send a prompt that wasn't answered by the p95 latency of its
+    # replica to a second replica as well, and use whichever answer arrives first.
+    enable_hedged_requests: bool = False
+    # LLM Gateway model that answers prompts while the deployment is down or too slow, e.g.
+    # "azure/gpt-5-1-2025-11-13". Fallback answers have no citations. Unset disables the fallback.
+    fallback_llm_model: str | None = None
+    # Fall back when the deployment hasn't answered, or sent the first token of a stream, within this
+    # many seconds. Unset only falls back on errors.
+    fallback_latency_slo_seconds: float | None = None
+    # Connection pool settings for the shared Chat API client. Every session in the app process
+    # shares one pool per deployment, so size it for the expected number of concurrent prompts.
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30.0
+    # Negotiate HTTP/2 with the deployment. Requires the optional `h2` package.
+    enable_http2: bool = False
+    # Open and read streamed answers on one shared asyncio event loop, see `async_engine.py`.
+    use_async_engine: bool = False
+
+    @property
+    def deployment_ids(self) -> list[str]:
+        """The deployments listed in DEPLOYMENT_ID, the first one is the primary deployment."""
+        return [
+            deployment_id.strip() for deployment_id in (self.deployment_id or "").split(",") if deployment_id.strip()
+        ]
+
+
+def environment_snapshot() -> frozenset[tuple[str, str]]:
+    """Hashable snapshot of the environment, used to key objects built from it"""
+    return frozenset(os.environ.items())
+
+
+@lru_cache(maxsize=1)
+def _load_config(env: frozenset[tuple[str, str]]) -> Config:
+    return Config()
+
+
+def get_config() -> Config:
+    """Return the app configuration, parsed again only when the environment changes.
+
+    Parsing reads the environment and .env files, which is too slow to repeat on every rerun.
+    """
+    return _load_config(environment_snapshot())
@@ -2,6 +2,14 @@ API_URL = "{base_url}/predApi/v1.0/deployments/{deployment_id}/predictions"  # n
 
 # Don't change this. It is enforced server-side too.
 MAX_PREDICTION_INPUT_SIZE_BYTES = 52428800  # 50 MB
+# Prediction request bodies at least this large are gzip-compressed before sending
+PREDICTION_GZIP_MIN_BYTES = 65536  # 64 KB
+
+# Bulk scoring: prompts are packed into requests of at most this size and scored concurrently
+BULK_CHUNK_MAX_BYTES = 1048576  # 1 MB
+BULK_CHUNK_MAX_ROWS = 50
+BULK_MAX_WORKERS = 4
+BULK_PROMPT_FIELD = "prompt"
 
 DEFAULT_PROMPT_COLUMN_NAME = "promptText"
 DEFAULT_RESULT_COLUMN_NAME = "resultText"
@@ -10,10 +18,80 @@ DEFAULT_RESULT_COLUMN_NAME = "resultText"
 CHAT_CAPABILITIES_KEY = "supports_chat_api"
 DEFAULT_CHAT_MODEL_NAME = "datarobot-deployed-llm"
 
+# Context window: the conversation history sent with a prompt is limited to CONTEXT_TOKEN_BUDGET tokens
+CONTEXT_TOKENIZER_ENCODING = "cl100k_base"
+# Used to estimate token counts when tiktoken is not available
+CONTEXT_CHARS_PER_TOKEN = 4
+# Approximate overhead of the chat format per message
+CONTEXT_TOKENS_PER_MESSAGE = 4
+CONTEXT_SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+CONTEXT_SUMMARY_PROMPT = (
+    "Summarize the conversation above in a few sentences. Keep names, numbers and decisions that later "
+    "questions may refer to. Reply with the summary only."
+)
+
+# Backend paths exposed as `st.session_state.backend_path`
+BACKEND_PATH_CHAT_API = "chat_api"
+BACKEND_PATH_PREDICTION_API = "prediction_api"
+BACKEND_PATH_LLM_GATEWAY = "llm_gateway"
+
 # Timeouts
 CUSTOM_METRIC_SUBMIT_TIMEOUT_SECONDS = 60
 PREDICTIONS_TIMEOUT_SECONDS = 60
 CAPABILITIES_TIMEOUT_SECONDS = 20
+OPENAI_WARM_UP_TIMEOUT_SECONDS = 5
+APPLICATION_INFO_TIMEOUT_SECONDS = 30
+LLM_GATEWAY_CATALOG_TIMEOUT_SECONDS = 15
+REST_CONNECT_TIMEOUT_SECONDS = 5
+
+# Retry policy for DataRobot REST calls. Only idempotent methods are retried.
+REST_MAX_RETRIES = 3
+REST_RETRY_BACKOFF_SECONDS = 0.5
+REST_RETRY_BACKOFF_JITTER_SECONDS = 0.5
+REST_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Feedback is submitted to the custom metric in batches from a background worker
+FEEDBACK_BATCH_MAX_ROWS = 100
+FEEDBACK_FLUSH_INTERVAL_SECONDS = 2
+FEEDBACK_MAX_ATTEMPTS = 3
+FEEDBACK_RETRY_BACKOFF_SECONDS = 1
+FEEDBACK_SHUTDOWN_TIMEOUT_SECONDS = 10
+CUSTOM_METRIC_CACHE_TTL_SECONDS = 600
+
+# Blocking LLM requests run in threads of their own, so the Stop button can interrupt the script while
+# it waits. Model comparisons, latency SLO checks and hedged requests use pools of LLM_REQUEST_WORKERS.
+LLM_REQUEST_WORKERS = 32
+LLM_REQUEST_POLL_SECONDS = 0.1
+
+# Backoff between attempts of Chat API and LLM Gateway requests, see `resilience.py`. The number of
+# attempts and the timeouts are runtime parameters.
+LLM_RETRY_BACKOFF_SECONDS = 0.5
+LLM_RETRY_MAX_BACKOFF_SECONDS = 8
+LLM_RETRY_STATUS_CODES = (408, 429, 502, 503, 504)
+
+# Circuit breakers judge the health of a backend by the requests of this window, see `circuit_breaker.py`
+CIRCUIT_BREAKER_WINDOW_SECONDS = 60
+
+# Replicas listed in DEPLOYMENT_ID are chosen by the EWMA of their latency, see `router.py`. A request
+# is only hedged once its replica has ROUTER_HEDGE_MIN_SAMPLES latencies for the p95.
+ROUTER_EWMA_ALPHA = 0.3
+ROUTER_LATENCY_SAMPLES = 100
+ROUTER_HEDGE_MIN_SAMPLES = 20
+
+# LLM Gateway models a prompt can be sent to at once in compare mode, see `compare.py`
+COMPARE_MAX_MODELS = 4
+
+# Deployment and application metadata is cached for all sessions. Expired entries are still served
+# for up to METADATA_CACHE_STALE_SECONDS while they are refreshed in the background.
+METADATA_CACHE_TTL_SECONDS = 300
+METADATA_CACHE_STALE_SECONDS = 3600
+METADATA_CACHE_MAX_ENTRIES = 256
+METADATA_CACHE_REFRESH_WORKERS = 2
+# Lookups started concurrently when a session starts, see `warm_up_metadata`
+METADATA_WARM_UP_WORKERS = 4
+# A failed capabilities probe falls back to the Prediction API and is retried after a short TTL
+CAPABILITIES_CACHE_TTL_SECONDS = 3600
+CAPABILITIES_ERROR_CACHE_TTL_SECONDS = 30
 
 # Set asset path or remote url
 APP_LOGO = "./assets/dr-logo-for-dark-bg.svg"
@@ -45,11 +123,30 @@ I18N_RESPONSE_COST = "Cost"
 I18N_RESPONSE_TOKENS = "Tokens"
 I18N_RESPONSE_LATENCY = "Latency"
 I18N_RESPONSE_CONFIDENCE = "Confidence"
+I18N_RESPONSE_ORIGIN = "Answer"
+I18N_RESPONSE_CACHED = "Cached"
+I18N_RESPONSE_FALLBACK = "Fallback model {}, without citations"
+I18N_RESPONSE_SPEED = "Speed"
+I18N_RESPONSE_TIME_TO_FIRST_TOKEN = "First token"
+I18N_RESPONSE_TOTAL_TIME = "Response time"
+I18N_RESPONSE_RETRIES = "Retries"
+I18N_RESPONSE_OUTPUT_TOKENS = "Output tokens"
+I18N_RESPONSE_COMPARE_TIME = "All models answered in"
+I18N_RESPONSE_CIRCUIT_BREAKER = "Circuit breaker"
+I18N_RESPONSE_REPLICA = "Replica"
+I18N_CIRCUIT_BREAKER_STATES = {"closed": "Closed", "half_open": "Half-open", "open": "Open"}
 I18N_FORMAT_CURRENCY = "${}"  # Place the currency before or after {}
 I18N_FORMAT_LATENCY = "{}s"  # Place time unit before or after {}
 I18N_FORMAT_CONFIDENCE = "{}%"  # Place unit before or after {}
+I18N_FORMAT_TOKENS_PER_SECOND = "{} tokens/s"  # Place unit before or after {}
+I18N_FORMAT_CIRCUIT_BREAKER_REASON = "{} ({})"  # Breaker state and why it opened
+I18N_FORMAT_REPLICA = "{} (avg. {}s)"  # Deployment ID and its average latency
 I18N_INPUT_PLACEHOLDER = "Send a prompt"
 I18N_LOADING_MESSAGE = "Waiting for LLM response..."
+I18N_STOP_BUTTON = "Stop"
+I18N_COMPARE_TOGGLE = "Compare models"
+I18N_COMPARE_MODELS = "Models to compare"
+I18N_MESSAGE_CANCELLED = "Stopped before the answer was complete."
 I18N_SPLASH_TITLE = "What do you want to know?"
 I18N_SPLASH_TEXT = "Ask a question"
 I18N_CITATION_BUTTON = "Citation"
@@ -66,11 +163,19 @@ I18N_ACCESSIBILITY_LABEL_LLM = "ai"  # Name is not shown in the UI but is only s
 I18N_NO_DEPLOYMENT_ID = (
     "Required environment variable `DEPLOYMENT_ID` is not defined. Set the variable and rebuild the application"
 )
+I18N_BULK_TITLE = "Bulk Questions"
+I18N_BULK_UPLOAD_LABEL = "CSV or JSONL file with a `prompt` column"
+I18N_BULK_RUN_BUTTON = "Score all prompts"
+I18N_BULK_PROGRESS = "Scored {} prompts"
+I18N_BULK_PREPARE_DOWNLOAD_BUTTON = "Prepare results for download"
+I18N_BULK_DOWNLOAD_BUTTON = "Download results"
+I18N_BULK_ERROR = "Bulk scoring failed: {}"
 I18N_NO_DEPLOYMENT_FOUND = "Could not find deployment with given id: {}"
 
 STATUS_PENDING = "PENDING"
 STATUS_ERROR = "ERROR"
 STATUS_COMPLETED = "COMPLETED"
+STATUS_CANCELLED = "CANCELLED"
 
 ROLE_SYSTEM = "system"
 ROLE_USER = "user"
@@ -0,0 +1,181 @@
+"""Token-budgeted conversation context for LLM requests.
+
+Long sessions would otherwise send the whole conversation with every prompt, so cost and
+latency keep growing. `build_context_window` keeps the system prompt and as many of the latest
+messages as fit in the token budget. Optionally, the messages that no longer fit are folded into
+a rolling summary, generated in the background and sent in their place.
+"""
+
+import logging
+import math
+import threading
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from constants import (
+    CONTEXT_CHARS_PER_TOKEN,
+    CONTEXT_SUMMARY_HEADER,
+    CONTEXT_SUMMARY_PROMPT,
+    CONTEXT_TOKENIZER_ENCODING,
+    CONTEXT_TOKENS_PER_MESSAGE,
+    ROLE_SYSTEM,
+    ROLE_USER,
+)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_loader: threading.Thread | None = None
+
+
+def _load_encoding():
+    global _encoding
+    try:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER_ENCODING)
+    except Exception as exc:
+        # tiktoken is optional and may not be able to download its encoding
+        logging.info("Counting tokens with a character heuristic, tiktoken is unavailable: %s", exc)
+
+
+def _get_encoding():
+    """Return the tiktoken encoding, or None while it is not loaded (yet).
+
+    tiktoken downloads the encoding without a timeout when it is not in its local cache, so it is
+    loaded on a daemon thread and nothing ever waits for it.
+    """
+    global _encoding_loader
+    if _encoding is None and _encoding_loader is None:
+        with _encoding_lock:
+            if _encoding_loader is None:
+                _encoding_loader = threading.Thread(target=_load_encoding, name="tiktoken-loader", daemon=True)
+                _encoding_loader.start()
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def _count_encoded_tokens(text: str) -> int:
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text with tiktoken, or estimate them until it is available."""
+    if _get_encoding() is not None:
+        return _count_encoded_tokens(text)
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+
+def count_message_tokens(message: dict[str, Any]) -> int:
+    return count_tokens(message["content"] or "") + CONTEXT_TOKENS_PER_MESSAGE
+
+
+@dataclass
+class ContextWindow:
+    messages: list[dict[str, Any]]
+    tokens_sent: int
+    tokens_dropped: int
+    # Number of conversation messages (excluding the system prompt) not sent verbatim
+    dropped_count: int
+
+
+@dataclass
+class RollingSummary:
+    """Summary of the first `covered_count` conversation messages of a session.
+
+    Updated from a background thread, so readers take a consistent snapshot with `snapshot()`.
+    """
+
+    text: str | None = None
+    covered_count: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _running: bool = field(default=False, repr=False)
+
+    def snapshot(self) -> tuple[str | None, int]:
+        with self._lock:
+            return self.text, self.covered_count
+
+    def refresh_in_background(
+        self, messages: Sequence[dict[str, Any]], upto: int, summarize: Callable[[list[dict[str, Any]]], str]
+    ) -> None:
+        """Extend the summary to cover `messages[:upto]`, unless it already does or is being updated."""
+        with self._lock:
+            if self._running or upto <= self.covered_count:
+                return
+            self._running = True
+            previous_summary = self.text
+            new_messages = messages[self.covered_count : upto]
+
+        def _run():
+            text = None
+            try:
+                prompt = (
+                    [{"role": ROLE_SYSTEM, "content": CONTEXT_SUMMARY_HEADER + previous_summary}]
+                    if previous_summary
+                    else []
+                )
+                text = summarize([*prompt, *new_messages, {"role": ROLE_USER, "content": CONTEXT_SUMMARY_PROMPT}])
+            except Exception as exc:
+                logging.warning("Failed to summarize the conversation: %s", exc)
+            with self._lock:
+                if text:
+                    self.text = text
+                    self.covered_count = upto
+                self._running = False
+
+        threading.Thread(target=_run, name="context-summary", daemon=True).start()
+
+
+def build_context_window(
+    messages: Sequence[dict[str, Any]],
+    token_budget: int,
+    summary: RollingSummary | None = None,
+    summarize: Callable[[list[dict[str, Any]]], str] | None = None,
+) -> ContextWindow:
+    """Select the messages to send within `token_budget`.
+
+    The system prompt and the latest message are always sent, even if they exceed the budget on
+    their own. Older messages are added from newest to oldest while they fit. If a summary covers
+    messages that did not fit, it is sent as a system message in their place. When `summarize` is
+    given, the summary is extended in the background to cover every message that did not fit.
+    """
+    system_count = 0
+    while system_count < len(messages) and messages[system_count]["role"] == ROLE_SYSTEM:
+        system_count += 1
+
+    summary_text, summary_count = summary.snapshot() if summary else (None, 0)
+    summary_message = {"role": ROLE_SYSTEM, "content": CONTEXT_SUMMARY_HEADER + summary_text} if summary_text else None
+
+    used = sum(count_message_tokens(message) for message in messages[:system_count])
+    if summary_message:
+        used += count_message_tokens(summary_message)
+
+    # Walk back from the latest message, `start` is the index of the oldest message that is sent
+    start = len(messages)
+    while start > system_count:
+        tokens = count_message_tokens(messages[start - 1])
+        if start < len(messages) and used + tokens > token_budget:
+            break
+        used += tokens
+        start -= 1
+    # Don't start the history with an answer whose prompt was dropped
+    while start < len(messages) - 1 and messages[start]["role"] != ROLE_USER:
+        used -= count_message_tokens(messages[start])
+        start += 1
+    dropped_count = start - system_count
+
+    # The summary replaces dropped messages only. If it covers messages that are sent anyway, skip it.
+    if summary_message and not 0 < summary_count <= dropped_count:
+        used -= count_message_tokens(summary_message)
+        summary_message = None
+
+    if summary is not None and summarize is not None and dropped_count > summary_count:
+        summary.refresh_in_background(messages[system_count:start], dropped_count, summarize)
+
+    return ContextWindow(
+        messages=[*messages[:system_count], *([summary_message] if summary_message else []), *messages[start:]],
+        tokens_sent=used,
+        tokens_dropped=sum(count_message_tokens(message) for message in messages[system_count:start]),
+        dropped_count=dropped_count,
+    )
@@ -0,0 +1,120 @@
+"""Indexed storage for the messages of a chat session.
+
+`st.session_state.messages` and `st.session_state.messages_meta` are the `messages` list and
+`meta` dict of the session's `ConversationStore`, so existing readers keep working. All writes go
+through the store, which keeps an index from meta_id to the prompt, answer and meta of a turn.
+Looking up a message is then O(1) instead of a scan over the whole conversation on every rerun.
+
+The store also maintains the `messages` payload sent to the LLM as messages are added, so a
+request does not need to walk and copy the whole history.
+"""
+
+from dataclasses import dataclass
+from typing import Any
+
+from constants import ROLE_ASSISTANT, ROLE_SYSTEM, ROLE_USER
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    """A single chat message. Supports `message["role"]` and `message.get("meta_id")` like a dict."""
+
+    role: str
+    content: str | None
+    # Shared by a prompt and its answer, None for the system prompt
+    meta_id: str | None = None
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+
+@dataclass(slots=True)
+class Turn:
+    """A prompt, its answer (once received) and the meta of the exchange."""
+
+    prompt: MessageRecord
+    meta: dict[str, Any]
+    answer: MessageRecord | None = None
+    # The prompt's entry in the request payload
+    request_message: dict[str, Any] | None = None
+
+
+class ConversationStore:
+    """The messages of a session, indexed by meta_id."""
+
+    def __init__(self):
+        self.messages: list[MessageRecord] = []
+        self.meta: dict[str, dict[str, Any]] = {}
+        self._turns: dict[str, Turn] = {}
+        self._visible_messages: list[MessageRecord] | None = None
+        self._request_messages: tuple[dict[str, Any], ...] = ()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add_system_message(self, content: str) -> MessageRecord:
+        self._request_messages += ({"role": ROLE_SYSTEM, "content": content},)
+        return self._append(MessageRecord(ROLE_SYSTEM, content))
+
+    def add_prompt(self, meta_id: str, content: str, meta: dict[str, Any]) -> MessageRecord:
+        message = self._append(MessageRecord(ROLE_USER, content, meta_id))
+        request_message = {"role": ROLE_USER, "content": content}
+        self._request_messages += (request_message,)
+        self.meta[meta_id] = meta
+        self._turns[meta_id] = Turn(message, meta, request_message=request_message)
+        return message
+
+    def add_answer(self, meta_id: str, content: str | None) -> MessageRecord:
+        """Add the answer to a prompt. A `None` answer (failed request) drops the prompt from the payload."""
+        message = self._append(MessageRecord(ROLE_ASSISTANT, content, meta_id))
+        turn = self._turns[meta_id]
+        turn.answer = message
+        if content is not None:
+            self._request_messages += ({"role": ROLE_ASSISTANT, "content": content},)
+        elif self._request_messages and self._request_messages[-1] is turn.request_message:
+            # The failed prompt is almost always the last message of the payload
+            self._request_messages = self._request_messages[:-1]
+        else:
+            self._request_messages = tuple(m for m in self._request_messages if m is not turn.request_message)
+        return message
+
+    def get_turn(self, meta_id: str) -> Turn | None:
+        return self._turns.get(meta_id)
+
+    def get_message(self, role: str, meta_id: str) -> MessageRecord | None:
+        turn = self._turns.get(meta_id)
+        if turn is None:
+            return None
+        if role == ROLE_USER:
+            return turn.prompt
+        if role == ROLE_ASSISTANT:
+            return turn.answer
+        return None
+
+    @property
+    def visible_messages(self) -> list[MessageRecord]:
+        """All messages except the system prompt, cached until the next message is added."""
+        if self._visible_messages is None:
+            self._visible_messages = [message for message in self.messages if message.role != ROLE_SYSTEM]
+        return self._visible_messages
+
+    @property
+    def request_messages(self) -> tuple[dict[str, Any], ...]:
+        """The conversation as sent to the LLM: role and content only, without failed turns.
+
+        The tuple is replaced rather than modified when messages are added, so requests that still
+        read it from worker threads keep a consistent snapshot without copying it per turn. The
+        message dicts are shared and must not be modified.
+        """
+        return self._request_messages
+
+    def _append(self, message: MessageRecord) -> MessageRecord:
+        self.messages.append(message)
+        self._visible_messages = None
+        return message
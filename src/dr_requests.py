@@ -1,31 +1,52 @@
-import json
 import logging
-import os
-import sys
+import time
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from datetime import datetime
 
-import litellm
-import pandas as pd
-import requests
 import streamlit as st
 from datarobot.models.deployment import CustomMetric
-from datarobot_predict.deployment import predict
-from openai import OpenAI
 
+import transport
+from async_engine import async_engine
+from caching import metadata_cache
+from cancellation import close_stream, run_interruptibly, track_in_flight
+from circuit_breaker import STATE_OPEN, circuit_breakers
+from compare import ModelAnswer, stream_answers
 from constants import (
+    APPLICATION_INFO_TIMEOUT_SECONDS,
+    BACKEND_PATH_CHAT_API,
+    BACKEND_PATH_LLM_GATEWAY,
+    BACKEND_PATH_PREDICTION_API,
+    CAPABILITIES_CACHE_TTL_SECONDS,
+    CAPABILITIES_ERROR_CACHE_TTL_SECONDS,
     CAPABILITIES_TIMEOUT_SECONDS,
     CHAT_CAPABILITIES_KEY,
-    CUSTOM_METRIC_SUBMIT_TIMEOUT_SECONDS,
+    CUSTOM_METRIC_CACHE_TTL_SECONDS,
     DEFAULT_CHAT_MODEL_NAME,
     DEFAULT_PROMPT_COLUMN_NAME,
     DEFAULT_RESULT_COLUMN_NAME,
-    MAX_PREDICTION_INPUT_SIZE_BYTES,
+    LLM_REQUEST_POLL_SECONDS,
+    METADATA_WARM_UP_WORKERS,
+    ROLE_USER,
     STATUS_COMPLETED,
     STATUS_ERROR,
 )
+from context_window import build_context_window
+from fallback import should_fall_back, within_latency_slo
+from feedback import FeedbackTarget, feedback_queue
+from predictions import get_prediction_client
+from request_timing import RequestTimer
+from resilience import call_with_retries, get_deadlines, get_retry_policy
+from response_cache import CachedResponse, get_response_cache, make_cache_key
+from router import PrimedStream, deployment_router
+from singleflight import single_flight
+from streaming import StreamCollector, read_in_background
 from utils import (
     ResponseProcessingError,
+    fetch_association_id_column_name,
+    fetch_deployment,
     get_association_id_column_name,
     get_base_url,
     get_deployment,
@@ -33,68 +54,316 @@ from utils import (
     process_citations,
     process_predict_citations,
     raise_datarobot_error_for_status,
-    rename_dataframe_columns,
-    sanitize_messages_for_request,
     set_result_message_state,
 )
 
+_warm_up_executor = ThreadPoolExecutor(max_workers=METADATA_WARM_UP_WORKERS, thread_name_prefix="metadata-warm-up")
 
-@st.cache_data(show_spinner=False)
-def get_has_chat_api_support(deployment_id, token, endpoint):
+
+def _probe_chat_api_support(deployment_id, token, endpoint):
     url = f"{endpoint}/deployments/{deployment_id}/capabilities/"
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Token {token}",
     }
 
-    has_chat_api_support = False
     try:
-        response = requests.get(url, headers=headers, timeout=CAPABILITIES_TIMEOUT_SECONDS).json()
-        chat_capabilities = next((item for item in response["data"] if item["name"] == CHAT_CAPABILITIES_KEY), {})
-        has_chat_api_support = chat_capabilities.get("supported", False)
+        response = transport.request("GET", url, CAPABILITIES_TIMEOUT_SECONDS, headers=headers)
+        response.raise_for_status()
+        chat_capabilities = next(
+            (item for item in response.json()["data"] if item["name"] == CHAT_CAPABILITIES_KEY), {}
+        )
     except Exception as exc:
-        logging.error(exc)
+        logging.error("Failed to get deployment capabilities: %s", exc)
+        raise
+    return chat_capabilities.get("supported", False)
 
-    return has_chat_api_support
 
+def get_has_chat_api_support(deployment_id, token, endpoint):
+    """Return whether the deployment supports the Chat API.
 
-def prediction_server_override_url() -> str | None:
-    """
-    Because of the way internal networking is set up for on-prem and ST SAAS networks,
-    we need to use the service URL instead of the external URL.
+    A successful probe is cached for a long time. A failed probe falls back to the Prediction API
+    for a short time only, after which the deployment is re-probed in the background on the next
+    rerun, so a transient error does not pin the app to the predict path.
     """
-    if os.environ.get("DATAROBOT_ENDPOINT") == "http://datarobot-nginx/api/v2/":
-        return "http://datarobot-prediction-server:80/predApi/v1.0/"
-    else:
-        return None
+    return metadata_cache.get(
+        ("chat_api_support", endpoint, deployment_id),
+        lambda: _probe_chat_api_support(deployment_id, token, endpoint),
+        ttl_seconds=CAPABILITIES_CACHE_TTL_SECONDS,
+        error_value=False,
+        error_ttl_seconds=CAPABILITIES_ERROR_CACHE_TTL_SECONDS,
+    )
 
 
-def submit_metric(association_id, message_meta, value):
-    deployment = get_deployment()
-    endpoint = st.session_state.endpoint
-    custom_metric_id = st.session_state.custom_metric_id
-    custom_metric = CustomMetric.get(deployment_id=deployment.id, custom_metric_id=custom_metric_id)
+def get_custom_metric_is_model_specific(deployment_id, custom_metric_id):
+    def load():
+        custom_metric = CustomMetric.get(deployment_id=deployment_id, custom_metric_id=custom_metric_id)
+        return custom_metric.is_model_specific
+
+    return metadata_cache.get(
+        ("custom_metric_is_model_specific", st.session_state.endpoint, deployment_id, custom_metric_id),
+        load,
+        ttl_seconds=CUSTOM_METRIC_CACHE_TTL_SECONDS,
+    )
 
+
+def submit_metric(association_id, message_meta, value):
     # Return early if the same feedback was submitted already
     if message_meta.get("feedback_value") == value:
         return
 
-    message_meta["feedback_value"] = value
-    url = f"{endpoint}/deployments/{deployment.id}/customMetrics/{custom_metric_id}/fromJSON/"
+    deployment = get_deployment()
+    custom_metric_id = st.session_state.custom_metric_id
+    is_model_specific = get_custom_metric_is_model_specific(deployment.id, custom_metric_id)
 
+    message_meta["feedback_value"] = value
+    target = FeedbackTarget(
+        endpoint=st.session_state.endpoint,
+        token=st.session_state.token,
+        deployment_id=deployment.id,
+        custom_metric_id=custom_metric_id,
+        model_id=deployment.model["id"] if is_model_specific else None,
+    )
     ts = datetime.utcnow()
-    rows = [{"timestamp": ts.isoformat(), "value": value, "associationId": association_id}]
-    data = {
-        "buckets": rows,
-    }
-    if custom_metric.is_model_specific:
-        data["modelId"] = deployment.model["id"]
-    serialised_data = json.dumps(data)
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Token {st.session_state.token}",
+    feedback_queue.submit(target, {"timestamp": ts.isoformat(), "value": value, "associationId": association_id})
+
+
+def get_request_key(backend, target, messages):
+    """Return the key of requests that get the same answer.
+
+    None unless ENABLE_RESPONSE_CACHE or ENABLE_REQUEST_COALESCING is set.
+    """
+    if not (st.session_state.enable_response_cache or st.session_state.enable_request_coalescing):
+        return None
+    return make_cache_key(backend, target, messages, st.session_state.get("vdb_metadata_filters"))
+
+
+def _get_deployment_cache_target():
+    # Answers of a deployment change when its model is replaced
+    deployment = get_deployment()
+    return [deployment.id, deployment.model.get("id")]
+
+
+def without_association_ids(extra_model_output):
+    """Drop the association IDs of a prediction from its model output.
+
+    Used when an answer is reused for another prompt, so its feedback is not attributed to the
+    original prediction.
+    """
+    if not extra_model_output:
+        return extra_model_output
+    association_id_column_name = get_association_id_column_name()
+    return {
+        key: value
+        for key, value in extra_model_output.items()
+        if key not in ("datarobot_association_id", association_id_column_name)
     }
-    requests.post(url, data=serialised_data, headers=headers, timeout=CUSTOM_METRIC_SUBMIT_TIMEOUT_SECONDS)
+
+
+def complete_from_response_cache(meta_id, request_key):
+    """Complete the prompt with a cached answer. Returns the cached response, or None on a miss."""
+    if request_key is None or not st.session_state.enable_response_cache:
+        return None
+    cached = get_response_cache().get(request_key)
+    if cached is None:
+        return None
+
+    st.session_state.messages_meta[meta_id]["cached"] = True
+    set_result_message_state(
+        meta_id,
+        cached.content,
+        status=STATUS_COMPLETED,
+        citations=cached.citations,
+        extra_model_output=cached.extra_model_output,
+    )
+    return cached
+
+
+def store_in_response_cache(request_key, content, citations=None, extra_model_output=None):
+    if request_key is None or content is None or not st.session_state.enable_response_cache:
+        return
+    extra_model_output = without_association_ids(extra_model_output)
+    get_response_cache().put(request_key, CachedResponse(content, citations, extra_model_output or None))
+
+
+def coalesce_request(request_key, send):
+    """Call `send`, sharing the call with identical concurrent requests if ENABLE_REQUEST_COALESCING is set.
+
+    The call is made from a worker thread, so the Stop button can interrupt the wait and abort the
+    request. A call shared with other sessions is never aborted. Returns the result and whether it
+    came from another session's request.
+    """
+    if request_key is None or not st.session_state.enable_request_coalescing:
+        return run_interruptibly(send, scope=transport.AbortScope()), False
+    return run_interruptibly(lambda: single_flight.do(request_key, send))
+
+
+def coalesce_stream(request_key, open_stream, scope):
+    """Like `coalesce_request` for streaming requests, returns the chunk iterator and whether it is shared.
+
+    A stream that isn't shared is opened within `scope`, the scope of the in-flight request.
+    """
+    if request_key is None or not st.session_state.enable_request_coalescing:
+        return run_interruptibly(open_stream, discard=close_stream, scope=scope), False
+    return single_flight.stream(request_key, open_stream)
+
+
+def read_stream(stream, scope):
+    """Read the chunks of `stream` within `scope` on a reader thread, yielding None while none arrives.
+
+    None is yielded every flush interval. Streaming send functions yield an empty delta for it, so
+    `batch_deltas` flushes its buffer on time when the model stalls. The session state is read on
+    None as well, so the Stop button can interrupt the script while it waits.
+    """
+    poll_seconds = st.session_state.stream_flush_interval_ms / 1000 or LLM_REQUEST_POLL_SECONDS
+    for chunk in read_in_background(transport.iterate_abortable(scope, stream), poll_seconds):
+        if chunk is None:
+            # Session state access is a yield point, Streamlit raises here when the user clicked Stop
+            st.session_state.get("in_flight_request")
+        yield chunk
+
+
+def get_retrier(meta_id, backend):
+    """Return a function that calls `send(timeout)` with the timeouts and retries of `backend`, see `resilience.py`.
+
+    Every retry is recorded in the message meta. The returned function runs in a worker thread,
+    which can't access the session state, so the meta dict is bound here.
+    """
+    message_meta = st.session_state.messages_meta[meta_id]
+    policy, deadlines = get_retry_policy(), get_deadlines(backend)
+
+    def on_retry(retry):
+        logging.warning("Retrying %s request in %.2fs: %s", backend, retry.delay_seconds, retry.error)
+        message_meta.setdefault("retries", []).append(asdict(retry))
+
+    return lambda send: call_with_retries(send, policy, deadlines, on_retry)
+
+
+def with_retries(meta_id, backend, send):
+    """Wrap `send(timeout)` in the timeouts and retry policy of `backend`."""
+    retry = get_retrier(meta_id, backend)
+    return lambda: retry(send)
+
+
+def get_circuit_breaker(target, name):
+    """Return the circuit breaker of a deployment or LLM Gateway model, None unless ENABLE_CIRCUIT_BREAKER is set."""
+    if not st.session_state.enable_circuit_breaker:
+        return None
+    return circuit_breakers.get((st.session_state.endpoint, target), name)
+
+
+def guarded(breaker, send, message_meta, stream=False):
+    """Wrap `send` in a circuit breaker, see `circuit_breaker.py`. Returns `send` as is without a breaker.
+
+    Whether the breaker admitted or rejected the request is recorded in `message_meta`, which is
+    passed in because the request may be sent from a worker thread.
+    """
+    if breaker is None:
+        return send
+
+    def on_decision(decision):
+        message_meta.setdefault("circuit_breakers", []).append(asdict(decision))
+
+    call = breaker.call_stream if stream else breaker.call
+    return lambda *args: call(send, *args, on_decision=on_decision)
+
+
+def get_deployment_circuit_breaker(deployment_id):
+    return get_circuit_breaker(deployment_id, f"Deployment {deployment_id}")
+
+
+def get_llm_gateway_circuit_breaker(model):
+    return get_circuit_breaker(model, f"LLM Gateway model {model}")
+
+
+def route_request(meta_id, send_to, backend=None, stream=False, has_token=None):
+    """Return a function that sends a request to one of the replicas in DEPLOYMENT_ID, see `router.py`.
+
+    `send_to(deployment_id)` sends the request to a replica, or `send_to(deployment_id, timeout)`
+    with the timeouts and retries of `backend` if it is given. Requests go through the circuit
+    breaker of their replica, and replicas whose breaker is open are skipped while others are
+    available. With ENABLE_HEDGED_REQUESTS, a stream is hedged on its first token, as told by
+    `has_token(chunk)`, and with a fallback model, FALLBACK_LATENCY_SLO_SECONDS applies to the first
+    token too. The replica that answered is recorded in the message meta, with the router stats of
+    all replicas when there are several.
+    """
+    message_meta = st.session_state.messages_meta[meta_id]
+    deployment_ids = st.session_state.deployment_ids or [st.session_state.deployment_id]
+    breakers = {deployment_id: get_deployment_circuit_breaker(deployment_id) for deployment_id in deployment_ids}
+    available = [
+        deployment_id
+        for deployment_id in deployment_ids
+        if breakers[deployment_id] is None or breakers[deployment_id].state != STATE_OPEN
+    ] or deployment_ids
+    hedge = st.session_state.enable_hedged_requests and len(available) > 1
+    latency_slo = st.session_state.fallback_latency_slo_seconds if st.session_state.fallback_llm_model else None
+    retry = get_retrier(meta_id, backend) if backend else None
+    discard = close_stream if stream else lambda result: None
+
+    def send_to_replica(deployment_id):
+        if retry is None:
+            result = guarded(breakers[deployment_id], send_to, message_meta, stream)(deployment_id)
+        else:
+            result = retry(
+                guarded(breakers[deployment_id], lambda timeout: send_to(deployment_id, timeout), message_meta, stream)
+            )
+        return PrimedStream(result, has_token) if stream and (hedge or latency_slo) else result
+
+    def send_routed():
+        return deployment_router.send(available, send_to_replica, hedge, discard=discard)
+
+    def send():
+        if latency_slo:
+            result, deployment_id = within_latency_slo(send_routed, latency_slo, lambda routed: discard(routed[0]))
+        else:
+            result, deployment_id = send_routed()
+        message_meta["deployment_id"] = deployment_id
+        if len(deployment_ids) > 1:
+            message_meta["replicas"] = {
+                replica: {
+                    "ewma_latency": stats.ewma_latency,
+                    "in_flight": stats.in_flight,
+                    "requests": stats.requests,
+                    "hedges_won": stats.hedges_won,
+                }
+                for replica, stats in deployment_router.stats().items()
+                if replica in deployment_ids
+            }
+        return result
+
+    return send
+
+
+def get_fallback_model(meta_id, exc):
+    """Return the LLM Gateway model to answer a prompt whose deployment request failed, see `fallback.py`.
+
+    None if FALLBACK_LLM_MODEL is not set or the error is not an outage of the deployment. The
+    fallback is recorded in the message meta.
+    """
+    model = st.session_state.fallback_llm_model
+    if not model or not should_fall_back(exc):
+        return None
+    logging.warning("Answering with the fallback model %s, the deployment request failed: %s", model, exc)
+    message_meta = st.session_state.messages_meta[meta_id]
+    message_meta["fallback_model"] = model
+    message_meta["fallback_reason"] = str(exc)
+    return model
+
+
+def opened(timer, stream):
+    """Mark the time a stream was opened on its request timer. Called from the thread that opens it."""
+    timer.connected()
+    return stream
+
+
+def answered_by_replica(meta_id):
+    """Return whether a prompt was answered by a replica other than the primary deployment.
+
+    Feedback is submitted to the custom metric of the primary deployment, so the association IDs
+    of other replicas are dropped from their answers.
+    """
+    deployment_id = st.session_state.messages_meta[meta_id].get("deployment_id")
+    return deployment_id is not None and deployment_id != st.session_state.deployment_id
 
 
 def send_predict_request(message):
@@ -106,32 +375,41 @@ def send_predict_request(message):
     prompt_column_name = deployment.model.get("prompt", DEFAULT_PROMPT_COLUMN_NAME)
     result_column_name = deployment.model.get("target_name", DEFAULT_RESULT_COLUMN_NAME)
 
-    data_tuples = [
-        (association_id_column_name, meta_id) if association_id_column_name is not None else None,
-        (prompt_column_name, prompt),
-    ]
-    data = dict(filter(lambda item: item is not None, data_tuples))
+    request_key = get_request_key(
+        BACKEND_PATH_PREDICTION_API,
+        _get_deployment_cache_target(),
+        [{"role": ROLE_USER, "content": message["content"]}],
+    )
+    if complete_from_response_cache(meta_id, request_key):
+        return
+
+    row = {association_id_column_name: meta_id} if association_id_column_name is not None else {}
+    row[prompt_column_name] = prompt
 
-    input_df = pd.DataFrame(data, index=[0])
     prediction = None
     prediction_error = None
     processed_citations = None
 
-    try:
-        data_size = sys.getsizeof(data)
-        if data_size >= MAX_PREDICTION_INPUT_SIZE_BYTES:
-            raise Exception(
-                f"Prompt input is too large: {data_size} bytes. "
-                f"Max allowed size is: {MAX_PREDICTION_INPUT_SIZE_BYTES} bytes."
-            )
+    # The request is sent from a worker thread, which can't read the session state
+    endpoint, token = st.session_state.endpoint, st.session_state.token
 
-        result_df, response_headers = predict(
-            deployment, input_df, prediction_endpoint=prediction_server_override_url()
-        )
-        processed_df = rename_dataframe_columns(result_df)
-        prediction = processed_df.to_dict(orient="records")[0]
+    def predict(deployment_id):
+        replica = deployment if deployment_id == deployment.id else fetch_deployment(endpoint, deployment_id)
+        prediction_client = get_prediction_client(replica, endpoint, token)
+        return prediction_client.predict([row], text_columns={result_column_name})[0]
+
+    try:
+        timer = RequestTimer()
+        prediction, is_shared = coalesce_request(request_key, route_request(meta_id, predict))
+        record_timings(meta_id, timer, prediction[result_column_name])
+        if is_shared or answered_by_replica(meta_id):
+            prediction = without_association_ids(prediction)
         processed_citations = process_predict_citations(prediction)
     except Exception as exc:
+        fallback_model = get_fallback_model(meta_id, exc) if prediction is None else None
+        if fallback_model is not None:
+            send_llm_gateway_request(message, fallback_model)
+            return
         logging.error(exc)
         prediction_error = str(exc)
 
@@ -145,27 +423,139 @@ def send_predict_request(message):
         extra_model_output=prediction,
         error=prediction_error,
     )
+    store_in_response_cache(request_key, message_content, processed_citations, prediction)
+
+
+def record_timings(meta_id, timer, output=None):
+    """Store the client-side timings of a request in the message meta, see `request_timing.py`."""
+    timer.finish()
+    st.session_state.messages_meta[meta_id].update(timer.summary(output))
+
+
+def _llm_gateway_summarizer(model, token, endpoint):
+    def summarize(messages):
+        import litellm
+
+        response = litellm.completion(model=model, messages=messages, api_key=token, api_base=endpoint)
+        return response.choices[0].message.content
+
+    return summarize
+
+
+def _deployment_summarizer():
+    """Summarize the conversation of a deployment with DATAROBOT_LLM_MODEL of the LLM Gateway.
+
+    Sent to the deployment, the summary prompt would run retrieval and be recorded by its monitoring.
+    """
+    return _llm_gateway_summarizer(
+        st.session_state.llm_gateway_model, st.session_state.token, st.session_state.endpoint
+    )
+
+
+def get_request_messages(meta_id, summarize):
+    """Return the conversation to send with a prompt, limited to the context token budget.
+
+    `summarize` generates the rolling summary of dropped messages if ENABLE_CONTEXT_SUMMARY is set.
+    The tokens sent and dropped are recorded in the message meta.
+    """
+    request_messages = st.session_state.conversation.request_messages
+    token_budget = st.session_state.context_token_budget
+    if not token_budget:
+        return request_messages
+
+    window = build_context_window(
+        request_messages,
+        token_budget,
+        st.session_state.context_summary,
+        summarize if st.session_state.enable_context_summary else None,
+    )
+    message_meta = st.session_state.messages_meta[meta_id]
+    message_meta["context_tokens_sent"] = window.tokens_sent
+    message_meta["context_tokens_dropped"] = window.tokens_dropped
+    return window.messages
+
+
+def get_replica_openai_clients():
+    """Return the shared OpenAI client of every replica in DEPLOYMENT_ID."""
+    token = st.session_state.token
+    deployment_ids = st.session_state.deployment_ids or [st.session_state.deployment_id]
+    return {
+        deployment_id: transport.get_openai_client(get_base_url(deployment_id), token)
+        for deployment_id in deployment_ids
+    }
+
+
+def get_replica_stream_opener(stream_kwargs):
+    """Return `open_stream(deployment_id, timeout)`, which opens a Chat API stream on a replica.
+
+    With USE_ASYNC_ENGINE, the stream is read on the loop of `async_engine.py`.
+    """
+    if not st.session_state.use_async_engine:
+        replica_clients = get_replica_openai_clients()
+        return lambda deployment_id, timeout: replica_clients[deployment_id].chat.completions.create(
+            **stream_kwargs, timeout=timeout
+        )
+
+    token = st.session_state.token
+    deployment_ids = st.session_state.deployment_ids or [st.session_state.deployment_id]
+    async_clients = {
+        deployment_id: transport.get_async_openai_client(get_base_url(deployment_id), token)
+        for deployment_id in deployment_ids
+    }
+    return lambda deployment_id, timeout: async_engine.stream(
+        async_clients[deployment_id].chat.completions.create(**stream_kwargs, timeout=timeout)
+    )
+
+
+def open_llm_gateway_stream(use_async_engine, **completion_kwargs):
+    """Open an LLM Gateway stream, read on the loop of `async_engine.py` with USE_ASYNC_ENGINE."""
+    # litellm takes seconds to import, so only gateway-mode apps load it
+    import litellm
+
+    if use_async_engine:
+        return async_engine.stream(litellm.acompletion(**completion_kwargs, stream=True))
+    return litellm.completion(**completion_kwargs, stream=True, client=transport.get_llm_gateway_client())
 
 
 def send_chat_api_request(message):
     meta_id = message["meta_id"]
-    base_url = get_base_url()
-    openai_client = OpenAI(base_url=base_url, api_key=st.session_state.token)
+    openai_client = transport.get_openai_client(get_base_url(), st.session_state.token)
 
     processed_citations = None
     extra_model_output = None
     metadata_filters = st.session_state.get("vdb_metadata_filters") or {}
 
     with handle_chat_api_error(meta_id):
-        create_kwargs = dict(
-            model=DEFAULT_CHAT_MODEL_NAME,
-            messages=sanitize_messages_for_request(st.session_state.messages),
-        )
+        request_messages = get_request_messages(meta_id, _deployment_summarizer())
+        request_key = get_request_key(BACKEND_PATH_CHAT_API, _get_deployment_cache_target(), request_messages)
+        if complete_from_response_cache(meta_id, request_key):
+            return
+
+        create_kwargs = dict(model=DEFAULT_CHAT_MODEL_NAME, messages=request_messages)
         if metadata_filters:
             create_kwargs["extra_body"] = {"metadata_filter": metadata_filters}
-        completion = openai_client.chat.completions.create(**create_kwargs)
+        replica_clients = get_replica_openai_clients()
+        timer = RequestTimer()
+        try:
+            completion, is_shared = coalesce_request(
+                request_key,
+                route_request(
+                    meta_id,
+                    lambda deployment_id, timeout: replica_clients[deployment_id].chat.completions.create(
+                        **create_kwargs, timeout=timeout
+                    ),
+                    backend=BACKEND_PATH_CHAT_API,
+                ),
+            )
+        except Exception as exc:
+            fallback_model = get_fallback_model(meta_id, exc)
+            if fallback_model is None:
+                raise
+            send_llm_gateway_request(message, fallback_model)
+            return
 
         content = completion.choices[0].message.content
+        record_timings(meta_id, timer, content)
         try:
             if completion.model_extra.get("citations"):
                 processed_citations = process_citations(completion.model_extra.get("citations"))
@@ -178,6 +568,8 @@ def send_chat_api_request(message):
                 }
             if extra_model_output and not processed_citations:
                 processed_citations = process_predict_citations(extra_model_output)
+            if is_shared or answered_by_replica(meta_id):
+                extra_model_output = without_association_ids(extra_model_output)
 
         except Exception as exc:
             raise ResponseProcessingError(exc) from exc
@@ -189,36 +581,64 @@ def send_chat_api_request(message):
             citations=processed_citations,
             extra_model_output=extra_model_output,
         )
+        store_in_response_cache(request_key, content, processed_citations, extra_model_output)
         return
 
 
 def send_chat_api_streaming_request(message):
     meta_id = message["meta_id"]
-    base_url = get_base_url()
-    openai_client = OpenAI(base_url=base_url, api_key=st.session_state.token)
+    openai_client = transport.get_openai_client(get_base_url(), st.session_state.token)
 
     processed_citations = None
     extra_model_output = None
-    aggregated_content = ""
+    collector = StreamCollector()
     metadata_filters = st.session_state.get("vdb_metadata_filters") or {}
 
-    with handle_chat_api_error(meta_id):
-        stream_kwargs = dict(
-            model=DEFAULT_CHAT_MODEL_NAME,
-            messages=sanitize_messages_for_request(st.session_state.messages),
-            stream=True,
-        )
+    with handle_chat_api_error(meta_id), track_in_flight(meta_id, collector) as in_flight:
+        request_messages = get_request_messages(meta_id, _deployment_summarizer())
+        request_key = get_request_key(BACKEND_PATH_CHAT_API, _get_deployment_cache_target(), request_messages)
+        cached = complete_from_response_cache(meta_id, request_key)
+        if cached:
+            yield cached.content
+            return
+
+        stream_kwargs = dict(model=DEFAULT_CHAT_MODEL_NAME, messages=request_messages, stream=True)
         if metadata_filters:
             stream_kwargs["extra_body"] = {"metadata_filter": metadata_filters}
-        streaming_response = openai_client.chat.completions.create(**stream_kwargs)
-        for chunk in streaming_response:
+        open_stream = get_replica_stream_opener(stream_kwargs)
+        timer = collector.timer = RequestTimer()
+        # Only opening the stream is retried, never once tokens may have been shown
+        try:
+            streaming_response, is_shared = coalesce_stream(
+                request_key,
+                route_request(
+                    meta_id,
+                    lambda deployment_id, timeout: opened(timer, open_stream(deployment_id, timeout)),
+                    backend=BACKEND_PATH_CHAT_API,
+                    stream=True,
+                    has_token=lambda chunk: bool(chunk.choices and chunk.choices[0].delta.content),
+                ),
+                in_flight.scope,
+            )
+        except Exception as exc:
+            fallback_model = get_fallback_model(meta_id, exc)
+            if fallback_model is None:
+                raise
+            yield from send_llm_gateway_streaming_request(message, fallback_model)
+            return
+        in_flight.stream = streaming_response
+        for chunk in read_stream(streaming_response, in_flight.scope):
+            if chunk is None:
+                yield ""
+                continue
             # For some LLMs the first chunk might not include any choice or content
             if len(chunk.choices) == 0:
                 continue
 
             content = chunk.choices[0].delta.content
             is_final_chunk = chunk.choices[0].finish_reason == "stop"
-            aggregated_content += content if content is not None else ""
+            if content:
+                collector.add(content)
             if not is_final_chunk and content is not None:
                 yield content
             elif is_final_chunk:
@@ -233,84 +653,285 @@ def send_chat_api_streaming_request(message):
 
                     if extra_model_output and not processed_citations:
                         processed_citations = process_predict_citations(extra_model_output)
+                    if is_shared or answered_by_replica(meta_id):
+                        extra_model_output = without_association_ids(extra_model_output)
 
                 except Exception as exc:
                     raise ResponseProcessingError(exc) from exc
 
+                record_timings(meta_id, collector.timer, collector.text)
                 set_result_message_state(
                     meta_id,
-                    aggregated_content,
+                    collector.text,
                     status=STATUS_COMPLETED,
                     citations=processed_citations,
                     extra_model_output=extra_model_output,
                 )
+                store_in_response_cache(request_key, collector.text, processed_citations, extra_model_output)
                 return
 
 
-def send_llm_gateway_request(message: dict) -> None:
+def send_llm_gateway_request(message: dict, model: str | None = None) -> None:
     """Send the full conversation to the DataRobot LLM Gateway (non-streaming).
 
-    Used when DEPLOYMENT_ID is not configured. Stores the result in session state
-    via set_result_message_state — same contract as send_chat_api_request.
+    Used when DEPLOYMENT_ID is not configured, or with `model` set to answer with the fallback model.
+    Stores the result in session state via set_result_message_state — same contract as send_chat_api_request.
     """
+    # litellm takes seconds to import, so only gateway-mode apps load it
+    import litellm
+
     meta_id = message["meta_id"]
+    # The request is sent from a worker thread, which can't read the session state
+    model = model or st.session_state.llm_gateway_model
+    token, endpoint = st.session_state.token, st.session_state.endpoint
+    summarize = _llm_gateway_summarizer(model, token, endpoint)
     try:
-        response = litellm.completion(
-            model=st.session_state.llm_gateway_model,
-            messages=sanitize_messages_for_request(st.session_state.messages),
-            api_key=st.session_state.token,
-            api_base=st.session_state.endpoint,
+        request_messages = get_request_messages(meta_id, summarize)
+        request_key = get_request_key(BACKEND_PATH_LLM_GATEWAY, model, request_messages)
+        if complete_from_response_cache(meta_id, request_key):
+            return
+
+        timer = RequestTimer()
+        response, _ = coalesce_request(
+            request_key,
+            with_retries(
+                meta_id,
+                BACKEND_PATH_LLM_GATEWAY,
+                guarded(
+                    get_llm_gateway_circuit_breaker(model),
+                    lambda timeout: litellm.completion(
+                        model=model,
+                        messages=request_messages,
+                        api_key=token,
+                        api_base=endpoint,
+                        timeout=timeout,
+                        max_retries=0,
+                        client=transport.get_llm_gateway_client(),
+                    ),
+                    st.session_state.messages_meta[meta_id],
+                ),
+            ),
         )
         content = response.choices[0].message.content
+        record_timings(meta_id, timer, content)
         set_result_message_state(meta_id, content, status=STATUS_COMPLETED)
+        store_in_response_cache(request_key, content)
     except Exception as exc:
         logging.error(exc)
         set_result_message_state(meta_id, None, status=STATUS_ERROR, error=f"LLM Gateway error: {exc}")
 
 
-def send_llm_gateway_streaming_request(message: dict) -> Generator[str, None, None]:
+def send_llm_gateway_streaming_request(message: dict, model: str | None = None) -> Generator[str, None, None]:
     """Send the full conversation to the DataRobot LLM Gateway (streaming).
 
     Yields content chunks for use with st.write_stream. Stores the aggregated
-    result in session state once the stream is exhausted.
+    result in session state once the stream is exhausted. `model` overrides the selected model.
     """
     meta_id = message["meta_id"]
-    aggregated = ""
+    # The request is sent from a worker thread, which can't read the session state
+    model = model or st.session_state.llm_gateway_model
+    token, endpoint = st.session_state.token, st.session_state.endpoint
+    use_async_engine = st.session_state.use_async_engine
+    summarize = _llm_gateway_summarizer(model, token, endpoint)
+    collector = StreamCollector()
     try:
-        stream = litellm.completion(
-            model=st.session_state.llm_gateway_model,
-            messages=sanitize_messages_for_request(st.session_state.messages),
-            api_key=st.session_state.token,
-            api_base=st.session_state.endpoint,
-            stream=True,
-        )
-        for chunk in stream:
-            if not chunk.choices:
-                continue
-            content = chunk.choices[0].delta.content
-            if content:
-                aggregated += content
-                yield content
-        set_result_message_state(meta_id, aggregated, status=STATUS_COMPLETED)
+        with track_in_flight(meta_id, collector) as in_flight:
+            request_messages = get_request_messages(meta_id, summarize)
+            request_key = get_request_key(BACKEND_PATH_LLM_GATEWAY, model, request_messages)
+            cached = complete_from_response_cache(meta_id, request_key)
+            if cached:
+                yield cached.content
+                return
+
+            timer = collector.timer = RequestTimer()
+            # Only opening the stream is retried, never once tokens may have been shown
+            stream, _ = coalesce_stream(
+                request_key,
+                with_retries(
+                    meta_id,
+                    BACKEND_PATH_LLM_GATEWAY,
+                    guarded(
+                        get_llm_gateway_circuit_breaker(model),
+                        lambda timeout: opened(
+                            timer,
+                            open_llm_gateway_stream(
+                                use_async_engine,
+                                model=model,
+                                messages=request_messages,
+                                api_key=token,
+                                api_base=endpoint,
+                                timeout=timeout,
+                                max_retries=0,
+                            ),
+                        ),
+                        st.session_state.messages_meta[meta_id],
+                        stream=True,
+                    ),
+                ),
+                in_flight.scope,
+            )
+            in_flight.stream = stream
+            for chunk in read_stream(stream, in_flight.scope):
+                if chunk is None:
+                    yield ""
+                    continue
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    collector.add(content)
+                    yield content
+            record_timings(meta_id, collector.timer, collector.text)
+            set_result_message_state(meta_id, collector.text, status=STATUS_COMPLETED)
+            store_in_response_cache(request_key, collector.text)
     except Exception as exc:
         logging.error(exc)
         set_result_message_state(meta_id, None, status=STATUS_ERROR, error=f"LLM Gateway error: {exc}")
 
 
-@st.cache_data(show_spinner=False)
-def get_application_info():
-    if st.session_state.app_id is None or st.session_state.app_id == "":
-        # Fallback for local development or invalid APP_ID
-        return {}
+def _llm_gateway_deltas(
+    model, request_messages, token, endpoint, retry, breaker, message_meta, use_async_engine, scope
+):
+    """Return a function that streams the content deltas of one model within `scope`, for `compare.stream_answers`."""
+
+    def open_deltas(timer):
+        with transport.abortable(scope):
+            stream = retry(
+                guarded(
+                    breaker,
+                    lambda timeout: opened(
+                        timer,
+                        open_llm_gateway_stream(
+                            use_async_engine,
+                            model=model,
+                            messages=request_messages,
+                            api_key=token,
+                            api_base=endpoint,
+                            timeout=timeout,
+                            max_retries=0,
+                        ),
+                    ),
+                    message_meta,
+                    stream=True,
+                )
+            )
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                close_stream(stream)
+
+    return open_deltas
+
 
+def send_llm_gateway_compare_request(message: dict, models: list[str]) -> Generator[dict[int, str], None, None]:
+    """Send the full conversation to several LLM Gateway models at once, see `compare.py`.
+
+    Yields the text each model added, by the index of the model in `models`. Once all models are
+    done, the first answer without an error is stored as the answer of the prompt, and all of
+    them in the message meta under `comparison`. When the Stop button is clicked, the partial
+    answers of all models are stored there.
+    """
+    meta_id = message["meta_id"]
+    # The requests are sent from worker threads, which can't read the session state
+    token, endpoint = st.session_state.token, st.session_state.endpoint
+    message_meta = st.session_state.messages_meta[meta_id]
+    answers = [ModelAnswer(model) for model in models]
+
+    def keep_partial_answers():
+        # Stop button callback, every model keeps the text it received so far
+        message_meta["comparison"] = [answer.summary() for answer in answers]
+
+    try:
+        with track_in_flight(meta_id, answers[0].collector, on_cancel=keep_partial_answers) as in_flight:
+            request_messages = get_request_messages(meta_id, _llm_gateway_summarizer(models[0], token, endpoint))
+            open_deltas = [
+                _llm_gateway_deltas(
+                    model,
+                    request_messages,
+                    token,
+                    endpoint,
+                    get_retrier(meta_id, BACKEND_PATH_LLM_GATEWAY),
+                    get_llm_gateway_circuit_breaker(model),
+                    message_meta,
+                    st.session_state.use_async_engine,
+                    in_flight.scope,
+                )
+                for model in models
+            ]
+            started = time.monotonic()
+            # Closing the comparison stops every worker, e.g. when the Stop button was clicked
+            in_flight.stream = received_text = stream_answers(answers, open_deltas)
+            for received in received_text:
+                if not received:
+                    # Session state access is a yield point, Streamlit raises here when the user clicked Stop
+                    st.session_state.get("in_flight_request")
+                yield received
+
+            message_meta["comparison"] = [answer.summary() for answer in answers]
+            message_meta["total_time"] = time.monotonic() - started
+            answered = next((answer for answer in answers if answer.error is None), None)
+            if answered is None:
+                error = "; ".join(f"{answer.model}: {answer.error}" for answer in answers)
+                set_result_message_state(meta_id, None, status=STATUS_ERROR, error=f"LLM Gateway error: {error}")
+            else:
+                set_result_message_state(meta_id, answered.text, status=STATUS_COMPLETED)
+    except Exception as exc:
+        logging.error(exc)
+        set_result_message_state(meta_id, None, status=STATUS_ERROR, error=f"LLM Gateway error: {exc}")
+
+
+def _load_application_info(endpoint, token, app_id):
     # Set HTTP headers. The charset should match the contents of the file.
     headers = {
         "Content-Type": "application/json; charset=UTF-8",
-        "Authorization": f"Bearer {st.session_state.token}",
+        "Authorization": f"Bearer {token}",
     }
-    url = f"{st.session_state.endpoint}/customApplications/{st.session_state.app_id}/"
+    url = f"{endpoint}/customApplications/{app_id}/"
 
-    response = requests.get(url, headers=headers, timeout=30)
+    response = transport.request("GET", url, APPLICATION_INFO_TIMEOUT_SECONDS, headers=headers)
 
     raise_datarobot_error_for_status(response)
     return response.json()
+
+
+def fetch_application_info(endpoint, token, app_id):
+    return metadata_cache.get(
+        ("application_info", endpoint, app_id), lambda: _load_application_info(endpoint, token, app_id)
+    )
+
+
+def get_application_info():
+    if st.session_state.app_id is None or st.session_state.app_id == "":
+        # Fallback for local development or invalid APP_ID
+        return {}
+
+    return fetch_application_info(st.session_state.endpoint, st.session_state.token, st.session_state.app_id)
+
+
+def _run_warm_up_task(task):
+    try:
+        task()
+    except Exception as exc:
+        # The same lookup is repeated by the script, which handles and reports the error
+        logging.debug("Metadata warm-up failed: %s", exc)
+
+
+def warm_up_metadata(endpoint, token, deployment_id, app_id, probe_chat_api):
+    """Start the deployment metadata lookups of a new session concurrently.
+
+    Each lookup fills the shared metadata cache, and the script joins a lookup that is still in
+    flight instead of starting its own. The first render then waits for the slowest lookup rather
+    than for all of them one after another.
+    """
+    tasks = []
+    if app_id:
+        tasks.append(lambda: fetch_application_info(endpoint, token, app_id))
+    if deployment_id:
+        tasks.append(lambda: fetch_association_id_column_name(endpoint, fetch_deployment(endpoint, deployment_id)))
+        if probe_chat_api:
+            tasks.append(lambda: get_has_chat_api_support(deployment_id, token, endpoint))
+
+    for task in tasks:
+        _warm_up_executor.submit(_run_warm_up_task, task)
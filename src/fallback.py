@@ -0,0 +1,55 @@
+"""Falling back from the deployment to an LLM Gateway model.
+
+With `FALLBACK_LLM_MODEL` set, a prompt whose deployment request fails before any of its answer
+was shown is answered by that LLM Gateway model instead. The conversation is sent the same way as
+in LLM Gateway mode, including the context token budget and summary. The deployment request fails
+over when:
+
+- the circuit breaker of the deployment is open
+- it times out, can't connect, or the deployment answers with a 429 or 5xx error
+- with `FALLBACK_LATENCY_SLO_SECONDS`, the deployment hasn't answered, or for a stream hasn't sent
+  its first token, within that time. Its answer is discarded once it arrives.
+
+Fallback answers have no citations or feedback buttons. They are marked with `fallback_model` in
+the message meta and in the message footer.
+"""
+
+import contextvars
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any
+
+from circuit_breaker import is_backend_failure
+from constants import LLM_REQUEST_WORKERS
+
+_slo_executor = ThreadPoolExecutor(max_workers=LLM_REQUEST_WORKERS, thread_name_prefix="latency-slo")
+
+
+class LatencySLOError(TimeoutError):
+    """Raised when the deployment didn't answer within FALLBACK_LATENCY_SLO_SECONDS."""
+
+    def __init__(self, slo_seconds: float):
+        super().__init__(f"The deployment didn't answer within {slo_seconds:g}s")
+
+
+def within_latency_slo(
+    send: Callable[[], Any], slo_seconds: float, discard: Callable[[Any], None] = lambda result: None
+) -> Any:
+    """Call `send`, raising `LatencySLOError` if it takes longer than `slo_seconds`.
+
+    The call isn't aborted when it misses the SLO, `discard` is called with its result if it still arrives.
+    """
+    # In a copy of the context, the request stays within its `transport.abortable` scope
+    future = _slo_executor.submit(contextvars.copy_context().run, send)
+    try:
+        return future.result(timeout=slo_seconds)
+    except TimeoutError:
+        if not future.done():
+            future.add_done_callback(lambda done: discard(done.result()) if done.exception() is None else None)
+            raise LatencySLOError(slo_seconds) from None
+        raise
+
+
+def should_fall_back(exc: BaseException) -> bool:
+    """Return whether a failed deployment request should be answered by the fallback model."""
+    return isinstance(exc, Exception) and is_backend_failure(exc)
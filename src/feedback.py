@@ -0,0 +1,168 @@
+"""Background submission of feedback values to DataRobot custom metrics.
+
+Feedback clicks only enqueue a row. A worker thread merges the rows of all sessions that target
+the same custom metric into a single `fromJSON` payload and posts them in batches, either when
+enough rows have piled up or when the flush interval elapses.
+"""
+
+import atexit
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+
+import transport
+from constants import (
+    CUSTOM_METRIC_SUBMIT_TIMEOUT_SECONDS,
+    FEEDBACK_BATCH_MAX_ROWS,
+    FEEDBACK_FLUSH_INTERVAL_SECONDS,
+    FEEDBACK_MAX_ATTEMPTS,
+    FEEDBACK_RETRY_BACKOFF_SECONDS,
+    FEEDBACK_SHUTDOWN_TIMEOUT_SECONDS,
+    REST_RETRY_STATUS_CODES,
+)
+
+
+@dataclass(frozen=True)
+class FeedbackTarget:
+    """The custom metric a feedback row is submitted to. Rows with equal targets share a payload."""
+
+    endpoint: str
+    token: str
+    deployment_id: str
+    custom_metric_id: str
+    # Only set when the custom metric is model specific
+    model_id: str | None = None
+
+    @property
+    def url(self) -> str:
+        return f"{self.endpoint}/deployments/{self.deployment_id}/customMetrics/{self.custom_metric_id}/fromJSON/"
+
+
+class FeedbackQueue:
+    """Thread-safe queue that submits custom metric rows in batches from a background worker."""
+
+    def __init__(
+        self,
+        max_batch_rows: int = FEEDBACK_BATCH_MAX_ROWS,
+        flush_interval_seconds: float = FEEDBACK_FLUSH_INTERVAL_SECONDS,
+        max_attempts: int = FEEDBACK_MAX_ATTEMPTS,
+        retry_backoff_seconds: float = FEEDBACK_RETRY_BACKOFF_SECONDS,
+    ):
+        self._max_batch_rows = max_batch_rows
+        self._flush_interval_seconds = flush_interval_seconds
+        self._max_attempts = max_attempts
+        self._retry_backoff_seconds = retry_backoff_seconds
+
+        self._condition = threading.Condition()
+        self._pending: dict[FeedbackTarget, list[dict]] = {}
+        self._pending_rows = 0
+        self._in_flight = 0
+        self._worker: threading.Thread | None = None
+        self._closed = False
+
+    def submit(self, target: FeedbackTarget, row: dict) -> None:
+        """Queue a single bucket row. Returns immediately."""
+        with self._condition:
+            if self._closed:
+                logging.warning("Feedback queue is closed, submitting feedback synchronously")
+                self._in_flight += 1
+            else:
+                self._pending.setdefault(target, []).append(row)
+                self._pending_rows += 1
+                self._ensure_worker()
+                if self._pending_rows >= self._max_batch_rows:
+                    self._condition.notify_all()
+                return
+
+        self._send_batches({target: [row]})
+
+    def flush(self) -> None:
+        """Send every queued row and wait until all in-flight batches are done."""
+        with self._condition:
+            batches = self._take_pending()
+        self._send_batches(batches)
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight == 0)
+
+    def close(self, timeout: float = FEEDBACK_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        """Stop the worker and drain whatever is still queued."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        self.flush()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="feedback-queue", daemon=True)
+            self._worker.start()
+
+    def _take_pending(self) -> dict[FeedbackTarget, list[dict]]:
+        batches = self._pending
+        self._pending = {}
+        self._pending_rows = 0
+        self._in_flight += len(batches)
+        return batches
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._pending_rows >= self._max_batch_rows,
+                    timeout=self._flush_interval_seconds,
+                )
+                if self._closed:
+                    return
+                batches = self._take_pending()
+            self._send_batches(batches)
+
+    def _send_batches(self, batches: dict[FeedbackTarget, list[dict]]) -> None:
+        for target, rows in batches.items():
+            try:
+                for start in range(0, len(rows), self._max_batch_rows):
+                    self._send(target, rows[start : start + self._max_batch_rows])
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _send(self, target: FeedbackTarget, rows: list[dict]) -> None:
+        data = {"buckets": rows}
+        if target.model_id:
+            data["modelId"] = target.model_id
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Token {target.token}",
+        }
+        serialised_data = json.dumps(data)
+
+        for attempt in range(1, self._max_attempts + 1):
+            error = None
+            try:
+                response = transport.request(
+                    "POST", target.url, CUSTOM_METRIC_SUBMIT_TIMEOUT_SECONDS, data=serialised_data, headers=headers
+                )
+                if response.ok:
+                    return
+                error = f"{response.status_code} Error: {response.text}"
+                if response.status_code not in REST_RETRY_STATUS_CODES:
+                    break
+            except requests.exceptions.RequestException as exc:
+                error = str(exc)
+
+            if attempt < self._max_attempts:
+                time.sleep(self._retry_backoff_seconds * 2 ** (attempt - 1) * (1 + random.random()))
+
+        logging.error("Failed to submit %d feedback row(s) to %s: %s", len(rows), target.url, error)
+
+
+# Shared by all sessions in the app process
+feedback_queue = FeedbackQueue()
+atexit.register(feedback_queue.close)
@@ -0,0 +1,93 @@
+"""Report how long the app's startup imports take.
+
+Runs the top-level imports of the app entry point in a fresh interpreter with `-X importtime`
+and prints the slowest packages by cumulative import time, plus which of the optional backend
+libraries were loaded. `start-app.sh` runs it before launching the app when `IMPORT_TIME_REPORT`
+is set; it can also be run by hand:
+
+    python import_report.py --top 20
+"""
+
+import argparse
+import ast
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+ENTRY_POINT = Path(__file__).parent / "qa_chat_bot.py"
+# Backend libraries that should only be imported by the app mode that needs them
+BACKEND_MODULES = ("litellm", "openai", "pandas")
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    # Nesting level, 0 for modules imported directly by the entry point
+    depth: int
+
+
+def get_entry_point_imports(path: Path = ENTRY_POINT) -> list[str]:
+    """Return the modules imported at the top level of the app entry point."""
+    modules = []
+    for node in ast.parse(path.read_text()).body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(output: str) -> list[ImportTiming]:
+    """Parse the `-X importtime` lines written to stderr."""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        name = module.lstrip()
+        depth = (len(module) - len(name) - 1) // 2
+        timings.append(ImportTiming(name, int(self_us), int(cumulative_us), depth))
+    return timings
+
+
+def collect_import_timings(modules: list[str]) -> tuple[list[ImportTiming], set[str]]:
+    """Import `modules` in a fresh interpreter. Returns the timings and the backend modules it loaded."""
+    code = (
+        f"import sys\nimport {', '.join(modules)}\nprint(','.join(m for m in {BACKEND_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ENTRY_POINT.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = {module for module in result.stdout.strip().split(",") if module}
+    return parse_importtime(result.stderr), loaded
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Print the slowest startup imports of the app.")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list")
+    args = parser.parse_args(argv)
+
+    timings, loaded = collect_import_timings(get_entry_point_imports())
+    # Packages only, their cumulative time includes all submodules
+    packages = sorted(
+        (timing for timing in timings if "." not in timing.module),
+        key=lambda timing: timing.cumulative_us,
+        reverse=True,
+    )
+    total_us = sum(timing.cumulative_us for timing in timings if timing.depth == 0)
+
+    print(f"Startup imports took {total_us / 1e6:.2f}s")
+    for timing in packages[: args.top]:
+        print(f"{timing.cumulative_us / 1e3:10.1f} ms  {timing.module}")
+    print(f"Backend modules loaded at startup: {', '.join(sorted(loaded)) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
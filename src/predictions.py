@@ -0,0 +1,156 @@
+"""Lean client for the DataRobot Prediction API.
+
+Used for deployments that do not support the Chat API. Rows are encoded straight to CSV and
+sent over the shared, pooled REST session, so a prediction does not need a DataFrame, a new
+HTTP session or a prediction server lookup per request.
+"""
+
+import csv
+import gzip
+import io
+import os
+import re
+import threading
+from typing import Any
+
+from datarobot import Deployment
+
+import transport
+from constants import (
+    MAX_PREDICTION_INPUT_SIZE_BYTES,
+    PREDICTION_GZIP_MIN_BYTES,
+    PREDICTIONS_TIMEOUT_SECONDS,
+)
+from utils import clean_prediction_column_name, raise_datarobot_error_for_status
+
+_SERVERLESS_PLATFORM = "datarobotServerless"
+_INT_PATTERN = re.compile(r"^-?\d+$")
+_FLOAT_PATTERN = re.compile(r"^-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+
+_clients: dict[tuple, "PredictionClient"] = {}
+_clients_lock = threading.Lock()
+
+
+class PredictionInputTooLargeError(Exception):
+    """Raised if the encoded prediction request exceeds the Prediction API size limit"""
+
+
+def prediction_server_override_url() -> str | None:
+    """
+    Because of the way internal networking is set up for on-prem and ST SAAS networks,
+    we need to use the service URL instead of the external URL.
+    """
+    if os.environ.get("DATAROBOT_ENDPOINT") == "http://datarobot-nginx/api/v2/":
+        return "http://datarobot-prediction-server:80/predApi/v1.0/"
+    else:
+        return None
+
+
+def encode_csv(rows: list[dict[str, Any]]) -> bytes:
+    """Encode rows as a UTF-8 CSV request body. All rows must share the keys of the first row."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _coerce_csv_value(value: str) -> Any:
+    if value == "":
+        return None
+    if value in ("True", "False"):
+        return value == "True"
+    if _INT_PATTERN.match(value):
+        return int(value)
+    if _FLOAT_PATTERN.match(value):
+        return float(value)
+    return value
+
+
+def decode_csv(content: bytes, text_columns: set[str] = frozenset()) -> list[dict[str, Any]]:
+    """Decode a Prediction API CSV response into rows with cleaned column names.
+
+    Numeric and boolean cells are converted to Python values, except for `text_columns` which are
+    always kept as strings (e.g. the LLM answer, which may well look like a number).
+    """
+    reader = csv.reader(io.StringIO(content.decode("utf-8")))
+    columns = [clean_prediction_column_name(name) for name in next(reader, [])]
+    return [
+        {
+            column: value if column in text_columns else _coerce_csv_value(value)
+            for column, value in zip(columns, values, strict=False)
+        }
+        for values in reader
+    ]
+
+
+class PredictionClient:
+    """Sends prediction requests for a single deployment to its resolved prediction URL."""
+
+    def __init__(self, url: str, headers: dict[str, str]):
+        self.url = url
+        self.headers = headers
+
+    def send(self, body: bytes) -> bytes:
+        """Send an encoded CSV request body and return the raw CSV response."""
+        if len(body) >= MAX_PREDICTION_INPUT_SIZE_BYTES:
+            raise PredictionInputTooLargeError(
+                f"Prompt input is too large: {len(body)} bytes. "
+                f"Max allowed size is: {MAX_PREDICTION_INPUT_SIZE_BYTES} bytes."
+            )
+
+        headers = self.headers
+        if len(body) >= PREDICTION_GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers = {**headers, "Content-Encoding": "gzip"}
+
+        response = transport.request(
+            "POST", self.url, PREDICTIONS_TIMEOUT_SECONDS, data=body, headers=headers, retry_all_methods=True
+        )
+        raise_datarobot_error_for_status(response)
+        return response.content
+
+    def predict(self, rows: list[dict[str, Any]], text_columns: set[str] = frozenset()) -> list[dict[str, Any]]:
+        return decode_csv(self.send(encode_csv(rows)), text_columns)
+
+
+def _resolve_prediction_url(deployment: Deployment, endpoint: str) -> tuple[str, str | None]:
+    """Return the prediction URL and the DataRobot-Key header value for a deployment"""
+    override_url = prediction_server_override_url()
+    if override_url:
+        return f"{override_url.rstrip('/')}/deployments/{deployment.id}/predictions", None
+
+    if (deployment.prediction_environment or {}).get("platform") == _SERVERLESS_PLATFORM:
+        return f"{endpoint}/deployments/{deployment.id}/predictions", None
+
+    prediction_server = deployment.default_prediction_server
+    if not prediction_server:
+        raise ValueError("Can't make prediction request because the deployment has no default prediction server")
+    url = f"{prediction_server['url']}/predApi/v1.0/deployments/{deployment.id}/predictions"
+    return url, prediction_server.get("datarobot-key")
+
+
+def get_prediction_client(deployment: Deployment, endpoint: str, token: str) -> PredictionClient:
+    """Return the shared prediction client for a deployment.
+
+    Clients are keyed on the resolved prediction URL, so a deployment that moves to a different
+    prediction server gets a fresh client the next time its metadata is refreshed.
+    """
+    url, datarobot_key = _resolve_prediction_url(deployment, endpoint)
+    key = (url, datarobot_key, token)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            headers = {
+                "Content-Type": "text/csv; charset=UTF-8",
+                "Accept": "text/csv",
+                "Authorization": f"Bearer {token}",
+            }
+            if datarobot_key:
+                headers["DataRobot-Key"] = datarobot_key
+            client = _clients[key] = PredictionClient(url, headers)
+    return client
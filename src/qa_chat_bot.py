@@ -2,21 +2,24 @@ import os
 
 import streamlit as st
 import streamlit_sal as sal
-from datarobot import Client
-from datarobot.client import set_client
 
 from components import (
     render_app_header,
+    render_bulk_sidebar,
+    render_compare_sidebar,
     render_empty_chat,
     render_message,
     render_pending_message,
     render_vdb_filter_sidebar,
 )
 from constants import *
-from dr_requests import get_has_chat_api_support
+from dr_requests import get_has_chat_api_support, warm_up_metadata
+from transport import warm_up_openai_client
 from utils import (
     add_new_prompt,
     get_app_name,
+    get_base_url,
+    get_datarobot_client,
     get_deployment,
     get_llm_models,
     get_message_by_role,
@@ -48,11 +51,25 @@ def _inject_sal_stylesheet():
 
 
 def start_streamlit():
-    # Setup DR client — reads DATAROBOT_API_TOKEN and DATAROBOT_ENDPOINT automatically
-    dr = Client()
-    set_client(dr)
+    # Setup DR client, shared by all sessions and reruns
+    dr = get_datarobot_client()
     initiate_session_state(dr)
 
+    # Load the deployment metadata concurrently, the lookups below then only wait for the slowest one
+    if "metadata_warmed_up" not in st.session_state:
+        warm_up_metadata(
+            st.session_state.endpoint,
+            st.session_state.token,
+            st.session_state.deployment_id,
+            st.session_state.app_id,
+            probe_chat_api=st.session_state.enable_chat_api,
+        )
+        st.session_state.metadata_warmed_up = True
+
+    # Render the header before the sidebar, so it is painted while the deployment lookups finish
+    _inject_sal_stylesheet()
+    render_app_header()
+
     if st.session_state.use_llm_gateway:
         # No deployment needed — route requests through the DataRobot LLM Gateway.
         set_chat_api_session_state(False)
@@ -68,6 +85,7 @@ def start_streamlit():
                     st.session_state["_llm_model_select"] = configured if configured in models else models[0]
                 st.selectbox("LLM Model", options=models, key="_llm_model_select")
                 st.session_state.llm_gateway_model = f"datarobot/{st.session_state['_llm_model_select']}"
+                render_compare_sidebar(models)
             else:
                 st.caption("No LLM Gateway models found.")
     else:
@@ -81,12 +99,15 @@ def start_streamlit():
             else False
         )
         set_chat_api_session_state(is_chat_api_enabled)
+        # Open a pooled connection to the deployment while the user is still typing the first prompt
+        if is_chat_api_enabled and "chat_api_warmed_up" not in st.session_state:
+            warm_up_openai_client(get_base_url(), st.session_state.token)
+            st.session_state.chat_api_warmed_up = True
         has_valid_deployment = bool(st.session_state.deployment_id and get_deployment())
         if get_vdb_metadata_columns():
             render_vdb_filter_sidebar()
-
-    _inject_sal_stylesheet()
-    render_app_header()
+        if st.session_state.enable_bulk_mode and has_valid_deployment:
+            render_bulk_sidebar()
 
     # You can manually enable the sidebar in `constants.py` and add your own content below
     if SHOW_SIDEBAR:
@@ -99,7 +120,7 @@ def start_streamlit():
             add_new_prompt(prompt)
 
     # Ignore any system message in the conversation context
-    filtered_messages = [msg for msg in st.session_state.messages if msg["role"] != ROLE_SYSTEM]
+    filtered_messages = st.session_state.conversation.visible_messages
     if len(filtered_messages) > 0:
         # Render all chat messages from this session on every app rerun
         for message in filtered_messages:
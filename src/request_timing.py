@@ -0,0 +1,90 @@
+"""Client-side timings of LLM requests.
+
+Every send path in `dr_requests.py` times its upstream call with a `RequestTimer` and stores the
+result in the message meta, so backends can be compared from the app itself:
+
+- `request_started_at`: when the request was sent, ISO 8601 in UTC
+- `connect_time`: seconds until the response headers arrived (streaming requests only)
+- `time_to_first_token`: seconds until the first content delta arrived (streaming requests only)
+- `inter_token_p50`, `inter_token_p95`: seconds between content deltas (streaming requests only)
+- `total_time`: seconds until the answer was complete
+- `output_tokens_per_second`: output speed, measured from the first delta for streaming requests
+"""
+
+import math
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from itertools import pairwise
+from typing import Any
+
+from context_window import count_tokens
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of `values`, which must not be empty."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class RequestTimer:
+    """Times one upstream request. Create it right before the request is sent."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.started_at = datetime.now(UTC)
+        self.start = clock()
+        self.connected_at: float | None = None
+        self.delta_times: list[float] = []
+        self._first_delta_chars = 0
+        self.finished_at: float | None = None
+
+    def connected(self) -> None:
+        """Mark that the response headers arrived, i.e. a stream was opened. Only the first stream counts."""
+        if self.connected_at is None:
+            self.connected_at = self._clock()
+
+    def delta(self, content: str) -> None:
+        """Mark that a content delta of a stream arrived."""
+        if not self.delta_times:
+            self._first_delta_chars = len(content)
+        self.delta_times.append(self._clock())
+
+    def finish(self) -> None:
+        self.finished_at = self._clock()
+
+    def summary(self, output: str | None = None) -> dict[str, Any]:
+        """Return the timings to store in the message meta, leaving out those that weren't measured."""
+        finished_at = self._clock() if self.finished_at is None else self.finished_at
+        timings = {
+            "request_started_at": self.started_at.isoformat(),
+            "total_time": finished_at - self.start,
+        }
+        if self.connected_at is not None:
+            timings["connect_time"] = self.connected_at - self.start
+        if self.delta_times:
+            timings["time_to_first_token"] = self.delta_times[0] - self.start
+        gaps = [later - earlier for earlier, later in pairwise(self.delta_times)]
+        if gaps:
+            timings["inter_token_p50"] = percentile(gaps, 0.5)
+            timings["inter_token_p95"] = percentile(gaps, 0.95)
+
+        tokens_per_second = self._tokens_per_second(output, finished_at)
+        if tokens_per_second is not None:
+            timings["output_tokens_per_second"] = tokens_per_second
+        return timings
+
+    def _tokens_per_second(self, output: str | None, finished_at: float) -> float | None:
+        if not output:
+            return None
+        if not self.delta_times:
+            # Non-streaming: the whole answer arrived at once
+            duration = finished_at - self.start
+            return count_tokens(output) / duration if duration > 0 else None
+
+        # The first delta arrives at the start of the measured interval, its tokens are not counted
+        duration = self.delta_times[-1] - self.delta_times[0]
+        if duration <= 0:
+            return None
+        tokens = count_tokens(output) - count_tokens(output[: self._first_delta_chars])
+        return tokens / duration
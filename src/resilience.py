@@ -0,0 +1,177 @@
+"""Timeouts and retries for LLM requests.
+
+Chat API and LLM Gateway requests get connect and read timeouts and a total deadline per
+backend, configured with runtime parameters. Requests that fail with a transient error (a
+connection error, a timeout or a 408/429/502/503/504 response) are retried with exponential
+backoff and full jitter, paced by `Retry-After` and rate limit headers when the server sends them.
+A retry is only started if it can still complete within the total deadline.
+
+Streams are only retried while they are being opened, never once tokens may have been shown.
+The SDK-level retries of OpenAI and LiteLLM are disabled, so a request is never retried twice over.
+"""
+
+import email.utils
+import random
+import re
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+from config import get_config
+from constants import (
+    BACKEND_PATH_LLM_GATEWAY,
+    LLM_RETRY_BACKOFF_SECONDS,
+    LLM_RETRY_MAX_BACKOFF_SECONDS,
+    LLM_RETRY_STATUS_CODES,
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+@dataclass(frozen=True)
+class Deadlines:
+    connect_seconds: float
+    # Max wait for the next bytes of the response. For a blocking request, that is the whole answer.
+    read_seconds: float
+    # All attempts of a request, including the backoff between them
+    total_seconds: float
+
+    def timeout(self, remaining_seconds: float) -> httpx.Timeout:
+        """The timeout of one attempt, which must not run past the total deadline."""
+        read = max(min(self.read_seconds, remaining_seconds), 0.001)
+        return httpx.Timeout(read, connect=min(self.connect_seconds, read))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int
+    backoff_seconds: float = LLM_RETRY_BACKOFF_SECONDS
+    max_backoff_seconds: float = LLM_RETRY_MAX_BACKOFF_SECONDS
+    retry_status_codes: tuple[int, ...] = LLM_RETRY_STATUS_CODES
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter before retrying after `attempt` failed."""
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+
+
+@dataclass
+class RetryRecord:
+    attempt: int
+    error: str
+    status_code: int | None
+    delay_seconds: float
+
+
+def get_deadlines(backend: str) -> Deadlines:
+    config = get_config()
+    if backend == BACKEND_PATH_LLM_GATEWAY:
+        return Deadlines(
+            config.llm_gateway_connect_timeout_seconds,
+            config.llm_gateway_read_timeout_seconds,
+            config.llm_gateway_total_timeout_seconds,
+        )
+    return Deadlines(
+        config.chat_api_connect_timeout_seconds,
+        config.chat_api_read_timeout_seconds,
+        config.chat_api_total_timeout_seconds,
+    )
+
+
+def get_retry_policy() -> RetryPolicy:
+    return RetryPolicy(max_attempts=get_config().llm_max_attempts)
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse a rate limit reset duration such as `20ms`, `1.5s` or `6m0s`."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def get_retry_after(headers: Mapping[str, str] | None) -> float | None:
+    """Seconds the server asks to wait before retrying, from `Retry-After` or rate limit headers."""
+    if not headers:
+        return None
+    if retry_after_ms := headers.get("retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    if retry_after := headers.get("retry-after"):
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    # Wait for whichever rate limit ran out to reset
+    resets = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{kind}") or "")
+        for kind in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0"
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def classify_error(exc: Exception, policy: RetryPolicy) -> tuple[bool, int | None, float | None]:
+    """Return whether an error is transient, its HTTP status code and the wait the server asked for."""
+    status_code = getattr(exc, "status_code", None)
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if status_code is None and isinstance(response, httpx.Response):
+        status_code = response.status_code
+
+    if isinstance(status_code, int):
+        return status_code in policy.retry_status_codes, status_code, get_retry_after(headers)
+    # Connection errors and timeouts of httpx, OpenAI and LiteLLM
+    transient = isinstance(exc, httpx.TransportError | ConnectionError | TimeoutError) or type(exc).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "Timeout",
+    )
+    return transient, None, None
+
+
+def call_with_retries(
+    send: Callable[[httpx.Timeout], Any],
+    policy: RetryPolicy,
+    deadlines: Deadlines,
+    on_retry: Callable[[RetryRecord], None],
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Any:
+    """Call `send` with the timeout of each attempt, retrying transient errors.
+
+    `on_retry` is called before every retry. The last error is raised once the attempts are used up,
+    or when waiting for the next attempt would run past the total deadline.
+    """
+    deadline = clock() + deadlines.total_seconds
+    attempt = 1
+    while True:
+        try:
+            return send(deadlines.timeout(deadline - clock()))
+        except Exception as exc:
+            transient, status_code, retry_after = classify_error(exc, policy)
+            delay = retry_after if retry_after is not None else policy.backoff(attempt)
+            # The next attempt needs at least its connect timeout before the deadline
+            if (
+                not transient
+                or attempt >= policy.max_attempts
+                or clock() + delay + deadlines.connect_seconds > deadline
+            ):
+                raise
+            on_retry(RetryRecord(attempt, str(exc), status_code, delay))
+            sleep(delay)
+            attempt += 1
@@ -0,0 +1,148 @@
+"""Process-wide cache of LLM answers for repeated questions.
+
+Many users of the same app ask the same handful of questions. With ENABLE_RESPONSE_CACHE set,
+an answer is stored under a hash of everything that determines it (the backend, the deployment
+or model, the conversation payload and the VDB metadata filters) and a later identical request
+is answered from memory without calling the LLM. Entries expire after a TTL and the least
+recently used ones are evicted to stay within an entry count and memory bound.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from config import get_config
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    content: str
+    citations: list[dict[str, Any]] | None = None
+    extra_model_output: dict[str, Any] | None = None
+
+    def estimate_size(self) -> int:
+        """Approximate memory used by the response, in bytes."""
+        size = len(self.content.encode("utf-8"))
+        for value in (self.citations, self.extra_model_output):
+            if value:
+                size += len(json.dumps(value, default=str).encode("utf-8"))
+        return size
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expirations: int = 0
+    evictions: int = 0
+
+
+@dataclass
+class _Entry:
+    response: CachedResponse
+    size: int
+    expires_at: float
+
+
+def normalize_text(text: str | None) -> str:
+    """Collapse runs of whitespace, so prompts that only differ in spacing share an entry."""
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+
+def make_cache_key(
+    backend: str, target: Any, messages: list[dict[str, Any]], metadata_filters: dict[str, Any] | None = None
+) -> str:
+    """Hash the inputs that determine an answer.
+
+    `target` identifies what answers the request, e.g. the deployment and model ID or the LLM
+    Gateway model name, so replacing the model of a deployment does not serve stale answers.
+    """
+    payload = {
+        "backend": backend,
+        "target": target,
+        "messages": [(message["role"], normalize_text(message["content"])) for message in messages],
+        "filters": metadata_filters or {},
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of responses with a TTL, an entry count and a memory bound."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = ResponseCacheStats()
+        self.size_bytes = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+    def get(self, key: str) -> CachedResponse | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now >= entry.expires_at:
+                self._remove(key)
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry.response
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        size = response.estimate_size()
+        # A response that alone exceeds the memory bound would evict everything else
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(response, size, time.monotonic() + self.ttl_seconds)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        # Called with the lock held
+        self.size_bytes -= self._entries.pop(key).size
+
+
+_response_cache: ResponseCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the response cache shared by all sessions in the app process."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                config = get_config()
+                _response_cache = ResponseCache(
+                    ttl_seconds=config.response_cache_ttl_seconds,
+                    max_entries=config.response_cache_max_entries,
+                    max_bytes=config.response_cache_max_megabytes * 1024 * 1024,
+                )
+    return _response_cache
@@ -0,0 +1,183 @@
+"""Routing prompts between replicas of a deployment.
+
+`DEPLOYMENT_ID` may list several deployments of the same blueprint. Each request is sent to the
+replica with the lowest expected wait: the EWMA of its recent latencies, times the number of
+requests it is already working on plus one. Replicas without a latency yet are assumed to be as
+fast as the fastest known one, so new replicas get their share of requests right away.
+
+The latency of a request is the time until its answer arrived, or for a stream, until the stream
+was opened, or the first token arrived when hedging. Replicas count as busy with a request
+for as long as that time.
+
+With `ENABLE_HEDGED_REQUESTS`, a request that has not been answered by the p95 latency of its
+replica is also sent to the next best replica. Whichever answers first wins, the answer of the
+other replica is discarded, and a losing stream is closed.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+from constants import (
+    LLM_REQUEST_WORKERS,
+    ROUTER_EWMA_ALPHA,
+    ROUTER_HEDGE_MIN_SAMPLES,
+    ROUTER_LATENCY_SAMPLES,
+)
+from request_timing import percentile
+
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_REQUEST_WORKERS, thread_name_prefix="hedged-request")
+
+
+@dataclass
+class ReplicaStats:
+    ewma_latency: float | None = None
+    in_flight: int = 0
+    requests: int = 0
+    # Hedged duplicates this replica answered before the replica first chosen
+    hedges_won: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=ROUTER_LATENCY_SAMPLES))
+
+
+class PrimedStream:
+    """A stream whose chunks up to the first token were read already, so a hedge can be decided on it."""
+
+    def __init__(self, stream: Iterable[Any], has_token: Callable[[Any], bool]):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._buffer: list[Any] = []
+        for chunk in self._iterator:
+            self._buffer.append(chunk)
+            if has_token(chunk):
+                break
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._buffer
+        yield from self._iterator
+
+    def close(self) -> None:
+        # Imported here, cancellation imports streamlit and is only needed once a stream is closed
+        from cancellation import close_stream
+
+        close_stream(self._stream)
+
+
+class DeploymentRouter:
+    """Thread-safe latency-aware load balancing between replicas, shared by all sessions."""
+
+    def __init__(self, ewma_alpha: float = ROUTER_EWMA_ALPHA, clock: Callable[[], float] = time.monotonic):
+        self.ewma_alpha = ewma_alpha
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._replicas: dict[str, ReplicaStats] = {}
+
+    def choose(self, deployment_ids: list[str], exclude: Iterable[str] = ()) -> str:
+        """Return the replica with the lowest expected wait, the first listed one on a tie."""
+        candidates = [deployment_id for deployment_id in deployment_ids if deployment_id not in exclude]
+        with self._lock:
+            known = [stats.ewma_latency for stats in self._replicas.values() if stats.ewma_latency is not None]
+            default_latency = min(known, default=1.0)
+
+            def expected_wait(deployment_id: str) -> float:
+                stats = self._replicas.get(deployment_id) or ReplicaStats()
+                latency = stats.ewma_latency if stats.ewma_latency is not None else default_latency
+                return latency * (stats.in_flight + 1)
+
+            return min(candidates, key=expected_wait)
+
+    def hedge_delay(self, deployment_id: str) -> float | None:
+        """The p95 latency of a replica, None until enough requests were timed."""
+        with self._lock:
+            stats = self._replicas.get(deployment_id)
+            if stats is None or len(stats.latencies) < ROUTER_HEDGE_MIN_SAMPLES:
+                return None
+            return percentile(list(stats.latencies), 0.95)
+
+    def stats(self) -> dict[str, ReplicaStats]:
+        with self._lock:
+            return {
+                deployment_id: ReplicaStats(
+                    stats.ewma_latency, stats.in_flight, stats.requests, stats.hedges_won, deque(stats.latencies)
+                )
+                for deployment_id, stats in self._replicas.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._replicas.clear()
+
+    def send(
+        self,
+        deployment_ids: list[str],
+        send_to: Callable[[str], Any],
+        hedge: bool = False,
+        discard: Callable[[Any], None] = lambda result: None,
+    ) -> tuple[Any, str]:
+        """Call `send_to` with the chosen replica, hedged on a second replica if `hedge` is set.
+
+        Returns the result and the replica that produced it. An error is raised only if every
+        replica the request was sent to failed. `discard` is called with the result of a losing
+        replica, e.g. to close its stream.
+        """
+        primary = self.choose(deployment_ids)
+        delay = self.hedge_delay(primary) if hedge and len(deployment_ids) > 1 else None
+        if delay is None:
+            return self._timed(primary, send_to), primary
+
+        # The copied context keeps the abort scope of the request, see `transport.abortable`
+        futures = {_hedge_executor.submit(contextvars.copy_context().run, self._timed, primary, send_to): primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            secondary = self.choose(deployment_ids, exclude={primary})
+            futures[_hedge_executor.submit(contextvars.copy_context().run, self._timed, secondary, send_to)] = secondary
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if winners:
+                winner = winners[0]
+                for loser in [*winners[1:], *pending]:
+                    loser.add_done_callback(lambda future: _discard_result(future, discard))
+                if futures[winner] != primary:
+                    with self._lock:
+                        self._replicas[futures[winner]].hedges_won += 1
+                return winner.result(), futures[winner]
+            error = error or next(iter(done)).exception()
+        raise error
+
+    def _timed(self, deployment_id: str, send_to: Callable[[str], Any]) -> Any:
+        with self._lock:
+            stats = self._replicas.setdefault(deployment_id, ReplicaStats())
+            stats.in_flight += 1
+            stats.requests += 1
+        started = self._clock()
+        latency = None
+        try:
+            result = send_to(deployment_id)
+            latency = self._clock() - started
+            return result
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+                # Failed requests don't tell how fast the replica answers, the circuit breaker tracks them
+                if latency is not None:
+                    stats.latencies.append(latency)
+                    if stats.ewma_latency is None:
+                        stats.ewma_latency = latency
+                    else:
+                        stats.ewma_latency += self.ewma_alpha * (latency - stats.ewma_latency)
+
+
+def _discard_result(future: Future, discard: Callable[[Any], None]) -> None:
+    if future.exception() is None:
+        discard(future.result())
+
+
+deployment_router = DeploymentRouter()
@@ -0,0 +1,161 @@
+"""Single-flight execution of identical concurrent requests.
+
+When the same question is asked in many sessions at the same moment, only the first request is
+sent upstream. The other sessions wait for its result, or for streaming requests, replay the
+chunks received so far and then follow the same stream. Nothing is kept once the request has
+completed, see `response_cache.py` for reusing finished answers.
+"""
+
+import threading
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class SingleFlightStats:
+    # Requests sent upstream
+    calls: int = 0
+    # Requests that shared the call or stream of another request
+    shared: int = 0
+
+
+class _Broadcast:
+    """The chunks of one upstream stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._items: list[Any] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self._subscribers = 0
+        # Set when every subscriber left before the stream ended
+        self.abandoned = False
+
+    def subscribe(self) -> Iterator[Any] | None:
+        """Return an iterator over all chunks, or None if the stream was abandoned."""
+        with self._condition:
+            if self.abandoned:
+                return None
+            self._subscribers += 1
+        return self._iterate()
+
+    def publish(self, item: Any) -> bool:
+        """Add a chunk. Returns False once nobody is listening anymore."""
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify_all()
+            return not self.abandoned
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def _iterate(self) -> Iterator[Any]:
+        index = 0
+        try:
+            while True:
+                with self._condition:
+                    while index >= len(self._items) and not self._done:
+                        self._condition.wait()
+                    items = self._items[index:]
+                    index += len(items)
+                    done, error = self._done, self._error
+                yield from items
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+                if self._subscribers == 0 and not self._done:
+                    self.abandoned = True
+
+
+class SingleFlight:
+    """Thread-safe deduplication of concurrent calls and streams with the same key."""
+
+    def __init__(self):
+        self.stats = SingleFlightStats()
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        self._streams: dict[Hashable, _Broadcast] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Call `fn`, or wait for the call already running for `key`.
+
+        Returns the result and whether it was shared from another caller's call. An exception
+        raised by `fn` is raised to every caller waiting on it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_shared = future is not None
+            if is_shared:
+                self.stats.shared += 1
+            else:
+                self.stats.calls += 1
+                future = self._calls[key] = Future()
+
+        if is_shared:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stream(self, key: Hashable, open_stream: Callable[[], Iterable[Any]]) -> tuple[Iterator[Any], bool]:
+        """Iterate the stream opened by `open_stream`, or attach to the stream already open for `key`.
+
+        The upstream stream is read by a background thread, so a slow subscriber does not hold up
+        the others. It is closed early only when every subscriber has stopped iterating. Returns
+        the chunk iterator and whether the stream is shared with another caller.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            chunks = broadcast.subscribe() if broadcast is not None else None
+            is_shared = chunks is not None
+            if is_shared:
+                self.stats.shared += 1
+            else:
+                self.stats.calls += 1
+                broadcast = self._streams[key] = _Broadcast()
+                chunks = broadcast.subscribe()
+
+        if not is_shared:
+            threading.Thread(
+                target=self._pump, args=(key, broadcast, open_stream), name="single-flight-stream", daemon=True
+            ).start()
+        return chunks, is_shared
+
+    def _pump(self, key: Hashable, broadcast: _Broadcast, open_stream: Callable[[], Iterable[Any]]) -> None:
+        error = None
+        try:
+            upstream = open_stream()
+            for item in upstream:
+                if not broadcast.publish(item):
+                    if hasattr(upstream, "close"):
+                        upstream.close()
+                    break
+        except BaseException as exc:
+            error = exc
+        finally:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            broadcast.finish(error)
+
+
+# Upstream requests shared by all sessions in the app process
+single_flight = SingleFlight()
@@ -7,4 +7,8 @@ cd "$(dirname "$0")"
 echo "Starting App"
 # Compile SAL stylesheet; fall back to the committed CSS if the platform can't compile
 streamlit-sal compile 2>/dev/null || echo "streamlit-sal compile skipped — using pre-compiled CSS"
+# Set IMPORT_TIME_REPORT=true to log the slowest startup imports before the app starts
+if [ "${IMPORT_TIME_REPORT:-false}" = "true" ]; then
+  python import_report.py || echo "Import time report failed"
+fi
 streamlit run --server.port=8080 qa_chat_bot.py
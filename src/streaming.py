@@ -0,0 +1,231 @@
+"""Helpers for streamed LLM answers.
+
+Every chunk passed to `st.write_stream` is a websocket message and a markdown re-render of the
+whole answer in the browser. LLMs stream a few characters per delta, so `batch_deltas` merges
+deltas until `STREAM_FLUSH_INTERVAL_MS` have passed or `STREAM_FLUSH_CHARS` characters are
+buffered. The first delta is always passed on right away, so the answer starts showing as early
+as before. The upstream stream is read on a thread of its own by `read_in_background`, so the
+buffered text is also flushed on time when the model stalls between two deltas.
+
+`MarkdownBlockStream` splits the answer into paragraphs and code blocks while it streams, so
+finished blocks are rendered once and only the last, still growing block is rendered again.
+"""
+
+import queue
+import re
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+from request_timing import RequestTimer
+
+_END = object()
+# Bullet or ordered list item marker, the group is the bullet character or the delimiter of the number
+_LIST_ITEM = re.compile(r" {0,3}(?:([-+*])|\d{1,9}([.)]))(?:[ \t]|$)")
+
+
+class _ReadError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StreamCollector:
+    """Collects the deltas of a streamed answer, and marks their arrival on a `RequestTimer`."""
+
+    def __init__(self, timer: RequestTimer | None = None):
+        self.timer = timer
+        self._parts: list[str] = []
+
+    def add(self, delta: str) -> None:
+        self._parts.append(delta)
+        if self.timer is not None:
+            self.timer.delta(delta)
+
+    @property
+    def text(self) -> str:
+        # Joined once on demand, instead of copying the answer for every delta
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+
+def batch_deltas(
+    deltas: Iterable[str],
+    flush_interval_ms: int,
+    flush_chars: int,
+    clock: Callable[[], float] = time.monotonic,
+) -> Iterator[str]:
+    """Merge `deltas` into chunks flushed every `flush_interval_ms` or `flush_chars` characters.
+
+    Deltas are flushed when the next one arrives, or when the stream ends. An empty delta is a
+    heartbeat of a source that is still waiting for the upstream, see `read_in_background`: the
+    buffered text is flushed on it once it is due. The whole input is consumed, so code that runs
+    after the last delta of a generator still runs.
+    """
+    buffer: list[str] = []
+    buffered_chars = 0
+    flush_interval = flush_interval_ms / 1000
+    last_flush_at = None
+
+    for delta in deltas:
+        if delta:
+            buffer.append(delta)
+            buffered_chars += len(delta)
+        elif not buffer:
+            continue
+        now = clock()
+        if last_flush_at is None or buffered_chars >= flush_chars or now - last_flush_at >= flush_interval:
+            yield "".join(buffer)
+            buffer.clear()
+            buffered_chars = 0
+            last_flush_at = now
+
+    if buffer:
+        yield "".join(buffer)
+
+
+def read_in_background(chunks: Iterable[Any], poll_seconds: float) -> Iterator[Any]:
+    """Iterate `chunks` on a reader thread and yield them, or None every `poll_seconds` while none arrives.
+
+    Keeps the caller responsive while the upstream stalls, e.g. to flush buffered text. Errors of
+    the upstream are raised to the caller. If the caller stops early, the reader stops after the
+    chunk it is waiting for; close the upstream stream to end that wait right away.
+    """
+    received: queue.SimpleQueue = queue.SimpleQueue()
+    stopped = threading.Event()
+
+    def _read():
+        try:
+            for chunk in chunks:
+                received.put(chunk)
+                if stopped.is_set():
+                    return
+        except BaseException as exc:
+            received.put(_ReadError(exc))
+        finally:
+            received.put(_END)
+
+    threading.Thread(target=_read, name="llm-stream-reader", daemon=True).start()
+    try:
+        while True:
+            try:
+                chunk = received.get(timeout=poll_seconds)
+            except queue.Empty:
+                yield None
+                continue
+            if chunk is _END:
+                return
+            if isinstance(chunk, _ReadError):
+                raise chunk.error
+            yield chunk
+    finally:
+        stopped.set()
+
+
+def _fence_marker(line: str) -> str | None:
+    # Opening or closing code fence, e.g. ``` or ~~~~ indented by at most three spaces
+    stripped = line.lstrip(" ")
+    if len(line) - len(stripped) > 3:
+        return None
+    for char in "`~":
+        marker = stripped[: len(stripped) - len(stripped.lstrip(char))]
+        if len(marker) >= 3:
+            return marker
+    return None
+
+
+def _list_kind(line: str) -> str | None:
+    # Items of the same list use the same bullet, or the same delimiter after their number
+    match = _LIST_ITEM.match(line)
+    return (match.group(1) or match.group(2)) if match else None
+
+
+def _split_blocks(text: str, is_complete: bool) -> tuple[list[str], str]:
+    """Split markdown into top-level blocks and the trailing block that may still grow.
+
+    A block ends at a blank line followed by an unindented line, so indented continuations of
+    list items stay with their item, or at the end of a fenced code block. Blank lines inside
+    code blocks don't split them. The items of a loose list, which are separated by blank lines,
+    stay in one block, so the list is not rendered as several lists whose numbering restarts.
+    """
+    lines = text.split("\n")
+    blocks = []
+    start = 0
+    fence = None
+    after_blank = False
+
+    for index, line in enumerate(lines):
+        # The last line may still be cut off mid-way, unless the text is complete
+        is_partial = index == len(lines) - 1 and not is_complete
+        if fence is not None:
+            marker = _fence_marker(line)
+            if (
+                not is_partial
+                and marker
+                and marker[0] == fence[0]
+                and len(marker) >= len(fence)
+                and not line.strip(marker[0] + " ")
+            ):
+                blocks.append("\n".join(lines[start : index + 1]))
+                start = index + 1
+                fence = None
+            continue
+
+        if not line.strip():
+            if start == index:
+                # Skip blank lines between blocks
+                start = index + 1
+            else:
+                after_blank = True
+            continue
+
+        if after_blank and not line[0].isspace() and not _continues_list(lines[start], line, is_partial):
+            blocks.append("\n".join(lines[start:index]).rstrip("\n"))
+            start = index
+        after_blank = False
+        fence = _fence_marker(line)
+
+    return blocks, "\n".join(lines[start:])
+
+
+def _continues_list(first_line: str, line: str, is_partial: bool) -> bool:
+    list_kind = _list_kind(first_line)
+    if list_kind is None:
+        return False
+    # A line that is still cut off may turn out to be the next item
+    return is_partial or _list_kind(line) == list_kind
+
+
+def split_markdown_blocks(text: str) -> list[str]:
+    """Split a complete markdown text into the blocks `MarkdownBlockStream` renders it as."""
+    blocks, rest = _split_blocks(text, is_complete=True)
+    return [*blocks, rest] if rest.strip() else blocks
+
+
+class MarkdownBlockStream:
+    """Splits a streamed markdown answer into finished blocks as it arrives.
+
+    Only the text after the last finished block is scanned again for every chunk, so the cost of
+    a chunk does not grow with the length of the answer.
+    """
+
+    def __init__(self):
+        self._open_parts: list[str] = []
+
+    @property
+    def open_block(self) -> str:
+        return "".join(self._open_parts)
+
+    def feed(self, chunk: str) -> list[str]:
+        """Add a chunk and return the blocks it finished."""
+        self._open_parts.append(chunk)
+        blocks, rest = _split_blocks(self.open_block, is_complete=False)
+        self._open_parts = [rest]
+        return blocks
+
+    def close(self) -> list[str]:
+        """Return the remaining blocks once the stream has ended."""
+        blocks = split_markdown_blocks(self.open_block)
+        self._open_parts = []
+        return blocks
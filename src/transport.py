@@ -0,0 +1,387 @@
+"""Shared, process-wide HTTP clients for upstream calls.
+
+Streamlit runs every session in the same process, so clients created here are reused across
+sessions and reruns. Keeping them alive means requests go out over already-open keep-alive
+connections instead of paying for a new pool and TLS handshake each time.
+
+Requests sent within an `AbortScope` can be aborted from another thread, e.g. when the user clicks
+Stop, see `abortable`. Closing a socket doesn't wake a thread that is blocked reading from it, so
+the sockets the requests of the scope are waiting on are shut down instead. The request then
+fails right away and its connection is dropped from the pool.
+"""
+
+import logging
+import socket
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext, suppress
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any
+
+import httpcore
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.util.retry import Retry
+
+from config import Config, get_config
+from constants import (
+    OPENAI_WARM_UP_TIMEOUT_SECONDS,
+    REST_CONNECT_TIMEOUT_SECONDS,
+    REST_MAX_RETRIES,
+    REST_RETRY_BACKOFF_JITTER_SECONDS,
+    REST_RETRY_BACKOFF_SECONDS,
+    REST_RETRY_STATUS_CODES,
+)
+
+if TYPE_CHECKING:
+    from litellm.llms.custom_httpx.http_handler import HTTPHandler
+    from openai import AsyncOpenAI, OpenAI
+
+_sessions: dict[bool, requests.Session] = {}
+_session_lock = threading.Lock()
+
+_openai_clients: dict[tuple[str, str], tuple["OpenAI", httpx.Client]] = {}
+_async_openai_clients: dict[tuple[str, str], "AsyncOpenAI"] = {}
+_openai_clients_lock = threading.Lock()
+_llm_gateway_client: "HTTPHandler | None" = None
+
+
+class RequestAborted(Exception):
+    """Raised by the requests of an aborted `AbortScope`."""
+
+
+class AbortScope:
+    """The HTTP requests sent for one prompt, which another thread can abort, see `abortable`.
+
+    Only the sockets requests are reading from or writing to at the moment are tracked, so a
+    keep-alive connection used by another request afterwards is never affected. Once aborted, any
+    further request of the scope raises `RequestAborted`, so retries don't open new connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets: set[socket.socket] = set()
+        self.aborted = False
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            # Shut down under the lock: once a socket is untracked, it may already carry another request
+            for sock in self._sockets:
+                # Fails if its connection closed it already
+                with suppress(OSError):
+                    sock.shutdown(socket.SHUT_RDWR)
+
+    @contextmanager
+    def _track(self, sock: socket.socket | None) -> Iterator[None]:
+        """Track `sock` while the current thread is reading from or writing to it."""
+        with self._lock:
+            if self.aborted:
+                raise RequestAborted("The request was stopped")
+            if sock is not None:
+                self._sockets.add(sock)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sockets.discard(sock)
+
+
+_abort_scope: ContextVar[AbortScope | None] = ContextVar("abort_scope", default=None)
+
+
+@contextmanager
+def abortable(scope: AbortScope) -> Iterator[None]:
+    """Send the requests of the current thread within `scope`.
+
+    Applies to the DataRobot REST session, the OpenAI clients and the LLM Gateway client of this
+    module. Threads don't inherit the scope, run their work in `contextvars.copy_context()` for that.
+    """
+    token = _abort_scope.set(scope)
+    try:
+        yield
+    finally:
+        _abort_scope.reset(token)
+
+
+def iterate_abortable(scope: AbortScope, items: Iterable[Any]) -> Iterator[Any]:
+    """Iterate `items` within `scope`, for iterators that read from the network as they go, e.g. streams."""
+    with abortable(scope):
+        yield from items
+
+
+@contextmanager
+def _using_socket(sock: socket.socket | None) -> Iterator[None]:
+    scope = _abort_scope.get()
+    if scope is None:
+        yield
+        return
+    with scope._track(sock):
+        yield
+
+
+class _AbortableStream(httpcore.NetworkStream):
+    def __init__(self, stream: httpcore.NetworkStream):
+        self._stream = stream
+        ssl_object = stream.get_extra_info("ssl_object")
+        # An HTTP/2 connection also carries the requests of other sessions, so it is never aborted.
+        # Closing the response of a stream resets just that stream.
+        self._is_shared = ssl_object is not None and ssl_object.selected_alpn_protocol() == "h2"
+        self._socket = stream.get_extra_info("socket")
+
+    def _in_use(self):
+        return nullcontext() if self._is_shared else _using_socket(self._socket)
+
+    def read(self, max_bytes: int, timeout: float | None = None) -> bytes:
+        with self._in_use():
+            return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer: bytes, timeout: float | None = None) -> None:
+        with self._in_use():
+            self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None) -> httpcore.NetworkStream:
+        with self._in_use():
+            return _AbortableStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info: str) -> Any:
+        return self._stream.get_extra_info(info)
+
+
+class _AbortableBackend(httpcore.NetworkBackend):
+    def __init__(self, backend: httpcore.NetworkBackend):
+        self._backend = backend
+
+    def connect_tcp(self, *args, **kwargs) -> httpcore.NetworkStream:
+        with _using_socket(None):
+            return _AbortableStream(self._backend.connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs) -> httpcore.NetworkStream:
+        with _using_socket(None):
+            return _AbortableStream(self._backend.connect_unix_socket(*args, **kwargs))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+class _AbortableTransport(httpx.HTTPTransport):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # httpx has no option for the network backend of its connection pool
+        self._pool._network_backend = _AbortableBackend(self._pool._network_backend)
+
+
+class _AbortableConnectionMixin:
+    # A blocking request spends its time waiting for the response, only that wait is tracked
+
+    def connect(self) -> None:
+        with _using_socket(None):
+            super().connect()
+
+    def getresponse(self):
+        with _using_socket(self.sock):
+            return super().getresponse()
+
+
+class _AbortableHTTPConnection(_AbortableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _AbortableHTTPSConnection(_AbortableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool,
+        }
+
+
+def _build_session(config: Config, retry_all_methods: bool) -> requests.Session:
+    retry = Retry(
+        total=REST_MAX_RETRIES,
+        backoff_factor=REST_RETRY_BACKOFF_SECONDS,
+        backoff_jitter=REST_RETRY_BACKOFF_JITTER_SECONDS,
+        status_forcelist=REST_RETRY_STATUS_CODES,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    if retry_all_methods:
+        retry.allowed_methods = None
+    adapter = _AbortableHTTPAdapter(pool_maxsize=config.http_max_connections, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(retry_all_methods: bool = False) -> requests.Session:
+    """Return the process-wide requests session used for DataRobot REST calls.
+
+    Requests that fail with 429/5xx are retried with jittered exponential backoff, honouring
+    `Retry-After` when the server sends it. Only idempotent methods are retried unless
+    `retry_all_methods` is set, which is meant for requests that are safe to replay such as predictions.
+    """
+    session = _sessions.get(retry_all_methods)
+    if session is not None:
+        return session
+
+    with _session_lock:
+        session = _sessions.get(retry_all_methods)
+        if session is None:
+            session = _sessions[retry_all_methods] = _build_session(get_config(), retry_all_methods)
+    return session
+
+
+def request(method: str, url: str, timeout: float, retry_all_methods: bool = False, **kwargs) -> requests.Response:
+    """Send a DataRobot REST request through the shared session.
+
+    `timeout` is the read timeout for the endpoint; the connect timeout is the same for all endpoints.
+    """
+    session = get_session(retry_all_methods)
+    return session.request(method, url, timeout=(REST_CONNECT_TIMEOUT_SECONDS, timeout), **kwargs)
+
+
+def _get_http_client_options(config: Config) -> dict:
+    limits = httpx.Limits(
+        max_connections=config.http_max_connections,
+        max_keepalive_connections=config.http_max_keepalive_connections,
+        keepalive_expiry=config.http_keepalive_expiry_seconds,
+    )
+    http2 = config.enable_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("ENABLE_HTTP2 is set but the `h2` package is not installed, falling back to HTTP/1.1")
+            http2 = False
+    return {"limits": limits, "http2": http2}
+
+
+def _build_http_client(config: Config) -> httpx.Client:
+    from openai import DefaultHttpxClient
+
+    options = _get_http_client_options(config)
+    return DefaultHttpxClient(limits=options["limits"], transport=_AbortableTransport(**options))
+
+
+def _get_openai_timeout(config: Config) -> httpx.Timeout:
+    # Requests are retried by `resilience.call_with_retries`, which also sets the timeouts
+    # of each attempt. These defaults apply to the other requests, e.g. context summaries.
+    return httpx.Timeout(config.chat_api_read_timeout_seconds, connect=config.chat_api_connect_timeout_seconds)
+
+
+def _get_openai_client_entry(base_url: str, token: str) -> tuple["OpenAI", httpx.Client]:
+    # openai is imported on first use so that Prediction API and LLM Gateway apps never load it
+    from openai import OpenAI
+
+    key = (base_url, token)
+    entry = _openai_clients.get(key)
+    if entry is not None:
+        return entry
+
+    with _openai_clients_lock:
+        entry = _openai_clients.get(key)
+        if entry is None:
+            config = get_config()
+            http_client = _build_http_client(config)
+            client = OpenAI(
+                base_url=base_url,
+                api_key=token,
+                http_client=http_client,
+                timeout=_get_openai_timeout(config),
+                max_retries=0,
+            )
+            entry = (client, http_client)
+            _openai_clients[key] = entry
+    return entry
+
+
+def get_openai_client(base_url: str, token: str) -> "OpenAI":
+    """Return the shared OpenAI client for a deployment base URL and API token.
+
+    The client is created on first use and then reused by every session in the process.
+    Both OpenAI and the underlying httpx pool are thread-safe.
+    """
+    return _get_openai_client_entry(base_url, token)[0]
+
+
+def get_async_openai_client(base_url: str, token: str) -> "AsyncOpenAI":
+    """Return the shared AsyncOpenAI client for a deployment base URL and API token.
+
+    Only used on the loop of `async_engine.py`, an async connection pool can't be shared between loops.
+    """
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    key = (base_url, token)
+    client = _async_openai_clients.get(key)
+    if client is not None:
+        return client
+
+    with _openai_clients_lock:
+        client = _async_openai_clients.get(key)
+        if client is None:
+            config = get_config()
+            client = _async_openai_clients[key] = AsyncOpenAI(
+                base_url=base_url,
+                api_key=token,
+                http_client=DefaultAsyncHttpxClient(**_get_http_client_options(config)),
+                timeout=_get_openai_timeout(config),
+                max_retries=0,
+            )
+    return client
+
+
+def get_llm_gateway_client() -> "HTTPHandler":
+    """Return the LiteLLM HTTP client for LLM Gateway requests, shared by every session in the process.
+
+    Pass it as `client` to `litellm.completion`, so the requests can be aborted, see `abortable`.
+    """
+    global _llm_gateway_client
+    if _llm_gateway_client is not None:
+        return _llm_gateway_client
+
+    # litellm takes seconds to import, so only gateway-mode apps load it
+    from litellm.llms.custom_httpx.http_handler import HTTPHandler
+
+    with _openai_clients_lock:
+        if _llm_gateway_client is None:
+            options = _get_http_client_options(get_config())
+            _llm_gateway_client = HTTPHandler(
+                client=httpx.Client(limits=options["limits"], transport=_AbortableTransport(**options))
+            )
+    return _llm_gateway_client
+
+
+def warm_up_openai_client(base_url: str, token: str) -> None:
+    """Open a keep-alive connection to the deployment in the background.
+
+    The response itself is ignored; the point is to have the TCP/TLS connection sitting in the
+    pool by the time the first prompt is sent.
+    """
+    http_client = _get_openai_client_entry(base_url, token)[1]
+
+    def _warm_up():
+        try:
+            http_client.head(base_url, timeout=OPENAI_WARM_UP_TIMEOUT_SECONDS)
+        except httpx.HTTPError as exc:
+            logging.debug("Chat API connection warm-up failed: %s", exc)
+
+    threading.Thread(target=_warm_up, name="openai-warm-up", daemon=True).start()
@@ -3,20 +3,37 @@ import logging
 import re
 import uuid
 from contextlib import contextmanager
+from functools import lru_cache
 from typing import Any, cast
 
 import requests
 import streamlit as st
 from datarobot import AppPlatformError, Client, Deployment
-from openai import APIError
-
-from config import Config
-from constants import ROLE_ASSISTANT, ROLE_SYSTEM, STATUS_ERROR, STATUS_PENDING
+from datarobot.client import set_client
+
+import transport
+from caching import metadata_cache
+from circuit_breaker import CircuitOpenError
+from config import environment_snapshot, get_config
+from constants import (
+    BACKEND_PATH_CHAT_API,
+    BACKEND_PATH_LLM_GATEWAY,
+    BACKEND_PATH_PREDICTION_API,
+    LLM_GATEWAY_CATALOG_TIMEOUT_SECONDS,
+    STATUS_ERROR,
+    STATUS_PENDING,
+)
+from context_window import RollingSummary
+from conversation import ConversationStore
 
 
 class DataRobotPredictionError(Exception):
     """Raised if there are issues getting predictions from DataRobot"""
 
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class ResponseProcessingError(Exception):
     """Raised if the app faces issues processing the response from OpenAI"""
@@ -28,7 +45,7 @@ def raise_datarobot_error_for_status(response):
         response.raise_for_status()
     except requests.exceptions.HTTPError:
         err_msg = f"{response.status_code} Error: {response.text}"
-        raise DataRobotPredictionError(err_msg) from None
+        raise DataRobotPredictionError(err_msg, response.status_code) from None
 
 
 _VDB_FILTER_ERROR_FRAGMENT = "Vector database request returned an error"
@@ -41,50 +58,63 @@ def get_vdb_metadata_columns() -> list[str]:
     runtime parameter on the deployment). Returns an empty list when not configured,
     which falls back to a free-text input in the sidebar.
     """
-    raw = getattr(Config(), "vdb_metadata_columns", None)
+    raw = getattr(get_config(), "vdb_metadata_columns", None)
     if not raw:
         return []
     return [c.strip() for c in raw.split(",") if c.strip()]
 
 
-@st.cache_data(show_spinner=False)
+def fetch_deployment(endpoint, deployment_id):
+    """Return the cached deployment, loading it on a miss. Raises AppPlatformError if it can't be loaded."""
+    return metadata_cache.get(("deployment", endpoint, deployment_id), lambda: Deployment.get(deployment_id))
+
+
 def get_deployment():
     try:
-        return Deployment.get(st.session_state.deployment_id)
+        return fetch_deployment(st.session_state.endpoint, st.session_state.deployment_id)
     except AppPlatformError:
         logging.error("Failed to get deployment")
         return None
 
 
-@st.cache_data(show_spinner=False)
-def get_base_url():
+def get_base_url(deployment_id=None):
+    """Return the Chat API base URL of a deployment, by default the primary deployment."""
     endpoint = st.session_state.endpoint
-    deployment_id = st.session_state.deployment_id
+    deployment_id = deployment_id or st.session_state.deployment_id
     return f"{endpoint}/deployments/{deployment_id}"
 
 
-@st.cache_data(show_spinner=False)
-def get_association_id_column_name():
-    deployment = get_deployment()
-
+def _load_association_id_column_name(deployment):
     # The library typing sets the return value as <string>, but it actually returns a <dict>. Cast it here
     deployment_association_id_settings = cast(dict[str, Any], deployment.get_association_id_settings())
     association_id_names = deployment_association_id_settings.get("column_names")
     return association_id_names[0] if association_id_names else None
 
 
+def fetch_association_id_column_name(endpoint, deployment):
+    return metadata_cache.get(
+        ("association_id_column_name", endpoint, deployment.id),
+        lambda: _load_association_id_column_name(deployment),
+    )
+
+
+def get_association_id_column_name():
+    return fetch_association_id_column_name(st.session_state.endpoint, get_deployment())
+
+
 def get_app_name():
-    return Config().app_name
+    return get_config().app_name
 
 
 @st.cache_data(show_spinner=False)
 def get_llm_models(token: str, endpoint: str) -> list[str]:
     """List model names available in the DataRobot LLM Gateway (/genai/llmgw/catalog/)."""
     try:
-        resp = requests.get(
+        resp = transport.request(
+            "GET",
             f"{endpoint.rstrip('/')}/genai/llmgw/catalog/",
+            LLM_GATEWAY_CATALOG_TIMEOUT_SECONDS,
             headers={"Authorization": f"Bearer {token}"},
-            timeout=15,
         )
         resp.raise_for_status()
         return [item["model"] for item in resp.json().get("data", [])]
@@ -93,8 +123,33 @@ def get_llm_models(token: str, endpoint: str) -> list[str]:
         return []
 
 
+@lru_cache(maxsize=1)
+def _create_datarobot_client(env: frozenset[tuple[str, str]]) -> Client:
+    # Reads DATAROBOT_API_TOKEN and DATAROBOT_ENDPOINT automatically
+    dr = Client()
+    set_client(dr)
+    return dr
+
+
+def get_datarobot_client() -> Client:
+    """Return the process-wide DataRobot client, created again only when the environment changes.
+
+    Creating a client checks the server version with an API call, so it is not done on every rerun.
+    """
+    return _create_datarobot_client(environment_snapshot())
+
+
+def get_llm_gateway_model_name(model: str) -> str:
+    """Return the LiteLLM model string of an LLM Gateway model, which has the `datarobot/` provider prefix."""
+    return model if model.startswith("datarobot/") else f"datarobot/{model}"
+
+
 def initiate_session_state(dr: Client):
-    config = Config()
+    # Everything below only needs to run once per session
+    if st.session_state.get("session_initialized"):
+        return
+
+    config = get_config()
 
     if "token" not in st.session_state:
         st.session_state.token = dr.token
@@ -102,55 +157,97 @@ def initiate_session_state(dr: Client):
         st.session_state.endpoint = dr.endpoint
     if "custom_metric_id" not in st.session_state:
         st.session_state.custom_metric_id = config.custom_metric_id
+    if "deployment_ids" not in st.session_state:
+        st.session_state.deployment_ids = config.deployment_ids
     if "deployment_id" not in st.session_state:
-        st.session_state.deployment_id = config.deployment_id
+        st.session_state.deployment_id = st.session_state.deployment_ids[0] if st.session_state.deployment_ids else None
     if "app_id" not in st.session_state:
         st.session_state.app_id = config.application_id
     if "enable_chat_api" not in st.session_state:
         st.session_state.enable_chat_api = config.enable_chat_api
     if "enable_chat_api_streaming" not in st.session_state:
         st.session_state.enable_chat_api_streaming = config.enable_chat_api_streaming
+    if "stream_flush_interval_ms" not in st.session_state:
+        st.session_state.stream_flush_interval_ms = config.stream_flush_interval_ms
+    if "stream_flush_chars" not in st.session_state:
+        st.session_state.stream_flush_chars = config.stream_flush_chars
+    if "enable_bulk_mode" not in st.session_state:
+        st.session_state.enable_bulk_mode = config.enable_bulk_mode
     # True when running without a Deployment — routes requests through the LLM Gateway instead.
     if "use_llm_gateway" not in st.session_state:
         st.session_state.use_llm_gateway = not bool(st.session_state.deployment_id)
     if "llm_gateway_model" not in st.session_state:
-        model = config.datarobot_llm_model
-        if not model.startswith("datarobot/"):
-            model = f"datarobot/{model}"
-        st.session_state.llm_gateway_model = model
+        st.session_state.llm_gateway_model = get_llm_gateway_model_name(config.datarobot_llm_model)
+    # LLM Gateway models a prompt is sent to at once, set in the sidebar. Empty unless comparing models.
+    if "llm_compare_models" not in st.session_state:
+        st.session_state.llm_compare_models = []
+    if "fallback_llm_model" not in st.session_state:
+        fallback_model = config.fallback_llm_model
+        st.session_state.fallback_llm_model = get_llm_gateway_model_name(fallback_model) if fallback_model else None
+    if "fallback_latency_slo_seconds" not in st.session_state:
+        st.session_state.fallback_latency_slo_seconds = config.fallback_latency_slo_seconds
+
+    if "context_token_budget" not in st.session_state:
+        st.session_state.context_token_budget = config.context_token_budget
+    if "enable_context_summary" not in st.session_state:
+        st.session_state.enable_context_summary = config.enable_context_summary
+    if "context_summary" not in st.session_state:
+        st.session_state.context_summary = RollingSummary()
+
+    if "enable_response_cache" not in st.session_state:
+        st.session_state.enable_response_cache = config.enable_response_cache
+    if "enable_request_coalescing" not in st.session_state:
+        st.session_state.enable_request_coalescing = config.enable_request_coalescing
+    if "enable_circuit_breaker" not in st.session_state:
+        st.session_state.enable_circuit_breaker = config.enable_circuit_breaker
+    if "enable_hedged_requests" not in st.session_state:
+        st.session_state.enable_hedged_requests = config.enable_hedged_requests
+    if "use_async_engine" not in st.session_state:
+        st.session_state.use_async_engine = config.use_async_engine
 
     if "vdb_metadata_filters" not in st.session_state:
         st.session_state.vdb_metadata_filters = dict(config.vdb_metadata_filter or {})
 
-    # Create messages storage on first render
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    # Create messages storage on first render. `messages` and `messages_meta` are views of the store.
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = ConversationStore()
+        st.session_state.messages = st.session_state.conversation.messages
+        st.session_state.messages_meta = st.session_state.conversation.meta
 
-    if config.system_prompt and len(st.session_state.messages) == 0:
-        st.session_state.messages.append({"role": ROLE_SYSTEM, "content": config.system_prompt})
-
-    if "messages_meta" not in st.session_state:
-        st.session_state.messages_meta = {}
+    if config.system_prompt and len(st.session_state.conversation) == 0:
+        st.session_state.conversation.add_system_message(config.system_prompt)
 
     if "pending_message_id" not in st.session_state:
         st.session_state.pending_message_id = None
 
+    st.session_state.session_initialized = True
+
 
 def set_chat_api_session_state(is_chat_api_enabled):
     if "is_chat_api_enabled" not in st.session_state or st.session_state.is_chat_api_enabled != is_chat_api_enabled:
         st.session_state.is_chat_api_enabled = is_chat_api_enabled
 
+    # Expose which backend serves the prompts, it can change while the session is open
+    if st.session_state.use_llm_gateway:
+        backend_path = BACKEND_PATH_LLM_GATEWAY
+    elif is_chat_api_enabled:
+        backend_path = BACKEND_PATH_CHAT_API
+    else:
+        backend_path = BACKEND_PATH_PREDICTION_API
+    if st.session_state.get("backend_path") != backend_path:
+        logging.info("Sending prompts through the %s backend", backend_path)
+        st.session_state.backend_path = backend_path
+
 
 def add_new_prompt(prompt):
     new_prompt_id = str(uuid.uuid4())
-    new_prompt = {"role": "user", "content": prompt, "meta_id": new_prompt_id}
-
-    st.session_state.messages.append(new_prompt)
-    st.session_state.messages_meta[new_prompt_id] = {
+    meta = {
         "status": STATUS_PENDING,
         "error_message": None,
         "feedback_value": None,
     }
+
+    st.session_state.conversation.add_prompt(new_prompt_id, prompt, meta)
     st.session_state.pending_message_id = new_prompt_id
 
 
@@ -176,7 +273,7 @@ def process_citations(citations: dict[str:Any]) -> list[dict[str:Any]]:
     ]
 
 
-# Process function for the result from datarobot-predict
+# Process function for the result from the Prediction API
 def process_predict_citations(input_dict: dict[str:Any]) -> list[dict[str:Any]]:
     """Processes citation data"""
     output_list = []
@@ -235,13 +332,8 @@ def split_source_page(link):
         return link[:-1], None
 
 
-def rename_dataframe_columns(df):
-    def clean_column_name(name):
-        return name.replace("_PREDICTION", "").replace("_OUTPUT", "")
-
-    # Apply the function to all column names
-    df.columns = [clean_column_name(col) for col in df.columns]
-    return df
+def clean_prediction_column_name(name):
+    return name.replace("_PREDICTION", "").replace("_OUTPUT", "")
 
 
 def escape_result_text(text):
@@ -250,27 +342,11 @@ def escape_result_text(text):
 
 
 def get_message_by_role(role, meta_id):
-    return next(
-        (msg for msg in st.session_state.messages if msg.get("meta_id", None) == meta_id and msg["role"] == role), None
-    )
-
-
-def sanitize_messages_for_request(messages):
-    """Strips meta_id and any invalid fields from the messages, otherwise OpenAI will fail due to schema mismatch"""
-    sanitized_messages = []
-    for i, message in enumerate(messages):
-        if message["content"] is None:
-            if i > 0 and messages[i - 1]["meta_id"] == message["meta_id"]:
-                sanitized_messages.pop()
-            continue
-
-        sanitized_messages.append({key: message[key] for key in message if key in {"role", "content"}})
-
-    return sanitized_messages
+    return st.session_state.conversation.get_message(role, meta_id)
 
 
 def set_result_message_state(meta_id, content, status, citations=None, extra_model_output=None, error=None):
-    st.session_state.messages.append({"role": ROLE_ASSISTANT, "content": content, "meta_id": meta_id})
+    st.session_state.conversation.add_answer(meta_id, content)
     set_result_message_meta_state(meta_id, status, citations, extra_model_output, error)
     st.session_state.pending_message_id = None
 
@@ -306,6 +382,9 @@ def set_result_message_meta_state(meta_id, status, citations=None, extra_model_o
 
 @contextmanager
 def handle_chat_api_error(meta_id):
+    # Imported here so that apps using the Prediction API or the LLM Gateway never load openai
+    from openai import APIError
+
     try:
         yield
     except APIError as e:
@@ -326,5 +405,7 @@ def handle_chat_api_error(meta_id):
     except ResponseProcessingError as e:
         request_error = "{reason}  \n{msg}".format(reason="Error processing response from Chat API", msg=e)
         set_result_message_state(meta_id, None, status=STATUS_ERROR, error=request_error)
+    except CircuitOpenError as e:
+        set_result_message_state(meta_id, None, status=STATUS_ERROR, error=str(e))
     except Exception as e:
         set_result_message_state(meta_id, None, status=STATUS_ERROR, error=f"An unexpected error occurred: {e}")
@@ -20,6 +20,41 @@ sys.path.insert(0, str(src_path))
 
 
 # Fixtures
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    """Deployment metadata is cached process-wide, start every test with an empty cache"""
+    from caching import metadata_cache
+
+    metadata_cache.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Answers are cached process-wide when ENABLE_RESPONSE_CACHE is set, don't share them between tests"""
+    import response_cache
+
+    response_cache._response_cache = None
+
+
+@pytest.fixture(autouse=True)
+def clear_circuit_breakers():
+    """Circuit breakers are shared by all sessions of the process.
+
+    Don't let failures of one test open them in another.
+    """
+    from circuit_breaker import circuit_breakers
+
+    circuit_breakers.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_deployment_router():
+    """Replica latencies are tracked process-wide, don't let one test steer the routing of another"""
+    from router import deployment_router
+
+    deployment_router.clear()
+
+
 @pytest.fixture(scope='module')
 def deployment_id():
     return 'deployment_id_' + str(ObjectId())
@@ -65,6 +100,11 @@ def prediction_api_url():
     return "https://prediction-test.dynamic.orm.datarobot.com"
 
 
+@pytest.fixture
+def prediction_endpoint(prediction_api_url, deployment_id):
+    return f"{prediction_api_url}/predApi/v1.0/deployments/{deployment_id}/predictions"
+
+
 @pytest.fixture
 def feedback_endpoint(datarobot_endpoint, deployment_id, custom_metric_id):
     return f"{datarobot_endpoint}/deployments/{deployment_id}/customMetrics/{custom_metric_id}/fromJSON/"
@@ -347,6 +387,17 @@ def mock_deployment_api(
     )
 
 
+def mock_prediction_response(prediction_endpoint, mock_file):
+    current_dir = os.path.dirname(__file__)
+    with open(os.path.join(current_dir, f"mocks/{mock_file}"), "rb") as csv_file:
+        responses.post(prediction_endpoint, body=csv_file.read(), content_type="text/csv")
+
+
+@pytest.fixture
+def mock_prediction_api(prediction_endpoint):
+    mock_prediction_response(prediction_endpoint, 'prediction_response.csv')
+
+
 def find_request_by_url(calls, url):
     return next(
         (c for c in calls if c.request.url == url),
@@ -442,7 +493,7 @@ def mock_set_env_llm_gateway(
 
 @pytest.fixture
 def mock_bad_request_error(datarobot_endpoint, deployment_id):
-    def raise_bad_request_error(model, messages):
+    def raise_bad_request_error(model, messages, **kwargs):
         mock_response = httpx.Response(
             status_code=400,
             request=httpx.Request("POST", f"{datarobot_endpoint}/deployments/{deployment_id}/"),
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.async_engine import async_engine
+
+
+async def open_chunks(*chunks, error=None):
+    async def read():
+        for chunk in chunks:
+            yield chunk
+        if error:
+            raise error
+
+    return read()
+
+
+def test_stream_bridge_iterates_async_stream():
+    assert list(async_engine.stream(open_chunks("Paris ", "is the capital."))) == ["Paris ", "is the capital."]
+
+    bridge = async_engine.stream(open_chunks("Paris ", error=ConnectionError("Connection lost")))
+    assert next(bridge) == "Paris "
+    with pytest.raises(ConnectionError, match="Connection lost"):
+        next(bridge)
+
+    async def open_failing():
+        raise TimeoutError("Timed out")
+
+    # Errors while opening are raised by the caller, so they can be retried
+    with pytest.raises(TimeoutError, match="Timed out"):
+        async_engine.stream(open_failing())
+
+
+def test_stream_bridge_close_closes_async_stream():
+    closed = threading.Event()
+
+    async def open_endless():
+        async def read():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "token "
+            finally:
+                closed.set()
+
+        return read()
+
+    bridge = async_engine.stream(open_endless())
+    assert next(bridge) == "token "
+    bridge.close()
+    assert closed.wait(timeout=1)
+    assert list(bridge) == []
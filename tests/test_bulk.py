@@ -0,0 +1,112 @@
+import gc
+import io
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+import responses
+
+from src import bulk
+from src.predictions import PredictionClient
+
+PREDICTION_URL = "https://prediction-test.dynamic.orm.datarobot.com/predApi/v1.0/deployments/abc/predictions"
+
+
+def test_read_prompts_from_csv_and_jsonl():
+    assert list(bulk.read_prompts(io.StringIO('prompt,other\nHello,1\n"Hi, there",2\n'), "csv")) == [
+        "Hello",
+        "Hi, there",
+    ]
+    assert list(bulk.read_prompts(io.StringIO('{"prompt": "Hello"}\n\n{"prompt": "Hi"}\n'), "jsonl")) == ["Hello", "Hi"]
+    with pytest.raises(ValueError, match="Row 1 has no `prompt` field"):
+        list(bulk.read_prompts(io.StringIO('{"prompt": "Hello"}\n{"question": "Hi"}\n'), "jsonl"))
+
+
+def test_chunk_prompts_respects_size_and_row_limits():
+    prompts = [f"prompt {i}" for i in range(7)]
+
+    chunks = list(bulk.chunk_prompts(prompts, "promptText", max_rows=3))
+    assert [chunk.start_index for chunk in chunks] == [0, 3, 6]
+    assert chunks[0].body == b"promptText\n'prompt 0'\n'prompt 1'\n'prompt 2'\n"
+
+    chunks = list(bulk.chunk_prompts(prompts, "promptText", "association_id", max_bytes=120))
+    assert all(len(chunk.body) <= 120 for chunk in chunks)
+    assert sum(len(chunk.prompts) for chunk in chunks) == len(prompts)
+    assert all(chunk.body.startswith(b"association_id,promptText\n") for chunk in chunks)
+
+
+def test_extract_citations_from_result_frame():
+    df = pd.DataFrame(
+        {
+            "CITATION_CONTENT_0": ["first", "third"],
+            "CITATION_SOURCE_0": ["a.txt", "c.txt"],
+            "CITATION_PAGE_0": [0, 2],
+            "CITATION_CONTENT_1": ["second", None],
+            "CITATION_SOURCE_1": ["b.txt", None],
+            "CITATION_PAGE_1": [1, None],
+        },
+        dtype=object,
+    )
+    assert bulk.extract_citations(df) == [
+        [{"text": "first", "source": "a.txt", "page": 0}, {"text": "second", "source": "b.txt", "page": 1}],
+        # Like `process_predict_citations`, empty citations are kept
+        [{"text": "third", "source": "c.txt", "page": 2}, {"text": None, "source": None, "page": None}],
+    ]
+
+
+@responses.activate
+def test_run_bulk_job_streams_results_to_csv():
+    responses.post(
+        PREDICTION_URL,
+        body=b"resultText_PREDICTION,datarobot_latency_OUTPUT\n42,0.5\nNA,0.5\n",
+        content_type="text/csv",
+    )
+    responses.post(PREDICTION_URL, status=400, body=b"Bad request")
+    client = PredictionClient(PREDICTION_URL, {})
+    output = io.StringIO()
+
+    rows_written = bulk.run_bulk_job(
+        client, ["one", "two", "three"], output, "promptText", "resultText", max_workers=1, max_chunk_rows=2
+    )
+
+    assert rows_written == 3
+    results = pd.read_csv(io.StringIO(output.getvalue()), dtype={"answer": str}, keep_default_na=False)
+    results = results.sort_values("row_index")
+    assert list(results["prompt"]) == ["one", "two", "three"]
+    assert list(results["answer"]) == ["42", "NA", ""]
+    assert json.loads(results["citations"].iloc[0]) == []
+    assert "400 Error: Bad request" in results["error"].iloc[2]
+
+
+def test_bulk_results_file_is_removed_explicitly_or_with_its_owner():
+    results = bulk.BulkResultsFile()
+    path = Path(results.path)
+    assert path.exists()
+    results.remove()
+    assert not path.exists()
+    results.remove()
+
+    results = bulk.BulkResultsFile()
+    path = Path(results.path)
+    del results
+    gc.collect()
+    assert not path.exists()
+
+
+@patch("src.bulk.run_bulk_job", return_value=0)
+@patch("src.bulk.get_prediction_client")
+@patch("src.bulk.get_bulk_columns", return_value=("promptText", "resultText", None))
+@patch("src.bulk.Deployment")
+@patch("src.bulk.Client")
+def test_main_scores_with_the_primary_of_several_deployments(
+    _client, deployment, _columns, _prediction_client, _run, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("DEPLOYMENT_ID", "primary_deployment_id, replica_deployment_id")
+    source = tmp_path / "prompts.csv"
+    source.write_text("prompt\nHello\n")
+
+    bulk.main([str(source), "--output", str(tmp_path / "results.csv")])
+
+    deployment.get.assert_called_once_with("primary_deployment_id")
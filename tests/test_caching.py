@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from src.caching import TTLCache
+
+
+def test_cache_hit_and_miss_counters():
+    cache = TTLCache("test", ttl_seconds=60)
+    loader_calls = []
+
+    def loader():
+        loader_calls.append(1)
+        return {"id": "abc"}
+
+    first = cache.get(("deployment", "endpoint", "abc"), loader)
+    second = cache.get(("deployment", "endpoint", "abc"), loader)
+
+    # The cached object is returned as is, not a copy
+    assert first is second
+    assert len(loader_calls) == 1
+    assert (cache.stats.misses, cache.stats.hits) == (1, 1)
+
+
+def test_cache_serves_stale_value_while_refreshing():
+    cache = TTLCache("test", ttl_seconds=0, stale_seconds=60)
+    refreshed = threading.Event()
+    values = iter(["old model", "new model"])
+
+    def loader():
+        value = next(values)
+        if value == "new model":
+            refreshed.set()
+        return value
+
+    assert cache.get("deployment", loader) == "old model"
+    # Expired, the stale value is returned and reloaded in the background
+    assert cache.get("deployment", loader) == "old model"
+    assert refreshed.wait(5)
+    for _ in range(50):
+        if cache.get("deployment", lambda: "new model") == "new model":
+            break
+        time.sleep(0.01)
+    assert cache.stats.refreshes >= 1
+    assert cache.stats.stale_hits >= 1
+
+
+def test_cache_does_not_store_errors_and_evicts_least_recently_used():
+    cache = TTLCache("test", ttl_seconds=60, max_entries=2)
+
+    def failing_loader():
+        raise ValueError("capabilities unavailable")
+
+    with pytest.raises(ValueError):
+        cache.get("a", failing_loader)
+    assert cache.get("a", lambda: 1) == 1
+
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 1)
+    cache.get("c", lambda: 3)
+
+    assert cache.get("a", lambda: "reloaded") == 1
+    assert cache.get("b", lambda: "reloaded") == "reloaded"
+    assert cache.stats.evictions >= 1
+
+
+def test_cache_stores_failed_loads_for_error_ttl():
+    cache = TTLCache("test", ttl_seconds=60)
+    refreshed = threading.Event()
+
+    def failing_loader():
+        raise ConnectionError("capabilities unavailable")
+
+    def recovered_loader():
+        refreshed.set()
+        return True
+
+    assert cache.get("capabilities", failing_loader, error_value=False, error_ttl_seconds=60) is False
+    # The failure is cached, no new probe within the error TTL
+    assert cache.get("capabilities", recovered_loader, error_value=False, error_ttl_seconds=60) is False
+    assert not refreshed.is_set()
+
+    # Once the error TTL has passed the entry is re-probed in the background
+    assert cache.get("recovering", failing_loader, error_value=False, error_ttl_seconds=0) is False
+    assert cache.get("recovering", recovered_loader, error_value=False, error_ttl_seconds=0) is False
+    assert refreshed.wait(5)
+
+
+def test_cache_invalidate_discards_loads_in_flight():
+    cache = TTLCache("test", ttl_seconds=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(5)
+        return "old"
+
+    loading = threading.Thread(target=cache.get, args=("deployment", slow_loader))
+    loading.start()
+    assert started.wait(5)
+
+    cache.invalidate()
+    # A new caller does not wait for the load that was started before the invalidation
+    assert cache.get("deployment", lambda: "new") == "new"
+    release.set()
+    loading.join(5)
+    assert cache.get("deployment", lambda: "reloaded") == "new"
@@ -0,0 +1,126 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.cancellation import _start_thread, cancel_generation, close_stream, run_interruptibly, track_in_flight
+from src.streaming import StreamCollector
+from src.transport import AbortScope
+
+
+class SessionState(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+class ScriptInterrupted(BaseException):
+    """Stands in for the exception Streamlit raises to stop the script"""
+
+
+@pytest.fixture
+def session_state():
+    state = SessionState(pending_message_id="meta_id", in_flight_request=None)
+    with patch("src.cancellation.st.session_state", state):
+        yield state
+
+
+@patch("src.cancellation.set_result_message_state")
+def test_stop_closes_the_stream_and_keeps_the_partial_answer(mock_set_result, session_state):
+    collector = StreamCollector()
+    stream = MagicMock()
+
+    with pytest.raises(ScriptInterrupted), track_in_flight("meta_id", collector) as request:
+        request.stream = stream
+        collector.add("Paris is")
+        raise ScriptInterrupted()
+
+    stream.close.assert_called_once()
+    assert request.scope.aborted
+    assert session_state.in_flight_request is request
+
+    cancel_generation("meta_id")
+    mock_set_result.assert_called_once_with("meta_id", "Paris is", "CANCELLED")
+    assert session_state.in_flight_request is None
+    stream.close.assert_called_once()
+
+
+@patch("src.cancellation.set_result_message_state")
+def test_completed_request_is_unregistered(mock_set_result, session_state):
+    stream = MagicMock()
+    with track_in_flight("meta_id") as request:
+        request.stream = stream
+
+    stream.close.assert_called_once()
+    assert session_state.in_flight_request is None
+
+    # Stop clicked while a blocking request was waited for, there is no partial answer
+    cancel_generation("meta_id")
+    mock_set_result.assert_called_once_with("meta_id", None, "CANCELLED")
+
+
+@patch("src.cancellation.set_result_message_state")
+def test_stop_calls_on_cancel_after_closing_the_stream(mock_set_result, session_state):
+    collector = StreamCollector()
+    stream = MagicMock()
+    # E.g. a model comparison keeps the partial answers of every model
+    on_cancel = MagicMock(side_effect=lambda: stream.close.assert_called_once())
+
+    with pytest.raises(ScriptInterrupted), track_in_flight("meta_id", collector, on_cancel=on_cancel) as request:
+        request.stream = stream
+        collector.add("Paris")
+        raise ScriptInterrupted()
+    on_cancel.assert_not_called()
+
+    cancel_generation("meta_id")
+    on_cancel.assert_called_once_with()
+    mock_set_result.assert_called_once_with("meta_id", "Paris", "CANCELLED")
+
+
+@patch("src.cancellation.LLM_REQUEST_POLL_SECONDS", 0.01)
+def test_interrupted_wait_aborts_the_request(session_state):
+    scope = AbortScope()
+    sent = threading.Event()
+    discarded = threading.Event()
+
+    def send():
+        sent.set()
+        while not scope.aborted:
+            time.sleep(0.01)
+        return "late result"
+
+    def interrupt(*args):
+        if sent.is_set():
+            raise ScriptInterrupted()
+
+    with patch.object(SessionState, "get", side_effect=interrupt), pytest.raises(ScriptInterrupted):
+        run_interruptibly(send, discard=lambda result: discarded.set(), scope=scope)
+
+    assert scope.aborted
+    assert discarded.wait(timeout=5)
+
+
+def test_close_stream_closes_the_stream_wrapped_by_litellm():
+    wrapper = MagicMock(spec=["completion_stream"])
+    close_stream(wrapper)
+    wrapper.completion_stream.close.assert_called_once()
+
+
+def test_requests_do_not_queue_behind_each_other():
+    release = threading.Event()
+    started = []
+
+    def send():
+        started.append(threading.current_thread())
+        release.wait(timeout=5)
+
+    # Far more waiting requests than any worker pool would be sized for
+    futures = [_start_thread(send) for _ in range(100)]
+    deadline = time.monotonic() + 5
+    while len(started) < 100 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+
+    assert len(started) == 100
+    assert all(thread.daemon for thread in started)
+    assert [future.result(timeout=5) for future in futures] == [None] * 100
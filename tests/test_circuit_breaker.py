@@ -0,0 +1,115 @@
+import httpx
+import pytest
+from openai import BadRequestError
+
+from src.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail():
+    raise ConnectionError("Connection refused")
+
+
+def make_breaker(clock, **kwargs):
+    return CircuitBreaker(
+        "Deployment 1", error_rate_threshold=0.5, min_requests=4, open_seconds=30, clock=clock, **kwargs
+    )
+
+
+def test_circuit_breaker_opens_fails_fast_and_recovers_with_a_probe():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    breaker.call(lambda: "answer")
+    breaker.call(lambda: "answer")
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == STATE_CLOSED
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == STATE_OPEN
+
+    clock.now = 10
+    with pytest.raises(CircuitOpenError, match="try again in 20s"):
+        breaker.call(lambda: "answer")
+
+    # After the open period, a single probe is let through and closes the breaker
+    clock.now = 31
+    assert breaker.acquire() is True
+    assert breaker.state == STATE_HALF_OPEN
+    with pytest.raises(CircuitOpenError, match="recovering"):
+        breaker.call(lambda: "answer")
+    breaker.record(True, failed=False, latency=0.5)
+    assert breaker.state == STATE_CLOSED
+
+    stats = breaker.stats()
+    assert stats.rejected == 2
+    assert stats.times_opened == 1
+    assert stats.requests == 0
+
+
+def test_circuit_breaker_ignores_client_errors_and_reopens_after_a_failed_probe():
+    clock = FakeClock()
+    breaker = make_breaker(clock, slow_call_seconds=5)
+    response = httpx.Response(400, request=httpx.Request("POST", "https://llm.test"))
+    for _ in range(4):
+        with pytest.raises(BadRequestError):
+            breaker.call(lambda: (_ for _ in ()).throw(BadRequestError("Bad prompt", response=response, body=None)))
+    assert breaker.stats().failures == 0
+
+    # Slow calls count as failures
+    for _ in range(4):
+        breaker.record(False, failed=False, latency=6)
+    assert breaker.state == STATE_OPEN
+
+    clock.now = 31
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == STATE_OPEN
+    assert breaker.stats().times_opened == 2
+
+
+def test_guarded_stream_records_its_outcome():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    clock.now = 1
+    breaker._state = STATE_OPEN
+
+    # A probe stream closed before its first chunk leaves the breaker half-open for the next probe
+    clock.now = 40
+    stream = breaker.call_stream(lambda: iter(["Paris", " is"]))
+    stream.close()
+    assert breaker.state == STATE_HALF_OPEN
+
+    stream = breaker.call_stream(lambda: iter(["Paris", " is"]))
+    assert next(iter(stream)) == "Paris"
+    stream.close()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.stats().requests == 0
+
+
+def test_circuit_breaker_reports_its_decisions():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    decisions = []
+    breaker.call(lambda: "answer", on_decision=decisions.append)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "answer", on_decision=decisions.append)
+    clock.now = 31
+    breaker.call_stream(lambda: iter(["Paris"]), on_decision=decisions.append)
+
+    assert [(decision.admitted, decision.reason, decision.stats.state) for decision in decisions] == [
+        (True, None, STATE_CLOSED),
+        (False, "3 of 4 requests failed", STATE_OPEN),
+        (True, "3 of 4 requests failed", STATE_HALF_OPEN),
+    ]
+    assert decisions[1].stats.rejected == 1
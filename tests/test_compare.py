@@ -0,0 +1,60 @@
+import time
+
+from src.compare import ModelAnswer, stream_answers
+
+
+def slow_deltas(*deltas, delay=0.2):
+    def open_deltas(timer):
+        time.sleep(delay)
+        timer.connected()
+        yield from deltas
+
+    return open_deltas
+
+
+def failing_deltas(timer):
+    raise ConnectionError("Gateway unavailable")
+
+
+def test_stream_answers_concurrently():
+    answers = [ModelAnswer("datarobot/model-a"), ModelAnswer("datarobot/model-b"), ModelAnswer("datarobot/model-c")]
+    started = time.monotonic()
+    received = list(
+        stream_answers(answers, [slow_deltas("Paris ", "is the capital."), slow_deltas("Paris."), failing_deltas])
+    )
+    # Each model is read by its own worker, so the comparison takes as long as the slowest model
+    assert time.monotonic() - started < 0.35
+
+    texts = {}
+    for batch in received:
+        for index, text in batch.items():
+            texts[index] = texts.get(index, "") + text
+    assert texts == {0: "Paris is the capital.", 1: "Paris."}
+    assert [answer.text for answer in answers] == ["Paris is the capital.", "Paris.", ""]
+    assert answers[2].error == "Gateway unavailable"
+
+    summary = answers[0].summary()
+    assert summary["model"] == "datarobot/model-a"
+    assert summary["output_tokens"] > 0
+    assert 0.2 <= summary["time_to_first_token"] <= summary["total_time"]
+
+
+def test_stream_answers_stops_workers_when_closed():
+    closed = []
+
+    def endless_deltas(timer):
+        try:
+            while True:
+                time.sleep(0.01)
+                yield "token "
+        finally:
+            closed.append(True)
+
+    received = stream_answers([ModelAnswer("datarobot/model-a")], [endless_deltas])
+    assert next(batch for batch in received if batch) == {0: "token "}
+    received.close()
+    for _ in range(100):
+        if closed:
+            break
+        time.sleep(0.01)
+    assert closed == [True]
@@ -0,0 +1,96 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from src import context_window
+from src.context_window import RollingSummary, build_context_window, count_tokens
+
+MESSAGES = [
+    {"role": "system", "content": "Be brief."},
+    {"role": "user", "content": "one two three four"},
+    {"role": "assistant", "content": "five six seven eight"},
+    {"role": "user", "content": "nine ten"},
+    {"role": "assistant", "content": "eleven twelve"},
+    {"role": "user", "content": "thirteen"},
+]
+
+
+@pytest.fixture(autouse=True)
+def word_tokens():
+    # One token per word plus no per-message overhead keeps the budgets readable
+    with (
+        patch.object(context_window, "count_tokens", lambda text: len(text.split())),
+        patch.object(context_window, "CONTEXT_TOKENS_PER_MESSAGE", 0),
+    ):
+        yield
+
+
+def test_context_window_keeps_system_prompt_and_latest_messages():
+    window = build_context_window(MESSAGES, token_budget=8)
+
+    assert window.messages == [MESSAGES[0], MESSAGES[3], MESSAGES[4], MESSAGES[5]]
+    assert (window.tokens_sent, window.tokens_dropped, window.dropped_count) == (7, 8, 2)
+
+
+def test_context_window_does_not_start_with_an_answer():
+    window = build_context_window(MESSAGES, token_budget=5)
+
+    # "eleven twelve" would fit, but its prompt does not
+    assert window.messages == [MESSAGES[0], MESSAGES[5]]
+
+
+def test_context_window_always_sends_latest_prompt():
+    window = build_context_window(MESSAGES, token_budget=0)
+
+    assert window.messages == [MESSAGES[0], MESSAGES[5]]
+
+
+def test_context_window_summarizes_dropped_messages_in_background():
+    summary = RollingSummary()
+    summarized = []
+
+    def summarize(messages):
+        summarized.append(messages)
+        return "counted to eight"
+
+    build_context_window(MESSAGES, token_budget=8, summary=summary, summarize=summarize)
+    for _ in range(100):
+        if summary.snapshot()[1]:
+            break
+        time.sleep(0.01)
+
+    assert summary.snapshot() == ("counted to eight", 2)
+    # The dropped messages followed by the summary instruction
+    assert summarized[0][:2] == MESSAGES[1:3]
+
+    window = build_context_window(MESSAGES, token_budget=16, summary=summary)
+    assert window.messages[1]["content"].endswith("counted to eight")
+    assert window.messages[2:] == MESSAGES[3:]
+
+
+class WordEncoding:
+    def encode(self, text, disallowed_special):
+        return text.split()
+
+
+def test_count_tokens_estimates_while_the_encoding_loads():
+    loaded = threading.Event()
+
+    def get_encoding(name):
+        loaded.wait(timeout=5)
+        return WordEncoding()
+
+    with (
+        patch.object(context_window, "_encoding", None),
+        patch.object(context_window, "_encoding_loader", None),
+        patch("tiktoken.get_encoding", get_encoding),
+    ):
+        context_window._count_encoded_tokens.cache_clear()
+        # Does not wait for the (possibly hanging) download of the encoding
+        assert count_tokens("one two three four five") == 6
+        loaded.set()
+        context_window._encoding_loader.join(timeout=5)
+        assert count_tokens("one two three four five") == 5
+    context_window._count_encoded_tokens.cache_clear()
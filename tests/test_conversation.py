@@ -0,0 +1,62 @@
+from src.conversation import ConversationStore
+
+
+def test_conversation_store_indexes_turns_by_meta_id():
+    store = ConversationStore()
+    store.add_system_message("Answer briefly.")
+    store.add_prompt("first", "Hello", {"status": "pending"})
+    store.add_answer("first", "Hi!")
+    store.add_prompt("second", "How are you?", {"status": "pending"})
+
+    assert store.get_message("user", "first").content == "Hello"
+    assert store.get_message("assistant", "first").content == "Hi!"
+    assert store.get_message("assistant", "second") is None
+    assert store.get_message("user", "unknown") is None
+    assert store.get_turn("second").meta is store.meta["second"]
+
+
+def test_conversation_store_messages_behave_like_dicts():
+    store = ConversationStore()
+    store.add_prompt("first", "Hello", {})
+
+    message = store.messages[0]
+    assert message["role"] == "user"
+    assert message.get("meta_id") == "first"
+    assert message.get("citations") is None
+
+
+def test_conversation_store_visible_messages_skip_system_prompt():
+    store = ConversationStore()
+    store.add_system_message("Answer briefly.")
+    assert store.visible_messages == []
+
+    store.add_prompt("first", "Hello", {})
+    visible = store.visible_messages
+    assert [message.content for message in visible] == ["Hello"]
+    # Cached until the next message is added
+    assert store.visible_messages is visible
+    store.add_answer("first", "Hi!")
+    assert [message.content for message in store.visible_messages] == ["Hello", "Hi!"]
+
+
+def test_conversation_store_request_messages_skip_failed_turns():
+    store = ConversationStore()
+    store.add_system_message("Answer with just a number.")
+    for index, answer in enumerate(["5", None, "2.5", None]):
+        store.add_prompt(f"turn-{index}", f"Question {index}", {})
+        # The pending prompt is part of the payload until it is answered
+        assert store.request_messages[-1] == {"role": "user", "content": f"Question {index}"}
+        store.add_answer(f"turn-{index}", answer)
+
+    assert store.request_messages == (
+        {"role": "system", "content": "Answer with just a number."},
+        {"role": "user", "content": "Question 0"},
+        {"role": "assistant", "content": "5"},
+        {"role": "user", "content": "Question 2"},
+        {"role": "assistant", "content": "2.5"},
+    )
+
+    # A request keeps its payload while the conversation goes on
+    payload = store.request_messages
+    store.add_prompt("turn-4", "Question 4", {})
+    assert len(payload) == 5
@@ -0,0 +1,30 @@
+import threading
+import time
+from unittest.mock import patch
+
+from src import dr_requests
+
+
+def test_warm_up_metadata_runs_lookups_concurrently():
+    # Every lookup blocks until all three are running at the same time
+    barrier = threading.Barrier(3, timeout=5)
+    finished = []
+
+    def lookup(*args, **kwargs):
+        barrier.wait()
+        finished.append(args)
+
+    with (
+        patch.object(dr_requests, "fetch_application_info", side_effect=lookup),
+        patch.object(dr_requests, "fetch_deployment", side_effect=lookup),
+        patch.object(dr_requests, "fetch_association_id_column_name", side_effect=lambda *args: None),
+        patch.object(dr_requests, "get_has_chat_api_support", side_effect=lookup),
+    ):
+        dr_requests.warm_up_metadata("https://endpoint", "token", "deployment_id", "app_id", probe_chat_api=True)
+        for _ in range(100):
+            if len(finished) == 3:
+                break
+            time.sleep(0.05)
+
+    assert not barrier.broken
+    assert len(finished) == 3
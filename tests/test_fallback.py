@@ -0,0 +1,41 @@
+import threading
+import time
+
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError
+
+from src.circuit_breaker import CircuitOpenError
+from src.fallback import LatencySLOError, should_fall_back, within_latency_slo
+
+
+def status_error(error_class, status_code):
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://llm.test"))
+    return error_class("Upstream error", response=response, body=None)
+
+
+def test_should_fall_back_on_outages_only():
+    assert should_fall_back(CircuitOpenError("Deployment 1", 10))
+    assert should_fall_back(LatencySLOError(5))
+    assert should_fall_back(status_error(InternalServerError, 503))
+    assert not should_fall_back(status_error(BadRequestError, 400))
+
+
+def test_within_latency_slo_discards_a_late_answer():
+    release = threading.Event()
+    discarded = []
+
+    def send():
+        release.wait(timeout=5)
+        return "late answer"
+
+    assert within_latency_slo(lambda: "answer", 1) == "answer"
+    with pytest.raises(LatencySLOError, match="within 0.05s"):
+        within_latency_slo(send, 0.05, discarded.append)
+
+    release.set()
+    for _ in range(100):
+        if discarded:
+            break
+        time.sleep(0.01)
+    assert discarded == ["late answer"]
@@ -0,0 +1,53 @@
+import json
+
+import responses
+
+from src.feedback import FeedbackQueue, FeedbackTarget
+
+TARGET = FeedbackTarget(
+    endpoint="https://test-app.datarobot.com/api/v2",
+    token="token",
+    deployment_id="deployment",
+    custom_metric_id="metric",
+    model_id="model",
+)
+
+
+@responses.activate
+def test_rows_for_the_same_metric_are_merged_into_one_payload():
+    responses.post(TARGET.url, json=None)
+    queue = FeedbackQueue(flush_interval_seconds=60)
+
+    queue.submit(TARGET, {"timestamp": "2024-01-01T00:00:00", "value": 1, "associationId": "a"})
+    queue.submit(TARGET, {"timestamp": "2024-01-01T00:00:01", "value": 0, "associationId": "b"})
+    queue.flush()
+
+    assert len(responses.calls) == 1
+    body = json.loads(responses.calls[0].request.body)
+    assert body["modelId"] == "model"
+    assert [row["associationId"] for row in body["buckets"]] == ["a", "b"]
+
+
+@responses.activate
+def test_batch_is_flushed_when_size_threshold_is_reached():
+    responses.post(TARGET.url, json=None)
+    queue = FeedbackQueue(max_batch_rows=2, flush_interval_seconds=60)
+
+    queue.submit(TARGET, {"value": 1, "associationId": "a"})
+    queue.submit(TARGET, {"value": 1, "associationId": "b"})
+    queue.close()
+
+    assert len(responses.calls) == 1
+    assert len(json.loads(responses.calls[0].request.body)["buckets"]) == 2
+
+
+@responses.activate
+def test_failed_batch_is_retried():
+    responses.post(TARGET.url, status=503)
+    responses.post(TARGET.url, json=None)
+    queue = FeedbackQueue(flush_interval_seconds=60, retry_backoff_seconds=0)
+
+    queue.submit(TARGET, {"value": 1, "associationId": "a"})
+    queue.flush()
+
+    assert len(responses.calls) == 2
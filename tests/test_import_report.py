@@ -0,0 +1,36 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from src import import_report
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+def test_parse_importtime():
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       324 |        742 |   json.decoder\n"
+        "import time:       188 |       1231 | json\n"
+        "some unrelated warning\n"
+    )
+
+    timings = import_report.parse_importtime(output)
+
+    assert [(t.module, t.self_us, t.cumulative_us, t.depth) for t in timings] == [
+        ("json.decoder", 324, 742, 1),
+        ("json", 188, 1231, 0),
+    ]
+
+
+def test_app_imports_do_not_load_backend_modules():
+    """litellm and openai are only imported once the matching backend is used."""
+    modules = import_report.get_entry_point_imports()
+    code = (
+        f"import sys\nimport {', '.join(modules)}\n"
+        "print(sorted(m for m in ('litellm', 'openai', 'bulk') if m in sys.modules))"
+    )
+
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
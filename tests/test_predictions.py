@@ -0,0 +1,49 @@
+import gzip
+from unittest.mock import patch
+
+import pytest
+import responses
+
+from src import predictions
+
+PREDICTION_URL = "https://prediction-test.dynamic.orm.datarobot.com/predApi/v1.0/deployments/abc/predictions"
+
+
+def test_encode_csv_quotes_special_characters():
+    body = predictions.encode_csv([{"association_id": "1", "promptText": 'Say "hi", please'}])
+    assert body == b'association_id,promptText\n1,"Say ""hi"", please"\n'
+
+
+def test_decode_csv_cleans_column_names_and_coerces_values():
+    content = (
+        b"resultText_PREDICTION,datarobot_latency_OUTPUT,datarobot_token_count_OUTPUT,blocked_OUTPUT,action_OUTPUT\n"
+        b"42,0.52,9,False,\n"
+    )
+    rows = predictions.decode_csv(content, text_columns={"resultText"})
+    assert rows == [
+        {"resultText": "42", "datarobot_latency": 0.52, "datarobot_token_count": 9, "blocked": False, "action": None}
+    ]
+
+
+@responses.activate
+def test_large_bodies_are_gzipped():
+    responses.post(PREDICTION_URL, body=b"resultText_PREDICTION\nok\n", content_type="text/csv")
+    client = predictions.PredictionClient(PREDICTION_URL, {"Content-Type": "text/csv; charset=UTF-8"})
+
+    with patch.object(predictions, "PREDICTION_GZIP_MIN_BYTES", 10):
+        assert client.predict([{"promptText": "a long enough prompt"}]) == [{"resultText": "ok"}]
+
+    request = responses.calls[0].request
+    assert request.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(request.body) == b"promptText\na long enough prompt\n"
+
+
+def test_input_size_is_checked_on_encoded_bytes():
+    client = predictions.PredictionClient(PREDICTION_URL, {})
+
+    # Multi-byte characters count once per encoded byte, not once per character
+    with (
+        patch.object(predictions, "MAX_PREDICTION_INPUT_SIZE_BYTES", 25),
+        pytest.raises(predictions.PredictionInputTooLargeError),
+    ):
+        client.predict([{"promptText": "ü" * 8}])
@@ -1,9 +1,7 @@
 import json
-import os
-from collections import namedtuple
-from unittest.mock import patch
+import threading
+from unittest.mock import MagicMock, patch
 
-import pandas as pd
 import pytest
 import responses
 from streamlit.testing.v1 import AppTest
@@ -27,23 +25,15 @@ from .conftest import find_request_by_url, create_stream_chat_completion, create
 @patch('constants.I18N_SPLASH_TEXT', 'Ask me anything!')
 @patch('constants.I18N_INPUT_PLACEHOLDER', 'Send your question')
 def test_empty_chat_app():
-    # Path to the CSV file relative to the test file
-    current_dir = os.path.dirname(__file__)
-    csv_file_path = os.path.join(current_dir, 'mocks/prediction_response.csv')
-    dataframe_output = pd.read_csv(csv_file_path)
-    PredictionResult = namedtuple('PredictionResult', field_names=['dataframe', 'response_headers'])
-
-    with patch('datarobot_predict.deployment.predict',
-               return_value=PredictionResult(dataframe=dataframe_output, response_headers={})):
-        """The app loads and renders empty chat splash"""
-        at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
-        assert at.subheader[0].value == 'Application Test'
-        assert at.caption[0].value == 'A small example description'
-        assert at.button(key="share-button").label == 'Share'
-        assert at.text[0].value == 'What would you like to know?'
-        assert at.text[1].value == 'Ask me anything!'
-        assert at.chat_input[0].placeholder == 'Send your question'
-        assert at.session_state.is_chat_api_enabled == True
+    """The app loads and renders empty chat splash"""
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    assert at.subheader[0].value == 'Application Test'
+    assert at.caption[0].value == 'A small example description'
+    assert at.button(key="share-button").label == 'Share'
+    assert at.text[0].value == 'What would you like to know?'
+    assert at.text[1].value == 'Ask me anything!'
+    assert at.chat_input[0].placeholder == 'Send your question'
+    assert at.session_state.is_chat_api_enabled == True
 
 
 @responses.activate
@@ -58,6 +48,24 @@ def test_chat_api_supported_app():
     """The app loads and uses deployment capabilities to check for Chat API support"""
     at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
     assert at.session_state.is_chat_api_enabled == True
+    assert at.session_state.backend_path == "chat_api"
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_app_info_api",
+    "mock_version_api",
+    "mock_deployment_api",
+    "app_id"
+)
+def test_chat_api_capabilities_error_app(datarobot_endpoint, deployment_id):
+    """A failed capabilities check falls back to the Prediction API"""
+    responses.replace(responses.GET, f"{datarobot_endpoint}/deployments/{deployment_id}/capabilities/", status=404)
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    assert not at.exception
+    assert not at.session_state.is_chat_api_enabled
+    assert at.session_state.backend_path == "prediction_api"
 
 
 @responses.activate
@@ -220,9 +228,10 @@ def test_chat_api_legacy_citations(openai_create):
     "mock_set_env_disable_chat_api",
     "mock_app_info_api",
     "mock_deployment_api",
+    "mock_prediction_api",
     "mock_version_api",
 )
-def test_chat_send_predict_request():
+def test_chat_send_predict_request(prediction_endpoint):
     """The app receives chat response after sending a prompt"""
     app = AppTest.from_file("qa_chat_bot.py")
     at = app.run(timeout=10)
@@ -237,6 +246,11 @@ def test_chat_send_predict_request():
     assert at.chat_message[1].markdown[0].value == '__LLM Deployment:__'
     assert at.chat_message[1].markdown[1].value == 'Hello! How can I assist you today?'
 
+    # The prompt is sent as a CSV row along with the association id
+    prediction_request = find_request_by_url(responses.calls, prediction_endpoint)
+    msg_id = at.session_state.messages[0].get('meta_id')
+    assert prediction_request.request.body.decode() == f"association_id,promptText\n{msg_id},'Hello'\n"
+
     meta_element_value = at.chat_message[1].markdown[4].value
     # The markdown value contains html elements, so we need to check by substrings
     expected_substrings = ['Latency:', '0.52s', 'Tokens:', '9', 'Confidence:', '28.57%']
@@ -387,6 +401,9 @@ def test_chat_feedback_request(openai_create, feedback_endpoint, model_id, is_mo
     assert feedback_up_button.label == '\u2009'
     assert feedback_up_button.value is False
     feedback_up_button.click().run(timeout=10)
+    # Feedback is posted by a background worker, drain it before inspecting the request
+    from feedback import feedback_queue
+    feedback_queue.flush()
     feedback_request = find_request_by_url(responses.calls, feedback_endpoint)
     feedback_up_request_body = json.loads(feedback_request.request.body)
     if is_model_specific:
@@ -460,3 +477,195 @@ def test_vdb_metadata_filter_passed_in_streaming_request(openai_create):
 
     call_kwargs = openai_create.call_args.kwargs
     assert call_kwargs.get("extra_body") == {"metadata_filter": {"source": "federal_clean_air_act.txt"}}
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_app_info_api",
+    "mock_deployment_api",
+    "mock_version_api",
+)
+@patch("openai.resources.chat.Completions.create")
+def test_chat_api_request_routed_to_faster_replica(openai_create, monkeypatch, deployment_id):
+    """With several deployments in DEPLOYMENT_ID, prompts go to the fastest replica without feedback buttons."""
+    from router import ReplicaStats, deployment_router
+
+    monkeypatch.setenv("DEPLOYMENT_ID", f"{deployment_id}, replica_deployment_id")
+    deployment_router._replicas[deployment_id] = ReplicaStats(ewma_latency=5.0)
+    deployment_router._replicas["replica_deployment_id"] = ReplicaStats(ewma_latency=1.0)
+    openai_create.return_value = create_chat_completion('mock_chat_api_no_stream_no_citations.json')
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    assert at.session_state.deployment_id == deployment_id
+    at.chat_input[0].set_value("Tell me an interesting animal fact").run(timeout=10)
+
+    meta_id = at.session_state.messages[0].get('meta_id')
+    meta = at.session_state.messages_meta[meta_id]
+    assert meta["deployment_id"] == "replica_deployment_id"
+    assert "association_id" not in meta
+    assert at.chat_message[1].markdown[1].value.startswith("Giraffes only need to drink water")
+    assert meta["replicas"][deployment_id] == {"ewma_latency": 5.0, "in_flight": 0, "requests": 0, "hedges_won": 0}
+    assert meta["replicas"]["replica_deployment_id"]["requests"] == 1
+    footer = [markdown.value for markdown in at.chat_message[1].markdown if "info-section" in markdown.value]
+    assert '<strong class="key">Replica:</strong> replica_deployment_id (avg. ' in footer[0]
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_app_info_api",
+    "mock_deployment_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+@patch("openai.resources.chat.Completions.create")
+def test_chat_api_outage_falls_back_to_llm_gateway(openai_create, mock_litellm, monkeypatch):
+    """With FALLBACK_LLM_MODEL, a prompt the deployment can't answer is answered by the LLM Gateway."""
+    import httpx
+    from openai import APIConnectionError
+
+    monkeypatch.setenv("FALLBACK_LLM_MODEL", "azure/gpt-4o")
+    monkeypatch.setenv("LLM_MAX_ATTEMPTS", "1")
+    openai_create.side_effect = APIConnectionError(request=httpx.Request("POST", "https://deployment.test"))
+    fallback_response = MagicMock()
+    fallback_response.choices[0].message.content = "Giraffes rarely drink water."
+    mock_litellm.return_value = fallback_response
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("Tell me an interesting animal fact").run(timeout=10)
+
+    assert mock_litellm.call_args.kwargs["model"] == "datarobot/azure/gpt-4o"
+    assert at.chat_message[1].markdown[1].value == "Giraffes rarely drink water."
+    meta_id = at.session_state.messages[0].get('meta_id')
+    meta = at.session_state.messages_meta[meta_id]
+    assert meta["fallback_model"] == "datarobot/azure/gpt-4o"
+    assert any("Fallback model azure/gpt-4o" in markdown.value for markdown in at.chat_message[1].markdown)
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_app_info_api",
+    "mock_deployment_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+@patch("openai.resources.chat.Completions.create")
+def test_chat_api_context_summary_is_generated_by_the_llm_gateway(openai_create, mock_litellm, monkeypatch):
+    """The summary prompt is not sent to the deployment, where it would run retrieval and be monitored."""
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "60")
+    monkeypatch.setenv("ENABLE_CONTEXT_SUMMARY", "true")
+    openai_create.return_value = create_chat_completion('mock_chat_api_no_stream_no_citations.json')
+    summarized = threading.Event()
+
+    def summarize(**kwargs):
+        summarized.set()
+        return MagicMock(choices=[MagicMock(message=MagicMock(content="The user asked a long question."))])
+
+    mock_litellm.side_effect = summarize
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("A long first question. " * 20).run(timeout=10)
+    at.chat_input[0].set_value("Second question?").run(timeout=10)
+
+    assert summarized.wait(5)
+    assert openai_create.call_count == 2
+    assert mock_litellm.call_args.kwargs["model"] == "datarobot/azure/gpt-5-1-2025-11-13"
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_app_info_api",
+    "mock_deployment_api",
+    "mock_version_api",
+)
+def test_bulk_results_are_read_only_when_the_download_is_requested(monkeypatch):
+    """The results file of a bulk job is not loaded into memory on every rerun."""
+    from bulk import BulkResultsFile
+
+    monkeypatch.setenv("ENABLE_BULK_MODE", "true")
+    results = BulkResultsFile()
+    with open(results.path, "w") as output:
+        output.write("row_index,prompt,resultText\n0,Hello,Hi!\n")
+
+    at = AppTest.from_file("qa_chat_bot.py")
+    at.session_state.bulk_results = results
+    with patch("builtins.open", wraps=open) as mock_open:
+        at.run(timeout=10)
+        assert not at.get("download_button")
+        assert (results.path, "rb") not in [call.args for call in mock_open.call_args_list]
+
+        prepare_button = next(button for button in at.button if button.label == "Prepare results for download")
+        prepare_button.click().run(timeout=10)
+
+    assert at.get("download_button")[0].proto.label == "Download results"
+    assert (results.path, "rb") in [call.args for call in mock_open.call_args_list]
+
+
+class StalledStream:
+    """Sends `chunks`, then stalls like a model that stops answering, until the stream is closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.stalled = threading.Event()
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield from self.chunks
+        self.stalled.set()
+        self.closed.wait(timeout=10)
+
+    def close(self):
+        self.closed.set()
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env",
+    "mock_set_env_enable_chat_api_streaming",
+    "mock_app_info_api",
+    "mock_deployment_api",
+    "mock_version_api",
+)
+@patch("openai.resources.chat.Completions.create")
+def test_stop_button_interrupts_the_stream(openai_create):
+    """Clicking Stop while the model stalls closes the stream and keeps the partial answer."""
+    from streamlit.runtime.scriptrunner_utils.script_requests import RerunData
+    from streamlit.testing.v1.element_tree import parse_tree_from_messages
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    stream = StalledStream(create_stream_chat_completion(['mock_initial_chunk.json', 'mock_delta_chunk.json']))
+    openai_create.return_value = stream
+    runners = []
+
+    class RecordingScriptRunner(LocalScriptRunner):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            runners.append(self)
+
+    def click_stop_once_stalled():
+        # Clicks Stop the way a browser does, while the script is still running
+        assert stream.stalled.wait(timeout=10)
+        runner = runners[-1]
+        tree = parse_tree_from_messages(runner.forward_msgs())
+        stop_button = next(button for button in tree.button if button.label == "Stop").click()
+        # A click on a button rendered within a fragment only reruns that fragment
+        fragment_id = next(
+            msg.delta.fragment_id for msg in runner.forward_msgs() if msg.delta.new_element.button.id == stop_button.id
+        )
+        runner.request_rerun(RerunData(widget_states=tree.get_widget_states(), fragment_id=fragment_id or None))
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    clicker = threading.Thread(target=click_stop_once_stalled)
+    clicker.start()
+    with patch("streamlit.testing.v1.app_test.LocalScriptRunner", RecordingScriptRunner):
+        at.chat_input[0].set_value('Tell me a joke').run(timeout=10)
+    clicker.join(timeout=10)
+
+    assert stream.closed.is_set()
+    assert at.session_state.pending_message_id is None
+    answer = at.session_state.messages[-1]
+    assert answer["content"] == "Why don't scientists trust atoms? Because they make up everything."
+    assert at.session_state.messages_meta[answer["meta_id"]]["status"] == "CANCELLED"
@@ -85,6 +85,35 @@ def test_llm_gateway_streaming(mock_litellm):
     assert at.chat_message[0].markdown[1].value == "What is the capital of France?"
     assert at.chat_message[1].markdown[1].value == "Paris is the capital of France."
 
+    meta_id = at.session_state.messages[0].get("meta_id")
+    meta = at.session_state.messages_meta[meta_id]
+    assert 0 < meta["connect_time"] <= meta["time_to_first_token"] <= meta["total_time"]
+    assert meta["inter_token_p50"] <= meta["inter_token_p95"]
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_set_env_enable_chat_api_streaming",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_streaming_blocks(mock_litellm):
+    """Gateway mode: a streamed answer is rendered as one markdown element per paragraph or code block."""
+    mock_litellm.return_value = _mock_stream(
+        "Use a loop:\n\n```python\nfor", " i in range(3):\n", "    print(i)\n```\n\nDone."
+    )
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("How do I print 0 to 2?").run(timeout=10)
+
+    assert [markdown.value for markdown in at.chat_message[1].markdown[1:4]] == [
+        "Use a loop:",
+        "```python\nfor i in range(3):\n    print(i)\n```",
+        "Done.",
+    ]
+
 
 @responses.activate
 @pytest.mark.usefixtures(
@@ -101,3 +130,218 @@ def test_llm_gateway_error(mock_litellm):
     at.chat_input[0].set_value("Hello").run(timeout=10)
 
     assert at.chat_message[1].error[0].value == "LLM Gateway error: Gateway unavailable"
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_context_token_budget(mock_litellm, monkeypatch):
+    """Gateway mode: history beyond CONTEXT_TOKEN_BUDGET is not sent, the saving is recorded."""
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "60")
+    mock_litellm.return_value = _mock_completion("An answer. " * 20)
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("A long first question. " * 20).run(timeout=10)
+    at.chat_input[0].set_value("Second question?").run(timeout=10)
+
+    sent_messages = mock_litellm.call_args.kwargs["messages"]
+    assert sent_messages == [{"role": "user", "content": "Second question?"}]
+
+    meta_id = at.session_state.messages[2].get("meta_id")
+    meta = at.session_state.messages_meta[meta_id]
+    assert meta["context_tokens_sent"] > 0
+    assert meta["context_tokens_dropped"] > meta["context_tokens_sent"]
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_response_cache(mock_litellm, monkeypatch):
+    """Gateway mode: with ENABLE_RESPONSE_CACHE, a question asked again is answered without the LLM."""
+    monkeypatch.setenv("ENABLE_RESPONSE_CACHE", "true")
+    mock_litellm.return_value = _mock_completion("The capital of France is Paris.")
+
+    first_session = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    first_session.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+    second_session = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    second_session.chat_input[0].set_value("What is the capital of  France?").run(timeout=10)
+
+    assert mock_litellm.call_count == 1
+    assert second_session.chat_message[1].markdown[1].value == "The capital of France is Paris."
+    first_meta_id = first_session.session_state.messages[0].get("meta_id")
+    second_meta_id = second_session.session_state.messages[0].get("meta_id")
+    assert "cached" not in first_session.session_state.messages_meta[first_meta_id]
+    assert second_session.session_state.messages_meta[second_meta_id]["cached"] is True
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_set_env_enable_chat_api_streaming",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_streaming_request_coalescing(mock_litellm, monkeypatch):
+    """Gateway mode: with ENABLE_REQUEST_COALESCING, the stream is opened outside of the script thread."""
+    monkeypatch.setenv("ENABLE_REQUEST_COALESCING", "true")
+    mock_litellm.return_value = _mock_stream("Paris ", "is the capital ", "of France.")
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+
+    assert mock_litellm.call_args.kwargs["model"] == at.session_state.llm_gateway_model
+    assert at.chat_message[1].markdown[1].value == "Paris is the capital of France."
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_retries_rate_limit(mock_litellm):
+    """Gateway mode: a rate limited request is retried after Retry-After, the retry is recorded."""
+    import httpx
+    import litellm
+
+    rate_limit_response = httpx.Response(
+        429, headers={"retry-after": "0"}, request=httpx.Request("POST", "https://gateway.test")
+    )
+    mock_litellm.side_effect = [
+        litellm.RateLimitError("Too many requests", "datarobot", "model", response=rate_limit_response),
+        _mock_completion("The capital of France is Paris."),
+    ]
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+
+    assert at.chat_message[1].markdown[1].value == "The capital of France is Paris."
+    assert mock_litellm.call_args.kwargs["max_retries"] == 0
+    meta_id = at.session_state.messages[0].get("meta_id")
+    [retry] = at.session_state.messages_meta[meta_id]["retries"]
+    assert retry["attempt"] == 1
+    assert retry["status_code"] == 429
+    assert retry["delay_seconds"] == 0
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_circuit_breaker_fails_fast(mock_litellm, monkeypatch):
+    """Gateway mode: once the circuit breaker opened, prompts fail without calling the gateway."""
+    monkeypatch.setenv("ENABLE_CIRCUIT_BREAKER", "true")
+    monkeypatch.setenv("CIRCUIT_BREAKER_MIN_REQUESTS", "1")
+    mock_litellm.side_effect = Exception("Gateway unavailable")
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("Hello").run(timeout=10)
+    at.chat_input[0].set_value("Hello again").run(timeout=10)
+
+    assert mock_litellm.call_count == 1
+    assert (
+        at.chat_message[3]
+        .error[0]
+        .value.startswith("LLM Gateway error: LLM Gateway model datarobot/azure/gpt-5-1-2025-11-13 is failing")
+    )
+    first_meta_id, second_meta_id = (message["meta_id"] for message in at.session_state.messages[::2])
+    [admitted] = at.session_state.messages_meta[first_meta_id]["circuit_breakers"]
+    assert (admitted["admitted"], admitted["reason"], admitted["stats"]["state"]) == (True, None, "closed")
+    [rejected] = at.session_state.messages_meta[second_meta_id]["circuit_breakers"]
+    assert (rejected["admitted"], rejected["reason"]) == (False, "1 of 1 requests failed")
+    assert rejected["stats"]["state"] == "open"
+    assert rejected["stats"]["rejected"] == 1
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_circuit_breaker_state_in_info_footer(mock_litellm, monkeypatch):
+    """Gateway mode: the state of the circuit breaker that admitted the request is shown with the answer."""
+    monkeypatch.setenv("ENABLE_CIRCUIT_BREAKER", "true")
+    mock_litellm.return_value = _mock_completion("The capital of France is Paris.")
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+
+    footer = [markdown.value for markdown in at.chat_message[1].markdown if "info-section" in markdown.value]
+    assert '<strong class="key">Circuit breaker:</strong> Closed' in footer[0]
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.completion")
+def test_llm_gateway_compare_models(mock_litellm):
+    """Gateway mode: in compare mode a prompt is answered by every selected model side by side."""
+    streams = {
+        "datarobot/model-a": ["Paris ", "is the capital."],
+        "datarobot/model-b": ["Paris."],
+    }
+    mock_litellm.side_effect = lambda model, **kwargs: _mock_stream(*streams[model])
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.session_state.llm_compare_models = list(streams)
+    at.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+
+    assert {call.kwargs["model"] for call in mock_litellm.call_args_list} == set(streams)
+    columns = at.chat_message[1].columns
+    assert [markdown.value for markdown in columns[0].markdown[:2]] == ["**model-a**", "Paris is the capital."]
+    assert [markdown.value for markdown in columns[1].markdown[:2]] == ["**model-b**", "Paris."]
+
+    meta_id = at.session_state.messages[0].get("meta_id")
+    meta = at.session_state.messages_meta[meta_id]
+    assert [answer["model"] for answer in meta["comparison"]] == list(streams)
+    assert all(answer["output_tokens"] > 0 and answer["time_to_first_token"] for answer in meta["comparison"])
+    # The first model continues the conversation
+    assert at.session_state.messages[1]["content"] == "Paris is the capital."
+
+
+@responses.activate
+@pytest.mark.usefixtures(
+    "mock_set_env_llm_gateway",
+    "mock_set_env_enable_chat_api_streaming",
+    "mock_app_info_api",
+    "mock_version_api",
+)
+@patch("litellm.acompletion")
+def test_llm_gateway_streaming_async_engine(mock_acompletion, monkeypatch):
+    """Gateway mode: with USE_ASYNC_ENGINE, the answer is streamed from litellm.acompletion on the shared loop."""
+    monkeypatch.setenv("USE_ASYNC_ENGINE", "true")
+
+    async def acompletion(**kwargs):
+        async def stream():
+            for chunk in _mock_stream("Paris ", "is the capital ", "of France."):
+                yield chunk
+
+        return stream()
+
+    mock_acompletion.side_effect = acompletion
+
+    at = AppTest.from_file("qa_chat_bot.py").run(timeout=10)
+    at.chat_input[0].set_value("What is the capital of France?").run(timeout=10)
+
+    assert mock_acompletion.call_args.kwargs["stream"] is True
+    assert at.chat_message[1].markdown[1].value == "Paris is the capital of France."
+    meta_id = at.session_state.messages[0].get("meta_id")
+    assert at.session_state.messages_meta[meta_id]["time_to_first_token"] > 0
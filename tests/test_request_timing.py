@@ -0,0 +1,50 @@
+from unittest.mock import patch
+
+import pytest
+
+from src.request_timing import RequestTimer, percentile
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def test_percentile_uses_nearest_rank():
+    values = [0.4, 0.1, 0.3, 0.2]
+    assert percentile(values, 0.5) == 0.2
+    assert percentile(values, 0.95) == 0.4
+    assert percentile([0.7], 0.5) == 0.7
+
+
+@patch("src.request_timing.count_tokens", side_effect=word_count)
+def test_streaming_request_timings(_):
+    clock = iter([10.0, 10.2, 10.5, 10.6, 11.0, 11.1])
+    timer = RequestTimer(clock=lambda: next(clock))
+    timer.connected()
+    for delta in ["Paris", " is", " nice"]:
+        timer.delta(delta)
+    timer.finish()
+
+    timings = timer.summary("Paris is nice")
+
+    assert timings["connect_time"] == pytest.approx(0.2)
+    assert timings["time_to_first_token"] == pytest.approx(0.5)
+    assert timings["inter_token_p50"] == pytest.approx(0.1)
+    assert timings["inter_token_p95"] == pytest.approx(0.4)
+    assert timings["total_time"] == pytest.approx(1.1)
+    # Two tokens after the first delta, in half a second
+    assert timings["output_tokens_per_second"] == pytest.approx(4.0)
+    assert "request_started_at" in timings
+
+
+@patch("src.request_timing.count_tokens", side_effect=word_count)
+def test_non_streaming_request_timings(_):
+    clock = iter([10.0, 12.0])
+    timer = RequestTimer(clock=lambda: next(clock))
+    timer.finish()
+
+    timings = timer.summary("The capital of France is Paris.")
+
+    assert timings["total_time"] == 2.0
+    assert timings["output_tokens_per_second"] == 3.0
+    assert not {"connect_time", "time_to_first_token", "inter_token_p50"} & timings.keys()
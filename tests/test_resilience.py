@@ -0,0 +1,98 @@
+import httpx
+import pytest
+from openai import APIConnectionError, BadRequestError, RateLimitError
+
+from src.resilience import Deadlines, RetryPolicy, call_with_retries, get_retry_after, parse_duration
+
+REQUEST = httpx.Request("POST", "https://llm.test/chat/completions")
+
+
+def status_error(error_class, status_code, headers=None):
+    response = httpx.Response(status_code, headers=headers, request=REQUEST)
+    return error_class("Upstream error", response=response, body=None)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_get_retry_after_reads_retry_and_rate_limit_headers():
+    assert get_retry_after({"retry-after-ms": "250"}) == 0.25
+    assert get_retry_after({"retry-after": "3"}) == 3
+    assert get_retry_after({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m30s"}) == 90
+    # Limits that haven't run out don't delay the retry
+    assert get_retry_after({"x-ratelimit-remaining-tokens": "10", "x-ratelimit-reset-tokens": "6s"}) is None
+    assert get_retry_after(httpx.Headers({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("soon") is None
+
+
+def test_call_with_retries_paces_retries_and_records_them():
+    clock = FakeClock()
+    errors = [
+        status_error(RateLimitError, 429, {"retry-after": "2"}),
+        APIConnectionError(request=REQUEST),
+    ]
+    timeouts = []
+    retries = []
+
+    def send(timeout):
+        timeouts.append(timeout)
+        if errors:
+            raise errors.pop(0)
+        return "answer"
+
+    result = call_with_retries(
+        send,
+        RetryPolicy(max_attempts=3, backoff_seconds=1, max_backoff_seconds=1),
+        Deadlines(connect_seconds=1, read_seconds=30, total_seconds=60),
+        retries.append,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+    assert result == "answer"
+    assert [retry.status_code for retry in retries] == [429, None]
+    assert clock.sleeps[0] == 2
+    assert 0 <= clock.sleeps[1] <= 1
+    assert timeouts[0].connect == 1
+    assert timeouts[0].read == 30
+
+
+@pytest.mark.parametrize(
+    "error, max_attempts, total_seconds",
+    [
+        # Not transient
+        (status_error(BadRequestError, 400), 3, 60),
+        # Attempts used up
+        (status_error(RateLimitError, 429), 1, 60),
+        # The server asks to wait past the deadline
+        (status_error(RateLimitError, 429, {"retry-after": "120"}), 3, 60),
+    ],
+)
+def test_call_with_retries_raises_when_not_retrying(error, max_attempts, total_seconds):
+    clock = FakeClock()
+    retries = []
+
+    def send(timeout):
+        raise error
+
+    with pytest.raises(type(error)):
+        call_with_retries(
+            send,
+            RetryPolicy(max_attempts=max_attempts),
+            Deadlines(connect_seconds=1, read_seconds=30, total_seconds=total_seconds),
+            retries.append,
+            clock=clock,
+            sleep=clock.sleep,
+        )
+    assert retries == []
@@ -0,0 +1,53 @@
+from unittest.mock import patch
+
+from src.response_cache import CachedResponse, ResponseCache, make_cache_key
+
+
+def test_make_cache_key_normalizes_whitespace():
+    messages = [{"role": "user", "content": "What is  the\ncapital of France? "}]
+    same_messages = [{"role": "user", "content": "What is the capital of France?"}]
+
+    assert make_cache_key("chat_api", ["deployment", "model"], messages) == make_cache_key(
+        "chat_api", ["deployment", "model"], same_messages
+    )
+
+
+def test_make_cache_key_depends_on_target_and_filters():
+    messages = [{"role": "user", "content": "What is the capital of France?"}]
+    key = make_cache_key("chat_api", ["deployment", "model"], messages)
+
+    assert key != make_cache_key("chat_api", ["deployment", "new_model"], messages)
+    assert key != make_cache_key("chat_api", ["deployment", "model"], messages, {"source": "report.txt"})
+    assert key != make_cache_key("chat_api", ["deployment", "model"], [*messages, {"role": "user", "content": "?"}])
+
+
+def test_response_cache_expires_entries():
+    cache = ResponseCache(ttl_seconds=10, max_entries=10, max_bytes=1024)
+    with patch("src.response_cache.time.monotonic", return_value=100):
+        cache.put("key", CachedResponse("Paris"))
+        assert cache.get("key") == CachedResponse("Paris")
+    with patch("src.response_cache.time.monotonic", return_value=110):
+        assert cache.get("key") is None
+
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.expirations) == (1, 1, 1)
+    assert len(cache) == 0
+
+
+def test_response_cache_evicts_least_recently_used_within_bounds():
+    cache = ResponseCache(ttl_seconds=10, max_entries=2, max_bytes=10)
+    cache.put("a", CachedResponse("aaaa"))
+    cache.put("b", CachedResponse("bbbb"))
+    cache.get("a")
+    # Exceeds the entry count, "b" is the least recently used
+    cache.put("c", CachedResponse("cc"))
+    assert cache.get("b") is None
+    # Exceeds the memory bound
+    cache.put("d", CachedResponse("dddddd"))
+    assert cache.get("a") is None
+    assert cache.get("c") == CachedResponse("cc")
+    assert cache.size_bytes == 8
+    # Larger than the whole cache, never stored
+    cache.put("e", CachedResponse("e" * 11))
+    assert cache.get("e") is None
+
+    assert cache.stats.evictions == 2
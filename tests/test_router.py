@@ -0,0 +1,58 @@
+import threading
+import time
+
+from src.router import DeploymentRouter, PrimedStream, ReplicaStats
+
+HEDGE_MIN_SAMPLES = 20
+
+
+def test_router_prefers_the_replica_with_the_lowest_expected_wait():
+    router = DeploymentRouter()
+    # Unknown replicas are tried in the listed order
+    assert router.choose(["a", "b"]) == "a"
+
+    router._replicas["a"] = ReplicaStats(ewma_latency=2.0)
+    router._replicas["b"] = ReplicaStats(ewma_latency=1.0, in_flight=1)
+    assert router.choose(["a", "b"]) == "a"
+    router._replicas["b"].in_flight = 0
+    assert router.choose(["a", "b"]) == "b"
+    # A new replica is assumed to be as fast as the fastest one
+    assert router.choose(["a", "c"]) == "c"
+
+    result, deployment_id = router.send(["a", "b"], lambda deployment_id: f"answer of {deployment_id}")
+    assert (result, deployment_id) == ("answer of b", "b")
+    stats = router.stats()["b"]
+    assert stats.requests == 1
+    assert stats.in_flight == 0
+    assert stats.ewma_latency < 1.0
+
+
+def test_router_hedges_a_slow_request_and_discards_the_loser():
+    router = DeploymentRouter()
+    router._replicas["a"] = ReplicaStats(ewma_latency=0.01)
+    router._replicas["a"].latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+    release_a = threading.Event()
+    discarded = []
+
+    def send_to(deployment_id):
+        if deployment_id == "a":
+            release_a.wait(timeout=5)
+        return f"answer of {deployment_id}"
+
+    result, deployment_id = router.send(["a", "b"], send_to, hedge=True, discard=discarded.append)
+    assert (result, deployment_id) == ("answer of b", "b")
+    assert router.stats()["b"].hedges_won == 1
+
+    release_a.set()
+    for _ in range(100):
+        if discarded:
+            break
+        time.sleep(0.01)
+    assert discarded == ["answer of a"]
+
+
+def test_primed_stream_reads_up_to_the_first_token():
+    chunks = iter(["", "", "Paris", " is"])
+    stream = PrimedStream(chunks, has_token=bool)
+    assert next(chunks) == " is"
+    assert list(stream) == ["", "", "Paris"]
@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.singleflight import SingleFlight, SingleFlightStats
+
+
+def test_do_shares_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    joined = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    class JoinedStats(SingleFlightStats):
+        def __setattr__(self, name, value):
+            super().__setattr__(name, value)
+            if name == "shared" and value:
+                joined.set()
+
+    single_flight.stats = JoinedStats()
+
+    def send():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(single_flight.do, "key", send)
+        started.wait(5)
+        follower = executor.submit(single_flight.do, "key", send)
+        assert joined.wait(5)
+        release.set()
+
+        assert leader.result() == ("answer", False)
+        assert follower.result() == ("answer", True)
+    assert len(calls) == 1
+    # The call is forgotten once it completed
+    assert single_flight.do("key", lambda: "new answer") == ("new answer", False)
+
+
+def test_stream_replays_chunks_to_late_subscribers():
+    single_flight = SingleFlight()
+    first_chunk_sent = threading.Event()
+    release = threading.Event()
+
+    def open_stream():
+        yield "Paris "
+        first_chunk_sent.set()
+        release.wait(5)
+        yield "is the capital."
+
+    leader, leader_is_shared = single_flight.stream("key", open_stream)
+    assert next(leader) == "Paris "
+    first_chunk_sent.wait(5)
+    follower, follower_is_shared = single_flight.stream("key", open_stream)
+    release.set()
+
+    assert list(leader) == ["is the capital."]
+    assert list(follower) == ["Paris ", "is the capital."]
+    assert (leader_is_shared, follower_is_shared) == (False, True)
+    assert single_flight.stats.calls == 1
+
+
+def test_stream_errors_reach_every_subscriber_and_abandoned_streams_are_closed():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_stream():
+        release.wait(5)
+        raise ConnectionError("upstream closed")
+
+    leader, _ = single_flight.stream("failing", failing_stream)
+    follower, _ = single_flight.stream("failing", failing_stream)
+    release.set()
+    for subscriber in (leader, follower):
+        with pytest.raises(ConnectionError):
+            list(subscriber)
+
+    closed = threading.Event()
+
+    def endless_stream():
+        try:
+            while True:
+                yield "chunk"
+        finally:
+            closed.set()
+
+    chunks, _ = single_flight.stream("endless", endless_stream)
+    next(chunks)
+    chunks.close()
+    assert closed.wait(5)
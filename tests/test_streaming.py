@@ -0,0 +1,89 @@
+import threading
+from itertools import count
+
+import pytest
+
+from src.streaming import MarkdownBlockStream, batch_deltas, read_in_background, split_markdown_blocks
+
+
+def test_batch_deltas_flushes_on_interval_and_size():
+    # Each delta arrives 10ms after the previous one
+    clock = (tick / 100 for tick in count())
+    deltas = ["The", " capital", " of", " France", " is", " Paris", ".", " A very long sentence follows."]
+
+    chunks = list(batch_deltas(deltas, flush_interval_ms=25, flush_chars=20, clock=lambda: next(clock)))
+
+    # The first delta is sent right away, later ones every 25ms or 20 characters, the rest when the stream ends
+    assert chunks == ["The", " capital of France", " is Paris.", " A very long sentence follows."]
+    assert "".join(chunks) == "".join(deltas)
+
+
+def test_batch_deltas_flushes_buffered_text_while_the_source_stalls():
+    resume = threading.Event()
+
+    def stalling_deltas():
+        yield "The"
+        yield " answer"
+        # The model stalls until the buffered text was flushed
+        resume.wait(5)
+        yield " is 42."
+
+    # Like the streaming send functions, pass on an empty heartbeat while no delta arrives
+    deltas = (delta or "" for delta in read_in_background(stalling_deltas(), poll_seconds=0.01))
+    chunks = batch_deltas(deltas, flush_interval_ms=50, flush_chars=100)
+
+    assert next(chunks) == "The"
+    assert next(chunks) == " answer"
+    resume.set()
+    assert list(chunks) == [" is 42."]
+
+
+def test_read_in_background_raises_errors_of_the_source():
+    def failing_chunks():
+        yield "first"
+        raise ConnectionError("Stream interrupted")
+
+    chunks = read_in_background(failing_chunks(), poll_seconds=1)
+    assert next(chunks) == "first"
+    with pytest.raises(ConnectionError, match="Stream interrupted"):
+        next(chunks)
+
+
+def test_markdown_block_stream_commits_finished_blocks():
+    text = "# Title\n\n- item\n\n  continued\n- other\n\n```python\nx = 1\n\ny = 2\n```\nDone.\n\n\nLast"
+    blocks = MarkdownBlockStream()
+
+    finished = []
+    for index in range(0, len(text), 4):
+        finished.extend(blocks.feed(text[index : index + 4]))
+        # Everything received so far is either finished or part of the open block
+        assert "\n\n".join([*finished, blocks.open_block]).replace("\n", "") in text.replace("\n", "")
+    finished.extend(blocks.close())
+
+    assert finished == [
+        "# Title",
+        "- item\n\n  continued\n- other",
+        "```python\nx = 1\n\ny = 2\n```",
+        "Done.",
+        "Last",
+    ]
+    assert finished == split_markdown_blocks(text)
+
+
+def test_markdown_block_stream_keeps_loose_lists_in_one_block():
+    text = "Steps:\n\n1. Install\n\n   Run `pip install`.\n\n1. Configure\n\n1. Start\n\n- other list\n\nDone."
+    blocks = MarkdownBlockStream()
+
+    finished = []
+    for index in range(0, len(text), 3):
+        finished.extend(blocks.feed(text[index : index + 3]))
+    finished.extend(blocks.close())
+
+    # Rendered separately, every item would start a new list numbered 1
+    assert finished == [
+        "Steps:",
+        "1. Install\n\n   Run `pip install`.\n\n1. Configure\n\n1. Start",
+        "- other list",
+        "Done.",
+    ]
+    assert finished == split_markdown_blocks(text)
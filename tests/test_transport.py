@@ -0,0 +1,118 @@
+import socket
+import threading
+
+import httpx
+import pytest
+import responses
+
+from src import transport
+from src.config import get_config
+
+
+@pytest.fixture
+def stalled_server():
+    """A server that accepts requests and never answers them."""
+    server = socket.create_server(("127.0.0.1", 0))
+    connections = []
+    received = threading.Event()
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            connections.append(connection)
+            connection.recv(65536)
+            received.set()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/", connections, received
+    server.close()
+    for connection in connections:
+        connection.close()
+
+
+def abort_once_received(send, received):
+    """Call `send` within an abort scope, abort it once the server received the request and return the error."""
+    scope = transport.AbortScope()
+    errors = []
+
+    def run():
+        with transport.abortable(scope):
+            try:
+                send()
+            except Exception as exc:
+                errors.append(exc)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert received.wait(timeout=5)
+    scope.abort()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    return errors[0]
+
+
+def test_get_openai_client_is_shared_per_base_url_and_token():
+    base_url = "https://test-app.datarobot.com/api/v2/deployments/abc"
+    client = transport.get_openai_client(base_url, "token-1")
+
+    assert transport.get_openai_client(base_url, "token-1") is client
+    assert transport.get_openai_client(base_url, "token-2") is not client
+    assert transport.get_openai_client(f"{base_url}-other", "token-1") is not client
+    assert str(client.base_url).rstrip("/") == base_url
+
+
+def test_get_async_openai_client_is_shared_per_base_url_and_token():
+    base_url = "https://test-app.datarobot.com/api/v2/deployments/abc"
+    client = transport.get_async_openai_client(base_url, "token-1")
+
+    assert transport.get_async_openai_client(base_url, "token-1") is client
+    assert transport.get_async_openai_client(base_url, "token-2") is not client
+    assert client is not transport.get_openai_client(base_url, "token-1")
+    assert client.max_retries == 0
+
+
+@responses.activate
+def test_request_retries_on_retryable_status():
+    url = "https://test-app.datarobot.com/api/v2/deployments/abc/capabilities/"
+    responses.get(url, status=503, headers={"Retry-After": "0"})
+    responses.get(url, json={"data": []})
+
+    response = transport.request("GET", url, timeout=1)
+
+    assert response.status_code == 200
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_request_does_not_retry_post():
+    url = "https://test-app.datarobot.com/api/v2/deployments/abc/customMetrics/def/fromJSON/"
+    responses.post(url, status=503)
+    responses.post(url, json=None)
+
+    response = transport.request("POST", url, timeout=1, data="{}")
+
+    assert response.status_code == 503
+    assert len(responses.calls) == 1
+
+
+def test_abort_wakes_an_openai_request_waiting_for_the_response(stalled_server):
+    url, connections, received = stalled_server
+    http_client = transport._build_http_client(get_config())
+
+    error = abort_once_received(lambda: http_client.post(url, timeout=30), received)
+
+    # Depending on whether the client was already waiting for the response
+    assert isinstance(error, (httpx.HTTPError, transport.RequestAborted))
+    assert len(connections) == 1
+
+
+def test_abort_wakes_a_rest_request_waiting_for_the_response_without_retrying_it(stalled_server):
+    url, connections, received = stalled_server
+
+    error = abort_once_received(lambda: transport.request("POST", url, 30, retry_all_methods=True, data="{}"), received)
+
+    assert isinstance(error, transport.RequestAborted)
+    assert len(connections) == 1
@@ -1,23 +1,11 @@
-from src import utils
+from src.config import get_config
 
 
-def test_sanitize_messages_for_request():
-    """Test when the input has no dollar signs."""
-    input = [
-        {"role": "system", "content": "Answer with just a number."},
-        {"role": "user", "content": "What is 2+3?", "some_other_value": False, "meta_id": '123-321'},
-        {"role": "assistant", "content": "5", "meta_id": '123-321'},
-        {"role": "user", "content": "Now multiply the result by 4.", "meta_id": '987-321'},
-        {"role": "assistant", "content": None, "meta_id": '987-321'},
-        {"role": "user", "content": "Now divide the result by 2.", "meta_id": '444-666'},
-        {"role": "assistant", "content": "2.5", "meta_id": '444-666'},
-    ]
+def test_get_config_is_parsed_again_only_when_the_environment_changes(monkeypatch):
+    monkeypatch.setenv("APP_NAME", "First App")
+    config = get_config()
+    assert get_config() is config
+    assert config.app_name == "First App"
 
-    expected_output = [
-        {"role": "system", "content": "Answer with just a number."},
-        {"role": "user", "content": "What is 2+3?"},
-        {"role": "assistant", "content": "5"},
-        {"role": "user", "content": "Now divide the result by 2."},
-        {"role": "assistant", "content": "2.5"},
-    ]
-    assert utils.sanitize_messages_for_request(input) == expected_output
\ No newline at end of file
+    monkeypatch.setenv("APP_NAME", "Second App")
+    assert get_config().app_name == "Second App"